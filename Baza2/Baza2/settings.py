@@ -40,6 +40,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'recipes.metrics.MetricsMiddleware',
+    'recipes.routing.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -80,9 +82,57 @@ DATABASES = {
         'PASSWORD': 'coderslab',
         'HOST': 'localhost',
         'PORT': '5432',
+        # połączenie zostaje otwarte między żądaniami i jest sprawdzane przed ponownym użyciem
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Repliki tylko do odczytu dla widoków oznaczonych recipes.routing.replica_reads, np.:
+# DATABASES['replica'] = {**DATABASES['default'], 'HOST': 'replica.local', 'TEST': {'MIRROR': 'default'}}
+# DATABASE_REPLICAS = ['replica']
+# Lokalnie replikę może udawać kopia pliku bazy SQLite, aktualizowana ręcznie.
+DATABASE_ROUTERS = ['recipes.routing.PrimaryReplicaRouter']
+DATABASE_REPLICAS = []
+# przez tyle sekund po zapisie użytkownik czyta z bazy głównej, żeby widział własne zmiany
+DATABASE_PRIMARY_STICKY_SECONDS = 10
+# replika, z którą nie udało się połączyć, jest pomijana przez tyle sekund
+DATABASE_REPLICA_RETRY = 30
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# Pamięć podręczna stron przepisów działa z pamięcią procesu; przy kilku procesach
+# można użyć 'django.core.cache.backends.filebased.FileBasedCache' z LOCATION w katalogu.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'recipes',
+    }
+}
+
+RECIPE_CACHE_TIMEOUT = 60 * 60
+
+# część ETagu stron HTML; zwiększ po zmianie szablonów, żeby przeglądarki pobrały strony od nowa
+PAGE_ETAG_VERSION = 1
+
+# zadania w tle (indeks wyszukiwania, podobne przepisy) wykonuje `manage.py run_worker`;
+# TASKS_EAGER = True wykonuje je od razu po zatwierdzeniu transakcji, bez kolejki
+TASKS_EAGER = False
+TASKS_MAX_ATTEMPTS = 5
+TASKS_RETRY_DELAY = 10
+TASKS_LOCK_TIMEOUT = 600
+
+# nowe komentarze z innych procesów strumień SSE znajduje, odpytując bazę co tyle sekund (0 wyłącza)
+LIVE_COMMENTS_POLL_INTERVAL = 1.0
+LIVE_COMMENTS_KEEPALIVE = 15
+
+# przepisy i konta usunięte przez użytkowników polecenie purge_deleted usuwa na stałe po tylu dniach
+DELETED_RETENTION_DAYS = 7
+
+# adresy, z których Prometheus może pobierać /metrics bez logowania
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -116,10 +166,22 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/5.0/howto/static-files/
 
 STATIC_URL = 'static/'
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+# collectstatic dodaje do nazw plików sumę treści i zapisuje obok warianty .gz i .br
+# (.br tylko z zainstalowanym pakietem brotli); wysyła je widok recipes.assets.static_asset
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'recipes.assets.CompressedManifestStaticFilesStorage'},
+}
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# przesyłane pliki trafiają kawałkami do pliku tymczasowego, a nie do pamięci
+FILE_UPLOAD_HANDLERS = ['recipes.photos.HashingUploadHandler']
+PHOTO_MAX_UPLOAD_SIZE = 20 * 1024 * 1024
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
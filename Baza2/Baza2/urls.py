@@ -17,9 +17,10 @@ Including another URLconf
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.contrib.auth import views as auth_views
 from recipes import views as recipe_views
+from recipes.assets import static_asset
 
 
 urlpatterns = [
@@ -28,5 +29,6 @@ urlpatterns = [
     path('accounts/login/', auth_views.LoginView.as_view(), name='login'),
     path('accounts/logout/', auth_views.LogoutView.as_view(next_page='login'), name='logout'),
     path('register/', recipe_views.register, name='register'),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT) + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
+    re_path(rf'^{settings.STATIC_URL.strip("/")}/(?P<path>.+)$', static_asset, name='static_asset'),
+] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 
@@ -0,0 +1,130 @@
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, F, Max
+from django.http import Http404, HttpResponse
+from django.views.decorators.http import condition, require_safe
+
+from . import caching, units
+from .caching import cached_fragment
+from .forms import RecipeFilterForm
+from .models import Ingredient, IngredientInRecipe, Recipe
+from .pagination import PAGE_SIZE, keyset_paginate, parse_int
+from .routing import replica_reads
+
+API_VERSION = 'v1'
+MAX_PAGE_SIZE = 100
+
+
+def _json(data):
+    return json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(',', ':'))
+
+
+def _json_response(content):
+    return HttpResponse(content, content_type='application/json')
+
+
+def conditional(version_func):
+    """Dodaje ETag i Last-Modified wyliczone z czasu ostatniej zmiany danych odpowiedzi w bazie.
+
+    `version_func(*args, **kwargs)` zwraca `updated_at`, odczytany jednym zapytaniem po
+    indeksie raz na żądanie, albo krotkę z `updated_at` na początku i wartościami, które
+    trafiają tylko do ETagu. Walidatory zmienia więc zapis w każdym procesie, także w
+    workerze kolejki; klient z aktualnymi danymi dostaje 304 po tym jednym zapytaniu.
+    """
+    def version(request, *args, **kwargs):
+        value = caching.request_version(request, version_func, *args, **kwargs)
+        return value if isinstance(value, tuple) else (value,)
+
+    def etag(request, *args, **kwargs):
+        updated_at, *extra = version(request, *args, **kwargs)
+        if updated_at is None:
+            return None
+        return '-'.join([API_VERSION, str(caching.version_stamp(updated_at)), *map(str, extra)])
+
+    def last_modified(request, *args, **kwargs):
+        return version(request, *args, **kwargs)[0]
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
+
+
+def _recipes_updated_at():
+    # także usunięte przepisy, bo usunięcie zmienia listę
+    return Recipe.all_objects.aggregate(last=Max('updated_at'))['last']
+
+
+def _recipe_updated_at(pk):
+    return Recipe.objects.filter(pk=pk).values_list('updated_at', flat=True).first()
+
+
+def _ingredients_version():
+    # usunięcie składnika nie zmienia Max(updated_at), więc ETag zależy też od liczby składników
+    row = Ingredient.objects.aggregate(last=Max('updated_at'), count=Count('pk'))
+    return row['last'], row['count']
+
+
+def _page_size(request):
+    size = parse_int(request.GET.get('limit')) or PAGE_SIZE
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def _page(items, next_cursor):
+    return _json({'results': items, 'next': next_cursor})
+
+
+@replica_reads
+@require_safe
+@conditional(_recipes_updated_at)
+def recipe_list(request):
+    """Zwraca stronę przepisów w JSON, z filtrami i sortowaniem jak na stronie głównej, stronicowaną kursorem."""
+    filter_form = RecipeFilterForm(request.GET)
+    # słowniki z .values() mają klucz id, a nie pk
+    ordering = tuple(field.replace('pk', 'id') for field in filter_form.ordering())
+    queryset = filter_form.filter(Recipe.objects.all()).values(
+        'id', 'title', 'preparation_time', 'cooking_time', 'total_time',
+        servings=F('number'), author_name=F('author__username'),
+    )
+    recipes, next_cursor = keyset_paginate(queryset, after=request.GET.get('after'),
+                                           page_size=_page_size(request), ordering=ordering)
+    return _json_response(_page(recipes, next_cursor))
+
+
+def _recipe_document(pk):
+    recipe = (Recipe.objects.filter(pk=pk)
+              .values('id', 'title', 'instructions', 'preparation_time', 'cooking_time', 'total_time',
+                      servings=F('number'), author_name=F('author__username'))
+              .first())
+    if recipe is None:
+        raise Http404('Nie ma takiego przepisu.')
+    rows = (IngredientInRecipe.objects.filter(recipe_id=pk).order_by('pk')
+            .values_list('ingredient_id', 'ingredient__name', 'quantity', 'unit'))
+    recipe['ingredients'] = [
+        {'id': ingredient_id, 'name': name, 'amount': units.from_base(quantity, unit), 'unit': unit}
+        for ingredient_id, name, quantity, unit in rows
+    ]
+    return _json(recipe)
+
+
+@replica_reads
+@require_safe
+@conditional(_recipe_updated_at)
+def recipe_detail(request, pk):
+    """Zwraca przepis ze składnikami, ilościami i jednostkami w JSON.
+
+    Gotowy dokument jest trzymany w pamięci podręcznej do następnej zmiany przepisu.
+    """
+    updated_at = caching.request_version(request, _recipe_updated_at, pk=pk)
+    if updated_at is None:
+        raise Http404('Nie ma takiego przepisu.')
+    return _json_response(cached_fragment(pk, updated_at, f'api:{API_VERSION}', lambda: _recipe_document(pk)))
+
+
+@replica_reads
+@require_safe
+@conditional(_ingredients_version)
+def ingredient_list(request):
+    """Zwraca stronę składników w JSON, w kolejności id, stronicowaną kursorem."""
+    ingredients, next_cursor = keyset_paginate(Ingredient.objects.values('id', 'name'),
+                                               after=request.GET.get('after'),
+                                               page_size=_page_size(request), ordering=('id',))
+    return _json_response(_page(ingredients, next_cursor))
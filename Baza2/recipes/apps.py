@@ -5,3 +5,7 @@ class RecipesConfig(AppConfig):
     """konfiguracja aplikacji recipes"""
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'recipes'
+
+    def ready(self):
+        """Rejestruje sygnały aplikacji."""
+        from . import signals  # noqa: F401
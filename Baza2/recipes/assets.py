@@ -0,0 +1,106 @@
+import gzip
+import os
+import posixpath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.http import Http404
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.http import require_safe
+from django.views.static import serve
+
+try:
+    import brotli
+except ImportError:  # brotli jest opcjonalny; bez niego powstają tylko warianty .gz
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.svg', '.ico', '.json', '.txt', '.map', '.html', '.xml'}
+# plik skompresowany musi być mniejszy przynajmniej o tyle, żeby opłacało się go wysyłać
+MIN_SAVING = 0.05
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'public, max-age=0, must-revalidate'
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+def _compress(data):
+    variants = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(data, quality=11)
+    return variants
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Pliki statyczne z sumą treści w nazwie i obok gotowymi wariantami .gz i .br, tworzonymi przy collectstatic.
+
+    Poza collectstatic, np. w testach i przy pracy bez zebranych plików, brakujący
+    wpis w manifeście daje adres bez sumy zamiast błędu.
+    """
+    manifest_strict = False
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            return name
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if dry_run:
+            return
+        for name in self.hashed_files.values():
+            if os.path.splitext(name)[1].lower() not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            with self.open(name) as original:
+                data = original.read()
+            for suffix, compressed in _compress(data).items():
+                if len(compressed) > len(data) * (1 - MIN_SAVING):
+                    continue
+                if self.exists(name + suffix):
+                    self.delete(name + suffix)
+                self._save(name + suffix, ContentFile(compressed))
+                yield name + suffix, name + suffix, True
+
+
+def _is_hashed(path):
+    return path in getattr(staticfiles_storage, 'hashed_files', {}).values()
+
+
+def _accepted_encodings(header):
+    accepted = set()
+    for part in header.split(','):
+        encoding, _, params = part.strip().partition(';')
+        quality = params.strip().removeprefix('q=')
+        try:
+            if params and float(quality) <= 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(encoding.strip().lower())
+    return accepted
+
+
+@require_safe
+def static_asset(request, path):
+    """Wysyła plik z STATIC_ROOT, wybierając wariant .br lub .gz obsługiwany przez przeglądarkę.
+
+    Pliki z sumą treści w nazwie nigdy się nie zmieniają, więc dostają nagłówek `immutable`
+    na rok i przeglądarka przy kolejnych stronach w ogóle o nie nie pyta. Pozostałe
+    przeglądarka musi sprawdzać przy każdym użyciu.
+    """
+    if not settings.STATIC_ROOT:
+        raise Http404('Pliki statyczne nie zostały zebrane.')
+    path = posixpath.normpath(path).lstrip('/')
+    if path == '..' or path.startswith('../'):
+        raise Http404('Nie ma takiego pliku.')
+    accepted = _accepted_encodings(request.headers.get('Accept-Encoding', ''))
+    served = path
+    for encoding, suffix in ENCODINGS:
+        if encoding in accepted and os.path.isfile(os.path.join(settings.STATIC_ROOT, path + suffix)):
+            served = path + suffix
+            break
+    response = serve(request, served, document_root=settings.STATIC_ROOT)
+    response['Cache-Control'] = IMMUTABLE if _is_hashed(path) else REVALIDATE
+    if os.path.splitext(path)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+        patch_vary_headers(response, ['Accept-Encoding'])
+    return response
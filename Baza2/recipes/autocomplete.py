@@ -0,0 +1,126 @@
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+
+from django.conf import settings
+
+from .batching import defer_until_commit
+from .models import Ingredient
+
+# litery, które nie rozkładają się na literę bazową i znak diakrytyczny
+FOLDED_LETTERS = str.maketrans({'ł': 'l', 'ß': 'ss', 'ø': 'o', 'đ': 'd'})
+
+
+def fold(text):
+    """Sprowadza tekst do klucza wyszukiwania bez wielkich liter i znaków diakrytycznych, np. "Łosoś" -> "losos"."""
+    text = unicodedata.normalize('NFKD', text.casefold().translate(FOLDED_LETTERS))
+    return ' '.join(''.join(char for char in text if not unicodedata.combining(char)).split())
+
+
+def _word_keys(name):
+    """Zwraca klucze nazwy od drugiego, trzeciego itd. słowa, np. "pszenna" dla "Mąka pszenna"."""
+    words = fold(name).split()
+    return {' '.join(words[start:]) for start in range(1, len(words))}
+
+
+def _remove(entries, entry):
+    position = bisect_left(entries, entry)
+    if position < len(entries) and entries[position] == entry:
+        del entries[position]
+
+
+def _prefix_range(entries, prefix, limit):
+    position = bisect_left(entries, (prefix,))
+    for key, pk in entries[position:position + limit]:
+        if not key.startswith(prefix):
+            break
+        yield pk
+
+
+class IngredientIndex:
+    """Posortowane tablice (klucz, id składnika) w pamięci procesu do podpowiadania składników po prefiksie.
+
+    Jedna tablica trzyma klucze całych nazw, druga nazwy od kolejnych słów, więc
+    wyszukanie prefiksu to wyszukiwanie binarne i odczyt co najwyżej `limit` wpisów,
+    a zmiana jednego składnika wstawia lub usuwa tylko jego klucze. Tak jak indeks
+    spiżarni, indeks jest budowany przy pierwszym użyciu i przebudowywany po
+    `AUTOCOMPLETE_INDEX_MAX_AGE` sekundach.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._names = {}
+        self._whole = []
+        self._words = []
+        self._built_at = None
+
+    @property
+    def max_age(self):
+        return getattr(settings, 'AUTOCOMPLETE_INDEX_MAX_AGE', 300)
+
+    def build(self):
+        """Buduje indeks od nowa jednym przebiegiem po tabeli składników."""
+        names = dict(Ingredient.objects.values_list('pk', 'name').iterator(chunk_size=10000))
+        whole = sorted((fold(name), pk) for pk, name in names.items())
+        words = sorted((key, pk) for pk, name in names.items() for key in _word_keys(name))
+        with self._lock:
+            self._names, self._whole, self._words = names, whole, words
+            self._built_at = time.monotonic()
+
+    def ensure_built(self):
+        """Buduje indeks, jeśli jeszcze nie istnieje lub jest starszy niż dopuszcza konfiguracja."""
+        if self._built_at is None or time.monotonic() - self._built_at > self.max_age:
+            self.build()
+
+    def set_ingredient(self, pk, name):
+        """Dodaje lub zmienia składnik; None jako nazwa usuwa go z indeksu."""
+        with self._lock:
+            previous = self._names.pop(pk, None)
+            if previous is not None:
+                _remove(self._whole, (fold(previous), pk))
+                for key in _word_keys(previous):
+                    _remove(self._words, (key, pk))
+            if name is not None:
+                self._names[pk] = name
+                insort(self._whole, (fold(name), pk))
+                for key in _word_keys(name):
+                    insort(self._words, (key, pk))
+
+    def refresh(self, ingredient_ids):
+        """Wczytuje z bazy aktualne nazwy podanych składników; usunięte składniki znikają z indeksu."""
+        if self._built_at is None:
+            return
+        names = dict(Ingredient.objects.filter(pk__in=ingredient_ids).values_list('pk', 'name'))
+        for pk in ingredient_ids:
+            self.set_ingredient(pk, names.get(pk))
+
+    def search(self, prefix, limit=10):
+        """Zwraca listę (id, nazwa) składników, których nazwa lub jedno ze słów nazwy zaczyna się od `prefix`.
+
+        Najpierw składniki, których nazwa zaczyna się od prefiksu, potem pozostałe, alfabetycznie.
+        """
+        prefix = fold(prefix)
+        if not prefix:
+            return []
+        self.ensure_built()
+        with self._lock:
+            results = dict.fromkeys(_prefix_range(self._whole, prefix, limit))
+            for pk in _prefix_range(self._words, prefix, limit):
+                if len(results) >= limit:
+                    break
+                results.setdefault(pk)
+            return [(pk, self._names[pk]) for pk in results]
+
+
+ingredient_index = IngredientIndex()
+
+
+def suggest(prefix, limit=10):
+    """Zwraca podpowiedzi składników dla wpisanego początku nazwy jako listę słowników z id i nazwą."""
+    return [{'id': pk, 'name': name} for pk, name in ingredient_index.search(prefix, limit)]
+
+
+def schedule_refresh(ingredient_ids):
+    """Odkłada aktualizację indeksu podpowiedzi do zatwierdzenia transakcji."""
+    defer_until_commit(ingredient_index.refresh, ingredient_ids)
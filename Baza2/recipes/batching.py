@@ -0,0 +1,40 @@
+import threading
+
+from django.db import transaction
+
+_pending = threading.local()
+
+
+class _Batch:
+    """Id odłożone dla jednego callbacku do zakończenia bieżącej transakcji."""
+    __slots__ = ('callback', 'ids', 'queue')
+
+    def __init__(self, callback, queue):
+        self.callback = callback
+        self.ids = set()
+        # lista callbacków połączenia, do której paczka należy; Django zastępuje ją nową po zakończeniu transakcji
+        self.queue = queue
+
+    def __call__(self):
+        if _pending.batches.get(self.callback) is self:
+            del _pending.batches[self.callback]
+        ids, self.ids = self.ids, set()
+        if ids:
+            self.callback(sorted(ids))
+
+
+def defer_until_commit(callback, ids):
+    """Odkłada wywołanie callback(ids) do zatwierdzenia transakcji, łącząc id z wielu wywołań w jedną listę.
+
+    Id z transakcji wycofanej nie trafiają do następnej: po wycofaniu lista callbacków
+    połączenia jest nowa, więc zaczyna się nowa paczka.
+    """
+    batches = getattr(_pending, 'batches', None)
+    if batches is None:
+        batches = _pending.batches = {}
+    queue = transaction.get_connection().run_on_commit
+    batch = batches.get(callback)
+    if batch is None or batch.queue is not queue:
+        batch = batches[callback] = _Batch(callback, queue)
+    batch.ids.update(ids)
+    transaction.on_commit(batch)
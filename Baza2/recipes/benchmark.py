@@ -0,0 +1,147 @@
+import http.client
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.core.cache import cache
+from django.db import connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return round(sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))], 2)
+
+
+def summarize(latencies, seconds, errors=0):
+    """Zwraca statystyki przebiegu: liczbę żądań na sekundę i percentyle czasu odpowiedzi w milisekundach."""
+    latencies = sorted(latency * 1000 for latency in latencies)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': round(seconds, 3),
+        'requests_per_second': round(len(latencies) / seconds, 1) if seconds else None,
+        'mean_ms': round(statistics.fmean(latencies), 2) if latencies else None,
+        'p50_ms': _percentile(latencies, 0.50),
+        'p95_ms': _percentile(latencies, 0.95),
+        'p99_ms': _percentile(latencies, 0.99),
+    }
+
+
+def run_load(base_url, paths, concurrency=20, total=1000, timeout=30):
+    """Wysyła `total` żądań GET do podanych ścieżek z `concurrency` równoległych połączeń.
+
+    Każdy wątek używa jednego połączenia keep-alive, a ścieżki są odpytywane po kolei,
+    więc wynik zależy od serwera i aplikacji, a nie od nawiązywania połączeń.
+    """
+    address = urlsplit(base_url)
+    counter = iter(range(total))
+    counter_lock = threading.Lock()
+    results_lock = threading.Lock()
+    latencies = []
+    errors = [0]
+
+    def worker():
+        connection = http.client.HTTPConnection(address.hostname, address.port, timeout=timeout)
+        while True:
+            with counter_lock:
+                number = next(counter, None)
+            if number is None:
+                break
+            started = time.perf_counter()
+            try:
+                connection.request('GET', paths[number % len(paths)])
+                response = connection.getresponse()
+                response.read()
+                failed = response.status >= 400
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = http.client.HTTPConnection(address.hostname, address.port, timeout=timeout)
+                failed = True
+            elapsed = time.perf_counter() - started
+            with results_lock:
+                if failed:
+                    errors[0] += 1
+                else:
+                    latencies.append(elapsed)
+        connection.close()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in range(concurrency):
+            executor.submit(worker)
+    return summarize(latencies, time.perf_counter() - started, errors[0])
+
+
+def time_client(client, paths, total):
+    """Zwraca czas wysłania `total` żądań GET klientem testowym Django, bez serwera HTTP."""
+    started = time.perf_counter()
+    for number in range(total):
+        client.get(paths[number % len(paths)])
+    return time.perf_counter() - started
+
+
+# (nazwa widoku, czy wymaga zalogowania autora, budżet zapytań przy pustej pamięci podręcznej)
+VIEW_BUDGETS = [
+    ('home', False, 5),
+    ('recipe_detail', False, 5),
+    ('search', False, 5),
+    ('my_recipes', True, 6),
+    ('add_recipe', True, 3),
+    ('recipe_edit', True, 5),
+]
+
+
+def _view_paths(recipe):
+    word = recipe.title.split()[0]
+    return {
+        'home': reverse('home'),
+        'recipe_detail': reverse('recipe_detail', args=[recipe.pk]),
+        'search': f"{reverse('search')}?q={word}",
+        'my_recipes': reverse('my_recipes'),
+        'add_recipe': reverse('add_recipe'),
+        'recipe_edit': reverse('recipe_edit', args=[recipe.pk]),
+    }
+
+
+def run_view_benchmarks(recipe, iterations=20, views=None):
+    """Mierzy liczbę zapytań i czas odpowiedzi widoków dla podanego przepisu i jego autora.
+
+    Liczba zapytań jest mierzona przy pustej pamięci podręcznej, czyli w najgorszym
+    przypadku, a czas jako mediana i 95. percentyl kolejnych żądań. Zwraca słownik
+    nazwa widoku -> wyniki, z polem `over_budget` dla widoków, które przekroczyły budżet.
+    """
+    paths = _view_paths(recipe)
+    anonymous, author = Client(), Client()
+    author.force_login(recipe.author)
+    results = {}
+    for name, needs_login, budget in VIEW_BUDGETS:
+        if views and name not in views:
+            continue
+        client = author if needs_login else anonymous
+        cache.clear()
+        with CaptureQueriesContext(connections['default']) as queries:
+            status = client.get(paths[name]).status_code
+        # lista zapytań jest czytana z połączenia, które kolejne żądanie wyczyści
+        query_count = len(queries)
+        timings = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            client.get(paths[name])
+            timings.append(time.perf_counter() - started)
+        timings = sorted(timing * 1000 for timing in timings)
+        results[name] = {
+            'path': paths[name],
+            'status': status,
+            'queries': query_count,
+            'query_budget': budget,
+            'over_budget': query_count > budget,
+            'median_ms': round(statistics.median(timings), 3),
+            'p95_ms': _percentile(timings, 0.95),
+        }
+    return results
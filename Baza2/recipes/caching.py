@@ -0,0 +1,202 @@
+import hashlib
+import threading
+from collections import Counter
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+KEY_PREFIX = 'recipes'
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _timeout():
+    return getattr(settings, 'RECIPE_CACHE_TIMEOUT', 60 * 60)
+
+
+def _count(event):
+    with _stats_lock:
+        _stats[event] += 1
+
+
+def stats():
+    """Zwraca liczniki trafień i chybień pamięci podręcznej fragmentów i stron w tym procesie."""
+    with _stats_lock:
+        return {event: _stats[event] for event in ('fragment_hits', 'fragment_misses', 'page_hits', 'page_misses')}
+
+
+def version_stamp(updated_at):
+    """Zamienia `updated_at` na liczbę mikrosekund do kluczy pamięci podręcznej i ETagów."""
+    return int(updated_at.timestamp() * 1_000_000)
+
+
+def _fragment_key(recipe_id, updated_at, name):
+    return f'{KEY_PREFIX}:recipe:{recipe_id}:{version_stamp(updated_at)}:{name}'
+
+
+def cached_fragment(recipe_id, updated_at, name, render):
+    """Zwraca fragment HTML przepisu z pamięci podręcznej albo renderuje go funkcją `render` i zapamiętuje.
+
+    Klucz zależy od `updated_at` przepisu, odczytanego z tej samej bazy, z której fragment
+    jest renderowany, więc opóźniona replika nie zapisze starej treści pod nowym kluczem.
+    """
+    key = _fragment_key(recipe_id, updated_at, name)
+    html = cache.get(key)
+    if html is not None:
+        _count('fragment_hits')
+        return html
+    _count('fragment_misses')
+    html = render()
+    cache.set(key, html, _timeout())
+    return html
+
+
+async def acached_fragment(recipe_id, updated_at, name, render):
+    """Asynchroniczna wersja `cached_fragment`; `render` jest funkcją asynchroniczną."""
+    key = _fragment_key(recipe_id, updated_at, name)
+    html = await cache.aget(key)
+    if html is not None:
+        _count('fragment_hits')
+        return html
+    _count('fragment_misses')
+    html = await render()
+    await cache.aset(key, html, _timeout())
+    return html
+
+
+def _version_memo(request, version_func, args, kwargs):
+    # wersja danych strony jest czytana raz na żądanie, choć używa jej kilka dekoratorów i widok
+    versions = request.__dict__.setdefault('_recipes_versions', {})
+    return versions, (version_func, args, tuple(sorted(kwargs.items())))
+
+
+def request_version(request, version_func, *args, **kwargs):
+    """Zwraca `version_func(*args, **kwargs)`, czas ostatniej zmiany danych strony, wywołaną najwyżej raz na żądanie."""
+    versions, key = _version_memo(request, version_func, args, kwargs)
+    if key not in versions:
+        versions[key] = version_func(*args, **kwargs)
+    return versions[key]
+
+
+async def arequest_version(request, version_func, *args, **kwargs):
+    """Asynchroniczna wersja `request_version`; `version_func` jest funkcją asynchroniczną."""
+    versions, key = _version_memo(request, version_func, args, kwargs)
+    if key not in versions:
+        versions[key] = await version_func(*args, **kwargs)
+    return versions[key]
+
+
+def _page_key(request, updated_at):
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f'{KEY_PREFIX}:page:{version_stamp(updated_at)}:{path}'
+
+
+def _cached_response(cached):
+    if cached is None:
+        _count('page_misses')
+        return None
+    _count('page_hits')
+    content, content_type = cached
+    return HttpResponse(content, content_type=content_type)
+
+
+def _cacheable(request, response):
+    return (response.status_code == 200 and not response.cookies and not getattr(response, 'streaming', False)
+            and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE'))
+
+
+def cache_anonymous_page(version_func):
+    """Zapamiętuje całą stronę dla niezalogowanych użytkowników, w kluczu zależnym od czasu zmiany jej danych.
+
+    `version_func(*args, **kwargs)` zwraca `updated_at` danych strony z bazy, więc zmiana
+    zapisana w dowolnym procesie, także w workerze kolejki, od razu zmienia klucz; dla
+    widoków asynchronicznych jest funkcją asynchroniczną. Odpowiedzi, które użyły tokenu
+    CSRF lub ustawiają ciasteczka, nie są zapamiętywane, żeby jeden użytkownik nie dostał
+    tokenu lub sesji innego.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            async def async_wrapper(request, *args, **kwargs):
+                if request.method not in ('GET', 'HEAD') or (await request.auser()).is_authenticated:
+                    return await view(request, *args, **kwargs)
+                updated_at = await arequest_version(request, version_func, *args, **kwargs)
+                if updated_at is None:
+                    return await view(request, *args, **kwargs)
+                key = _page_key(request, updated_at)
+                response = _cached_response(await cache.aget(key))
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                    if _cacheable(request, response):
+                        await cache.aset(key, (response.content, response['Content-Type']), _timeout())
+                return response
+            return wraps(view)(async_wrapper)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+            updated_at = request_version(request, version_func, *args, **kwargs)
+            if updated_at is None:
+                return view(request, *args, **kwargs)
+            key = _page_key(request, updated_at)
+            response = _cached_response(cache.get(key))
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if _cacheable(request, response):
+                    cache.set(key, (response.content, response['Content-Type']), _timeout())
+            return response
+        return wrapper
+    return decorator
+
+
+def _page_etag(request, updated_at, user):
+    # zalogowany użytkownik widzi na stronie swoje dane i formularze z tokenem CSRF, który
+    # zmienia się po ponownym zalogowaniu, więc jego ETag zależy od obu
+    version = getattr(settings, 'PAGE_ETAG_VERSION', 1)
+    etag = f'{version}-{version_stamp(updated_at)}'
+    if user.is_authenticated:
+        get_token(request)  # ustawia sekret CSRF, jeśli przeglądarka go jeszcze nie ma
+        csrf = hashlib.md5(request.META['CSRF_COOKIE'].encode(), usedforsecurity=False).hexdigest()[:8]
+        etag = f'{etag}-{user.pk}-{csrf}'
+    return f'W/"{etag}"'
+
+
+def conditional_page(last_modified_func):
+    """Dodaje do asynchronicznego widoku HTML nagłówki ETag i Last-Modified i odpowiada 304, jak `condition()`.
+
+    `last_modified_func(*args, **kwargs)` to funkcja asynchroniczna zwracająca czas ostatniej
+    zmiany danych strony, odczytany jednym zapytaniem po indeksie; gdy zwróci None, widok
+    działa bez nagłówków. Klient z aktualną kopią dostaje 304 bez renderowania szablonu.
+    Strony niezalogowanych mogą przechowywać także współdzielone pamięci podręczne, które
+    przed użyciem kopii muszą ją sprawdzić; strony zalogowanych tylko przeglądarka.
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return await view(request, *args, **kwargs)
+            updated_at = await arequest_version(request, last_modified_func, *args, **kwargs)
+            if updated_at is None:
+                return await view(request, *args, **kwargs)
+            user = await request.auser()
+            etag = _page_etag(request, updated_at, user)
+            response = get_conditional_response(request, etag=etag, last_modified=int(updated_at.timestamp()))
+            if response is None:
+                response = await view(request, *args, **kwargs)
+            if response.status_code in (200, 304):
+                response.headers.setdefault('ETag', etag)
+                response.headers.setdefault('Last-Modified', http_date(updated_at.timestamp()))
+                # strona z tokenem CSRF lub ciasteczkiem nie może trafić do współdzielonej pamięci podręcznej
+                shared = not user.is_authenticated and (response.status_code == 304 or _cacheable(request, response))
+                patch_cache_control(response, no_cache=True, **({'public': True} if shared else {'private': True}))
+                patch_vary_headers(response, ['Cookie'])
+            return response
+        return wrapper
+    return decorator
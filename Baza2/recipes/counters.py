@@ -0,0 +1,77 @@
+from django.db.models import Count, F, Max, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .models import AuthorStats, Comment, IngredientInRecipe, Recipe
+
+
+def _changed(field, delta):
+    # licznik, który rozjechał się z danymi, nie może zejść poniżej zera; naprawia go reconcile_counters
+    return F(field) + delta if delta > 0 else Greatest(F(field) + delta, 0)
+
+
+def _add(queryset, **deltas):
+    """Zmienia liczniki o podane wartości jednym UPDATE z wyrażeniami F, bez odczytu wiersza."""
+    deltas = {field: _changed(field, delta) for field, delta in deltas.items() if delta}
+    return queryset.update(**deltas) if deltas else 0
+
+
+def comment_added(recipe_id, created_at):
+    """Zwiększa liczbę komentarzy przepisu i przesuwa datę ostatniego komentarza, w jednym zapytaniu."""
+    Recipe.objects.filter(pk=recipe_id).update(
+        comment_count=F('comment_count') + 1,
+        last_commented_at=Greatest(Coalesce('last_commented_at', Value(created_at)), Value(created_at)),
+    )
+
+
+def comment_removed(recipe_id):
+    """Zmniejsza liczbę komentarzy i ustawia datę ostatniego z pozostałych, w jednym zapytaniu."""
+    latest = Comment.objects.filter(recipe_id=recipe_id).order_by('-created_at').values('created_at')[:1]
+    Recipe.objects.filter(pk=recipe_id).update(comment_count=_changed('comment_count', -1),
+                                               last_commented_at=Subquery(latest))
+
+
+def ingredients_added(recipe_id, count):
+    """Zmienia liczbę składników przepisu o `count`, także ujemne."""
+    _add(Recipe.objects.filter(pk=recipe_id), ingredient_count=count)
+
+
+def recipes_added(author_id, count):
+    """Zmienia liczbę przepisów autora o `count`, a przy pierwszym przepisie zakłada wiersz licznika."""
+    if not _add(AuthorStats.objects.filter(user_id=author_id), recipe_count=count):
+        # licznik liczony z bazy, więc nowy wiersz od razu uwzględnia także bieżącą zmianę
+        AuthorStats.objects.get_or_create(
+            user_id=author_id, defaults={'recipe_count': Recipe.objects.filter(author_id=author_id).count()})
+
+
+def reconcile_recipes(recipe_ids):
+    """Przelicza liczniki podanych przepisów od zera i zapisuje te, które się rozjechały; zwraca ich liczbę."""
+    comments = {row['recipe']: row for row in Comment.objects.filter(recipe__in=recipe_ids).order_by()
+                .values('recipe').annotate(count=Count('pk'), latest=Max('created_at'))}
+    ingredients = dict(IngredientInRecipe.objects.filter(recipe__in=recipe_ids).order_by()
+                       .values('recipe').annotate(count=Count('pk')).values_list('recipe', 'count'))
+    changed = []
+    now = timezone.now()
+    for recipe in Recipe.objects.filter(pk__in=recipe_ids).only('comment_count', 'ingredient_count',
+                                                                 'last_commented_at'):
+        row = comments.get(recipe.pk, {})
+        actual = (row.get('count', 0), ingredients.get(recipe.pk, 0), row.get('latest'))
+        if actual != (recipe.comment_count, recipe.ingredient_count, recipe.last_commented_at):
+            recipe.comment_count, recipe.ingredient_count, recipe.last_commented_at = actual
+            recipe.updated_at = now
+            changed.append(recipe)
+    if changed:
+        Recipe.objects.bulk_update(changed, ['comment_count', 'ingredient_count', 'last_commented_at', 'updated_at'])
+    return len(changed)
+
+
+def reconcile_authors(user_ids):
+    """Przelicza liczbę przepisów podanych użytkowników i zapisuje rozbieżne; zwraca ich liczbę."""
+    actual = dict(Recipe.objects.filter(author__in=user_ids).order_by()
+                  .values('author').annotate(count=Count('pk')).values_list('author', 'count'))
+    stored = dict(AuthorStats.objects.filter(user__in=user_ids).values_list('user_id', 'recipe_count'))
+    changed = [AuthorStats(user_id=user_id, recipe_count=actual.get(user_id, 0))
+               for user_id in user_ids if stored.get(user_id) != actual.get(user_id, 0)]
+    AuthorStats.objects.bulk_create(changed, update_conflicts=True, unique_fields=['user'],
+                                    update_fields=['recipe_count'])
+    return len(changed)
@@ -0,0 +1,101 @@
+import datetime
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import counters, pantry, search
+from .models import Comment, DeletedAccount, Recipe
+
+BATCH_SIZE = 500
+
+
+def retention():
+    """Czas, przez który usunięte przepisy i konta czekają na usunięcie na stałe."""
+    return datetime.timedelta(days=getattr(settings, 'DELETED_RETENTION_DAYS', 7))
+
+
+def delete_recipes(queryset, deleted_at=None):
+    """Usuwa przepisy miękko: jeden UPDATE oznacza je jako usunięte, bez wczytywania komentarzy i składników.
+
+    Liczniki autorów, indeksy i pamięć podręczna są aktualizowane od razu, więc przepisy
+    znikają ze wszystkich widoków; wiersze usuwa później polecenie purge_deleted.
+    """
+    deleted_at = deleted_at or timezone.now()
+    with transaction.atomic():
+        rows = list(queryset.values_list('pk', 'author_id'))
+        recipe_ids = [recipe_id for recipe_id, _ in rows]
+        Recipe.objects.filter(pk__in=recipe_ids).update(deleted_at=deleted_at, updated_at=deleted_at)
+        for author_id, count in Counter(author_id for _, author_id in rows).items():
+            counters.recipes_added(author_id, -count)
+        search.schedule_refresh(recipe_ids)
+        pantry.schedule_refresh(recipe_ids)
+    return len(recipe_ids)
+
+
+def delete_account(user):
+    """Dezaktywuje konto i miękko usuwa przepisy użytkownika; resztę danych usuwa purge_deleted."""
+    deleted_at = timezone.now()
+    with transaction.atomic():
+        User.objects.filter(pk=user.pk).update(is_active=False)
+        DeletedAccount.objects.update_or_create(user=user, defaults={'deleted_at': deleted_at})
+        delete_recipes(Recipe.objects.filter(author=user), deleted_at)
+
+
+def _delete_rows(model, column, ids, batch_size):
+    """Usuwa wiersze, których `column` jest jednym z `ids`, surowymi DELETE po najwyżej `batch_size` wierszy.
+
+    Wiersze nie są wczytywane i nie wysyłają sygnałów, a każde polecenie jest osobną,
+    krótką transakcją, więc nawet bardzo duża kaskada nie blokuje długo tabeli.
+    """
+    table, pk = model._meta.db_table, model._meta.pk.column
+    placeholders = ', '.join(['%s'] * len(ids))
+    deleted = 0
+    with connection.cursor() as cursor:
+        while True:
+            cursor.execute(
+                f'DELETE FROM {table} WHERE {pk} IN '
+                f'(SELECT {pk} FROM {table} WHERE {column} IN ({placeholders}) LIMIT %s)',
+                [*ids, batch_size],
+            )
+            deleted += cursor.rowcount
+            if cursor.rowcount < batch_size:
+                return deleted
+
+
+def _purge_recipes(recipe_ids, batch_size):
+    # najpierw wiersze wszystkich modeli wskazujących na przepis, także przez relacje bez
+    # odwrotnej nazwy (related_name='+'), np. podobne przepisy
+    for relation in Recipe._meta.get_fields(include_hidden=True):
+        if relation.auto_created and not relation.concrete and (relation.one_to_many or relation.one_to_one):
+            _delete_rows(relation.related_model, relation.field.column, recipe_ids, batch_size)
+    _delete_rows(Recipe, Recipe._meta.pk.column, recipe_ids, batch_size)
+
+
+def purge_recipes(before, batch_size=BATCH_SIZE):
+    """Usuwa na stałe przepisy usunięte przed `before`, paczkami; zwraca kolejno liczby usuniętych przepisów."""
+    while True:
+        recipe_ids = list(Recipe.all_objects.filter(deleted_at__lt=before).order_by('deleted_at', 'pk')
+                          .values_list('pk', flat=True)[:batch_size])
+        if not recipe_ids:
+            return
+        _purge_recipes(recipe_ids, batch_size)
+        yield len(recipe_ids)
+
+
+def purge_accounts(before, batch_size=BATCH_SIZE):
+    """Usuwa na stałe konta usunięte przed `before`; zwraca kolejno id usuniętych użytkowników.
+
+    Przepisy konta usuwa wcześniej `purge_recipes`. Komentarze użytkownika pod cudzymi
+    przepisami są usuwane paczkami, a liczniki tych przepisów przeliczane od nowa.
+    """
+    for user_id in DeletedAccount.objects.filter(deleted_at__lt=before).values_list('user_id', flat=True):
+        recipe_ids = list(Comment.objects.filter(user_id=user_id).order_by()
+                          .values_list('recipe_id', flat=True).distinct())
+        _delete_rows(Comment, Comment._meta.get_field('user').column, [user_id], batch_size)
+        for start in range(0, len(recipe_ids), batch_size):
+            counters.reconcile_recipes(recipe_ids[start:start + batch_size])
+        User.objects.filter(pk=user_id).delete()
+        yield user_id
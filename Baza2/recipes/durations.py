@@ -0,0 +1,35 @@
+import re
+
+HOUR_UNITS = ('h', 'godz')
+DURATION_RE = re.compile(r'(\d+(?:[.,]\d+)?)\s*([^\d\s.,]*)')
+NUMBER_RE = re.compile(r'\d+')
+
+
+def parse_minutes(text):
+    """Zamienia opis czasu, np. "1 h 30 min", "1,5 godziny" lub "45", na liczbę minut.
+
+    Liczby bez jednostki i z nieznaną jednostką traktowane są jako minuty.
+    Zwraca None, jeśli tekst nie zawiera żadnej liczby.
+    """
+    if text is None:
+        return None
+    if isinstance(text, int):
+        return text
+    parts = DURATION_RE.findall(str(text).lower())
+    if not parts:
+        return None
+    total = 0
+    for number, unit in parts:
+        value = float(number.replace(',', '.'))
+        total += value * 60 if unit.startswith(HOUR_UNITS) else value
+    return round(total)
+
+
+def parse_servings(text):
+    """Zwraca pierwszą liczbę z opisu liczby porcji, np. 4 dla "4 porcje" lub 2 dla "2-3"."""
+    if text is None:
+        return None
+    if isinstance(text, int):
+        return text
+    match = NUMBER_RE.search(str(text))
+    return int(match.group()) if match else None
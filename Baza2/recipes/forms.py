@@ -1,10 +1,43 @@
+from decimal import Decimal
+
 from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db.models import Value
+from django.db.models.functions import Upper
 
+from .durations import parse_minutes, parse_servings
 from .models import Recipe, Comment, Ingredient, IngredientInRecipe
 
 
+class ParsedIntegerField(forms.IntegerField):
+    """Pole liczbowe, które przed walidacją wyciąga liczbę z opisu tekstowego funkcją `parse`."""
+    widget = forms.TextInput
+    parse = staticmethod(int)
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            parsed = self.parse(value)
+        except (TypeError, ValueError):
+            parsed = None
+        if parsed is None:
+            raise ValidationError(self.error_messages['invalid'], code='invalid')
+        return parsed
+
+
+class MinutesField(ParsedIntegerField):
+    """Pole liczby minut, które przyjmuje też opisy w rodzaju "1 h 30 min" lub "1,5 godziny"."""
+    parse = staticmethod(parse_minutes)
+
+
+class ServingsField(ParsedIntegerField):
+    """Pole liczby porcji, które przyjmuje też opisy w rodzaju "4 porcje"."""
+    parse = staticmethod(parse_servings)
+
+
 class CustomUserCreationForm(UserCreationForm):
     """Formularz rejestracji użytkownika z dodatkowym polem email."""
     email = forms.EmailField(required=True)
@@ -25,27 +58,27 @@ class CustomUserCreationForm(UserCreationForm):
 
 class RecipeForm(forms.ModelForm):
     """formularz do tworzenia i aktualizowania instancji Recipe"""
+    preparation_time = MinutesField(
+        min_value=0, label='Czas przygotowania (min)', widget=forms.TextInput(attrs={'class': 'form-control'}))
+    cooking_time = MinutesField(
+        min_value=0, label='Czas pieczenia/gotowania/smażenia (min)',
+        widget=forms.TextInput(attrs={'class': 'form-control'}))
+    number = ServingsField(min_value=1, label='Liczba porcji', widget=forms.TextInput(attrs={'class': 'form-control'}))
 
     class Meta:
         """opcje Meta dla RecipeForm"""
         model = Recipe
-        fields = ['title', 'instructions', 'preparation_time', 'cooking_time', 'number']
+        fields = ['title', 'instructions', 'preparation_time', 'cooking_time', 'number', 'photo']
 
         labels = {
             'title': 'Nazwa przepisu',
             'instructions': 'Instrukcje',
-            'preparation_time': 'Czas przygotowania',
-            'cooking_time': 'Czas pieczenia/gotowania/smażenia',
-            'number': 'Liczba porcji',
 
 
         }
         widgets = {
             'title': forms.Textarea(attrs={'class': 'form-control', 'rows': 3}),
             'instructions': forms.Textarea(attrs={'class': 'form-control', 'rows': 5}),
-            'preparation_time': forms.Textarea(attrs={'class': 'form-control', 'rows': 3}),
-            'cooking_time': forms.Textarea(attrs={'class': 'form-control', 'rows': 3}),
-            'number': forms.Textarea(attrs={'class': 'form-control', 'rows': 3}),
 
         }
 
@@ -61,13 +94,94 @@ class CommentForm(forms.ModelForm):
 
 class IngredientInRecipeForm(forms.ModelForm):
     """Formularz do dodawania składników do przepisu."""
+    amount = forms.DecimalField(min_value=Decimal('0.001'), decimal_places=3, initial=1, label='Ilość')
+
     class Meta:
         model = IngredientInRecipe
         fields = ['ingredient', 'amount', 'unit']
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk:
+            self.initial.setdefault('amount', self.instance.amount)
+
+    def clean(self):
+        """Przelicza podaną ilość na jednostki bazowe przepisu."""
+        cleaned_data = super().clean()
+        if cleaned_data.get('amount') is not None and cleaned_data.get('unit'):
+            self.instance.unit = cleaned_data['unit']
+            self.instance.amount = cleaned_data['amount']
+        return cleaned_data
+
 
 class IngredientForm(forms.ModelForm):
     """Formularz do tworzenia i edytowania składników."""
     class Meta:
         model = Ingredient
         fields = ['name']
+
+    def clean_name(self):
+        """Odrzuca nazwę, która bez względu na wielkość liter jest już w bazie."""
+        name = self.cleaned_data['name'].strip()
+        # porównanie UPPER(name) z UPPER(wartości) korzysta z indeksu ingredient_name_upper_idx
+        duplicates = Ingredient.objects.alias(upper_name=Upper('name')).filter(upper_name=Upper(Value(name)))
+        if duplicates.exclude(pk=self.instance.pk).exists():
+            raise ValidationError('Taki składnik już istnieje.')
+        return name
+
+
+class RecipeFilterForm(forms.Form):
+    """Formularz filtrów zakresu i sortowania list przepisów."""
+    SORT_CHOICES = [
+        ('newest', 'Najnowsze'),
+        ('quickest', 'Najkrótszy łączny czas'),
+        ('slowest', 'Najdłuższy łączny czas'),
+        ('popular', 'Najczęściej komentowane'),
+    ]
+    ORDERINGS = {
+        'newest': ('-pk',),
+        'quickest': ('total_time', 'pk'),
+        'slowest': ('-total_time', '-pk'),
+        'popular': ('-comment_count', '-pk'),
+    }
+    RANGES = {
+        'min_total_time': 'total_time__gte',
+        'max_total_time': 'total_time__lte',
+        'max_preparation_time': 'preparation_time__lte',
+        'min_servings': 'number__gte',
+        'max_servings': 'number__lte',
+    }
+
+    min_total_time = forms.IntegerField(required=False, min_value=0, label='Łączny czas od (min)')
+    max_total_time = forms.IntegerField(required=False, min_value=0, label='Łączny czas do (min)')
+    max_preparation_time = forms.IntegerField(required=False, min_value=0, label='Czas przygotowania do (min)')
+    min_servings = forms.IntegerField(required=False, min_value=1, label='Porcji od')
+    max_servings = forms.IntegerField(required=False, min_value=1, label='Porcji do')
+    sort = forms.ChoiceField(required=False, label='Sortowanie')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['sort'].choices = self.SORT_CHOICES
+
+    def _cleaned(self):
+        return self.cleaned_data if self.is_valid() else {}
+
+    def has_filters(self):
+        """Sprawdza, czy podano którykolwiek filtr zakresu."""
+        cleaned = self._cleaned()
+        return any(cleaned.get(name) is not None for name in self.RANGES)
+
+    def filter(self, queryset):
+        """Zawęża zapytanie do przepisów spełniających podane zakresy."""
+        cleaned = self._cleaned()
+        lookups = {lookup: cleaned[name] for name, lookup in self.RANGES.items() if cleaned.get(name) is not None}
+        return queryset.filter(**lookups)
+
+    def ordering(self):
+        """Zwraca pola sortowania wybranego klucza lub None dla sortowania domyślnego."""
+        return self.ORDERINGS.get(self._cleaned().get('sort') or self.SORT_CHOICES[0][0])
+
+
+class SearchFilterForm(RecipeFilterForm):
+    """Formularz filtrów wyszukiwarki, w której domyślnie sortuje się według trafności."""
+    SORT_CHOICES = [('relevance', 'Trafność')] + RecipeFilterForm.SORT_CHOICES
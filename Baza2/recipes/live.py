@@ -0,0 +1,184 @@
+import asyncio
+import threading
+import time
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import DatabaseError, close_old_connections, connections, transaction
+from django.db.models import Max
+from django.template.loader import render_to_string
+
+from .models import Comment
+
+COMMENT_TEMPLATE = 'recipes/comment_item.html'
+# przeglądarka łączy się ponownie po tylu milisekundach, wysyłając Last-Event-ID
+RECONNECT_MS = 3000
+
+
+def _poll_interval():
+    return getattr(settings, 'LIVE_COMMENTS_POLL_INTERVAL', 1.0)
+
+
+def _keepalive():
+    return getattr(settings, 'LIVE_COMMENTS_KEEPALIVE', 15)
+
+
+def available(request):
+    """Strumień działa tylko pod ASGI; pod WSGI każde połączenie zajmowałoby wątek serwera do rozłączenia."""
+    return isinstance(request, ASGIRequest)
+
+
+def render_comment(comment):
+    """Fragment HTML jednego komentarza, taki sam na liście, w odpowiedzi na AJAX i w strumieniu."""
+    return render_to_string(COMMENT_TEMPLATE, {'comment': comment})
+
+
+class Subscription:
+    """Kolejka zdarzeń jednego połączenia SSE, zasilana z dowolnego wątku przez pętlę zdarzeń połączenia."""
+
+    def __init__(self, recipe_id):
+        self.recipe_id = recipe_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        # komentarz może przyjść i z sygnału tego procesu, i z odpytywania bazy; wysyłany jest raz
+        self.sent = set()
+
+    def push(self, comment_id, html):
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, (comment_id, html))
+        except RuntimeError:
+            # pętla zamkniętego połączenia; subskrypcja zaraz zostanie usunięta
+            pass
+
+    def mark_sent(self, comment_id):
+        if comment_id in self.sent:
+            return False
+        self.sent.add(comment_id)
+        return True
+
+
+class CommentBroker:
+    """Publikuje nowe komentarze do połączeń SSE oglądających przepis, w pamięci procesu.
+
+    Komentarze zapisane w tym procesie są wysyłane od razu po zatwierdzeniu transakcji.
+    Te z innych procesów i z operacji zbiorczych znajduje wątek odpytujący bazę co
+    `LIVE_COMMENTS_POLL_INTERVAL` s jednym zapytaniem o wszystkie oglądane przepisy;
+    działa tylko wtedy, gdy ktoś ogląda, a wartość 0 go wyłącza.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+        self._poller = None
+        # id ostatniego komentarza widzianego przez odpytywanie; None przed pierwszym odpytaniem
+        self._last_id = None
+
+    def subscribe(self, recipe_id):
+        subscription = Subscription(recipe_id)
+        with self._lock:
+            self._subscriptions.setdefault(recipe_id, set()).add(subscription)
+            if _poll_interval() and self._poller is None:
+                self._poller = threading.Thread(target=self._run_poller, name='live-comments', daemon=True)
+                self._poller.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.recipe_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscriptions.pop(subscription.recipe_id, None)
+
+    def watched(self):
+        with self._lock:
+            return list(self._subscriptions)
+
+    def publish(self, recipe_id, comment_id, html):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(recipe_id, ()))
+        for subscription in subscriptions:
+            subscription.push(comment_id, html)
+
+    def publish_comment(self, comment):
+        """Wysyła komentarz oglądającym przepis; bez oglądających nic nie jest renderowane."""
+        if comment.recipe_id in self.watched():
+            self.publish(comment.recipe_id, comment.pk, render_comment(comment))
+
+    def poll(self):
+        """Wysyła komentarze oglądanych przepisów dodane od poprzedniego odpytania bazy."""
+        recipe_ids = self.watched()
+        if self._last_id is None:
+            self._last_id = Comment.objects.aggregate(last=Max('pk'))['last'] or 0
+            return
+        if not recipe_ids:
+            return
+        comments = list(Comment.objects.filter(recipe_id__in=recipe_ids, pk__gt=self._last_id)
+                        .select_related('user').order_by('pk')[:500])
+        for comment in comments:
+            self.publish_comment(comment)
+        if comments:
+            self._last_id = comments[-1].pk
+
+    def _run_poller(self):
+        try:
+            while True:
+                with self._lock:
+                    # zatrzymanie pod blokadą, więc nowa subskrypcja zawsze uruchomi nowy wątek
+                    if not self._subscriptions:
+                        self._poller = None
+                        self._last_id = None
+                        return
+                close_old_connections()
+                try:
+                    self.poll()
+                except DatabaseError:
+                    # przy niedostępnej bazie komentarze z innych procesów dojdą po jej powrocie
+                    pass
+                time.sleep(_poll_interval())
+        finally:
+            connections.close_all()
+
+
+broker = CommentBroker()
+
+
+def schedule_publish(comment):
+    """Po zatwierdzeniu transakcji wysyła nowy komentarz do oglądających przepis w tym procesie."""
+    transaction.on_commit(partial(broker.publish_comment, comment))
+
+
+def _event(comment_id, html):
+    data = '\n'.join(f'data: {line}' for line in html.strip().splitlines())
+    return f'id: {comment_id}\nevent: comment\n{data}\n\n'
+
+
+def _comments_after(recipe_id, last_id):
+    comments = Comment.objects.filter(recipe_id=recipe_id, pk__gt=last_id).select_related('user').order_by('pk')
+    return [(comment.pk, render_comment(comment)) for comment in comments[:100]]
+
+
+async def stream(recipe_id, last_id=None):
+    """Zdarzenia SSE z nowymi komentarzami przepisu; po ponownym połączeniu najpierw te po `last_id`.
+
+    Co `LIVE_COMMENTS_KEEPALIVE` s wysyłany jest komentarz SSE, żeby pośrednicy nie zamknęli
+    bezczynnego połączenia.
+    """
+    subscription = broker.subscribe(recipe_id)
+    try:
+        yield f'retry: {RECONNECT_MS}\n\n'
+        if last_id is not None:
+            for comment_id, html in await sync_to_async(_comments_after)(recipe_id, last_id):
+                if subscription.mark_sent(comment_id):
+                    yield _event(comment_id, html)
+        while True:
+            try:
+                comment_id, html = await asyncio.wait_for(subscription.queue.get(), _keepalive())
+            except asyncio.TimeoutError:
+                yield ': ping\n\n'
+                continue
+            if subscription.mark_sent(comment_id):
+                yield _event(comment_id, html)
+    finally:
+        broker.unsubscribe(subscription)
@@ -0,0 +1,42 @@
+import statistics
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+
+from recipes.benchmark import time_client
+from recipes.models import Recipe
+
+METRICS_MIDDLEWARE = 'recipes.metrics.MetricsMiddleware'
+
+
+class Command(BaseCommand):
+    """Mierzy narzut MetricsMiddleware, porównując czas tych samych żądań z nim i bez niego.
+
+    Pomiary z włączonym i wyłączonym middleware są przeplatane, żeby rozgrzewka
+    i zmiany obciążenia maszyny nie faworyzowały żadnej wersji.
+    """
+    help = 'Mierzy narzut middleware metryk na widokach do odczytu.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Liczba żądań w jednej rundzie.')
+        parser.add_argument('--rounds', type=int, default=5)
+
+    def handle(self, *args, requests, rounds, **options):
+        recipe_id = Recipe.objects.order_by('-pk').values_list('pk', flat=True).first()
+        paths = ['/'] + ([f'/recipe/{recipe_id}/', f'/recipe/{recipe_id}/comments/'] if recipe_id else [])
+        without = [name for name in settings.MIDDLEWARE if name != METRICS_MIDDLEWARE]
+        timings = {'with': [], 'without': []}
+        # DEBUG zapisuje każde zapytanie w connection.queries, co zafałszowałoby pomiar
+        with override_settings(DEBUG=False, ALLOWED_HOSTS=['testserver']):
+            for _ in range(rounds):
+                for variant, middleware in (('without', without), ('with', [METRICS_MIDDLEWARE] + without)):
+                    with override_settings(MIDDLEWARE=middleware):
+                        client = Client()
+                        time_client(client, paths, len(paths))
+                        timings[variant].append(time_client(client, paths, requests))
+        baseline = statistics.median(timings['without'])
+        measured = statistics.median(timings['with'])
+        self.stdout.write(f'bez metryk: {baseline * 1000 / requests:.3f} ms/żądanie')
+        self.stdout.write(f'z metrykami: {measured * 1000 / requests:.3f} ms/żądanie')
+        self.stdout.write(f'narzut: {(measured - baseline) / baseline * 100:.2f}%')
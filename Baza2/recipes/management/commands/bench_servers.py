@@ -0,0 +1,84 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.benchmark import run_load
+from recipes.models import Recipe
+
+INTERFACES = {
+    'asgi': ('Baza2.asgi:application', 'asgi3'),
+    'wsgi': ('Baza2.wsgi:application', 'wsgi'),
+}
+
+
+def _wait_for_port(host, port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+class Command(BaseCommand):
+    """Porównuje przepustowość stron do odczytu przy równoległych żądaniach pod ASGI i WSGI.
+
+    Obie wersje aplikacji są uruchamiane tym samym serwerem (uvicorn, dla WSGI z pulą
+    wątków), więc różnica wynika z obsługi żądań przez Django, a nie z serwera.
+    """
+    help = 'Porównuje przepustowość strony głównej, przepisu i wyszukiwarki pod uvicorn (ASGI) i WSGI.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interface', choices=INTERFACES, action='append',
+                            help='Domyślnie oba interfejsy.')
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--path', action='append', help='Ścieżki do odpytywania; domyślnie widoki do odczytu.')
+        parser.add_argument('--output', help='Plik JSON z wynikami.')
+
+    def _default_paths(self):
+        recipe = Recipe.objects.order_by('-pk').values_list('pk', 'title').first()
+        if recipe is None:
+            raise CommandError('Baza nie zawiera przepisów; najpierw je zaimportuj.')
+        pk, title = recipe
+        word = title.split()[0] if title.split() else 'a'
+        return ['/', f'/recipe/{pk}/', f'/recipe/{pk}/comments/', f'/search/?q={word}']
+
+    def handle(self, *args, interface, concurrency, requests, host, port, path, output, **options):
+        try:
+            import uvicorn  # noqa: F401
+        except ImportError:
+            raise CommandError('Benchmark wymaga pakietu uvicorn (pip install uvicorn).')
+        paths = path or self._default_paths()
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'Baza2.settings')}
+        results = {}
+        for name in interface or list(INTERFACES):
+            app, uvicorn_interface = INTERFACES[name]
+            server = subprocess.Popen(
+                [sys.executable, '-m', 'uvicorn', app, '--interface', uvicorn_interface,
+                 '--host', host, '--port', str(port), '--log-level', 'warning', '--no-access-log'],
+                cwd=settings.BASE_DIR, env=env,
+            )
+            try:
+                if not _wait_for_port(host, port):
+                    raise CommandError(f'Serwer {name} nie wystartował.')
+                # rozgrzewka: pierwsze żądania wypełniają pamięć podręczną i indeksy w procesie
+                run_load(f'http://{host}:{port}', paths, concurrency=1, total=len(paths) * 2)
+                results[name] = run_load(f'http://{host}:{port}', paths, concurrency=concurrency, total=requests)
+            finally:
+                server.terminate()
+                server.wait()
+            self.stdout.write(f'{name}: {results[name]}')
+        if output:
+            with open(output, 'w', encoding='utf-8') as stream:
+                json.dump({'paths': paths, 'concurrency': concurrency, 'results': results}, stream, indent=2)
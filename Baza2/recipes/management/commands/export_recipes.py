@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.transfer import FORMATS, export_records, guess_format, write_records
+
+
+class Command(BaseCommand):
+    """Eksportuje wszystkie przepisy do pliku JSONL lub CSV, strumieniowo."""
+    help = 'Eksportuje przepisy do pliku JSONL lub CSV (domyślnie na standardowe wyjście).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o', default='-')
+        parser.add_argument('--format', choices=FORMATS, help='Domyślnie według rozszerzenia pliku.')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Liczba wierszy pobieranych naraz z bazy.')
+
+    def handle(self, *args, output, format, chunk_size, **options):
+        format = format or guess_format(output)
+        stream = self.stdout if output == '-' else open(output, 'w', encoding='utf-8', newline='')
+        started = time.monotonic()
+        count = 0
+        try:
+            for count, _ in enumerate(write_records(export_records(chunk_size), stream, format), 1):
+                pass
+        finally:
+            if stream is not self.stdout:
+                stream.close()
+        rate = round(count / max(time.monotonic() - started, 1e-6))
+        self.stderr.write(self.style.SUCCESS(f'Wyeksportowano przepisów: {count}, {rate} wierszy/s'))
@@ -0,0 +1,111 @@
+import random
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes import counters, units
+from recipes.models import Comment, Ingredient, IngredientInRecipe, Recipe
+from recipes.search import refresh_index
+
+DISHES = ['Zupa', 'Sałatka', 'Placki', 'Gulasz', 'Zapiekanka', 'Pierogi', 'Ciasto', 'Makaron', 'Risotto', 'Kotlety']
+ADJECTIVES = ['pomidorowa', 'babci', 'szybka', 'pikantna', 'jesienna', 'wiosenna', 'domowa', 'leśna', 'ostra',
+              'słodka', 'kremowa', 'wegetariańska']
+PRODUCTS = ['mąka', 'cukier', 'masło', 'mleko', 'jajko', 'pomidor', 'cebula', 'czosnek', 'ziemniak', 'marchew',
+            'łosoś', 'kurczak', 'ryż', 'śmietana', 'ser', 'papryka', 'pieczarki', 'jabłko', 'koper', 'sól']
+VARIANTS = ['pszenna', 'świeży', 'suszony', 'wędzony', 'ekologiczny', 'mrożony', 'tarty', 'drobny', 'czerwona']
+UNITS = list(units.UNITS)
+
+
+class Command(BaseCommand):
+    """Generuje syntetyczny katalog przepisów do benchmarków, zapisując wszystko paczkami przez bulk_create.
+
+    Przepisy dostają klucze importu zależne od ziarna, więc ponowne uruchomienie z tymi
+    samymi parametrami niczego nie dubluje, a z większym `--recipes` dopisuje brakujące.
+    """
+    help = 'Generuje syntetyczne przepisy, składniki, wiersze składników i komentarze (10 tys. - 1 mln przepisów).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--ingredients', type=int, default=2000)
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8)
+        parser.add_argument('--comments-per-recipe', type=int, default=3)
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--skip-search-index', action='store_true',
+                            help='Nie odświeżaj indeksu wyszukiwania (można to zrobić później rebuild_search_index).')
+
+    def handle(self, *args, recipes, ingredients, users, ingredients_per_recipe, comments_per_recipe,
+               batch_size, seed, skip_search_index, **options):
+        started = time.monotonic()
+        user_ids = self._users(users)
+        ingredient_ids = self._ingredients(ingredients, seed)
+        created = 0
+        for start in range(0, recipes, batch_size):
+            created += self._recipe_batch(range(start, min(start + batch_size, recipes)), seed, user_ids,
+                                          ingredient_ids, ingredients_per_recipe, comments_per_recipe,
+                                          skip_search_index)
+            done = min(start + batch_size, recipes)
+            self.stdout.write(f'{done}/{recipes} przepisów ({round(done / (time.monotonic() - started))}/s)')
+        self.stdout.write(self.style.SUCCESS(f'Dodano przepisów: {created} w {time.monotonic() - started:.1f} s'))
+
+    def _users(self, count):
+        usernames = [f'bench_user_{number}' for number in range(count)]
+        password = make_password(None)
+        User.objects.bulk_create([User(username=name, password=password) for name in usernames],
+                                 ignore_conflicts=True)
+        return sorted(User.objects.filter(username__in=usernames).values_list('pk', flat=True))
+
+    def _ingredients(self, count, seed, batch_size=5000):
+        rng = random.Random(seed)
+        names = [f'{rng.choice(PRODUCTS)} {rng.choice(VARIANTS)} {number}' for number in range(count)]
+        ids = []
+        for start in range(0, count, batch_size):
+            batch = names[start:start + batch_size]
+            existing = set(Ingredient.objects.filter(name__in=batch).values_list('name', flat=True))
+            Ingredient.objects.bulk_create([Ingredient(name=name) for name in batch if name not in existing])
+            ids.extend(Ingredient.objects.filter(name__in=batch).values_list('pk', flat=True))
+        return sorted(ids)
+
+    def _recipe_batch(self, numbers, seed, user_ids, ingredient_ids, per_recipe, comments, skip_search_index):
+        keys = {f'synthetic:{seed}:{number}': number for number in numbers}
+        existing = set(Recipe.all_objects.filter(import_key__in=list(keys)).values_list('import_key', flat=True))
+        new = {key: number for key, number in keys.items() if key not in existing}
+        if not new:
+            return 0
+        with transaction.atomic():
+            recipes = []
+            for key, number in new.items():
+                # osobne ziarno dla każdego przepisu, żeby wynik nie zależał od rozmiaru paczek
+                rng = random.Random(f'{seed}:{number}')
+                recipes.append(Recipe(
+                    import_key=key,
+                    title=f'{rng.choice(DISHES)} {rng.choice(ADJECTIVES)} {number}',
+                    instructions=' '.join(rng.choice(PRODUCTS) for _ in range(30)),
+                    preparation_time=rng.choice([None, 5, 10, 15, 20, 30, 45, 60, 90]),
+                    cooking_time=rng.choice([None, 0, 10, 20, 30, 45, 60, 120, 180]),
+                    number=rng.randint(1, 12),
+                    author_id=rng.choice(user_ids),
+                ))
+            Recipe.objects.bulk_create(recipes)
+            recipe_ids = dict(Recipe.objects.filter(import_key__in=list(new)).values_list('import_key', 'pk'))
+            rows, comment_rows = [], []
+            for key, number in new.items():
+                rng = random.Random(f'{seed}:{number}:rows')
+                for ingredient_id in rng.sample(ingredient_ids, min(per_recipe, len(ingredient_ids))):
+                    rows.append(IngredientInRecipe(recipe_id=recipe_ids[key], ingredient_id=ingredient_id,
+                                                   unit=rng.choice(UNITS),
+                                                   quantity=rng.randint(1, 2000)))
+                for comment in range(comments):
+                    comment_rows.append(Comment(recipe_id=recipe_ids[key], user_id=rng.choice(user_ids),
+                                                text=f'Komentarz {comment} do przepisu {number}'))
+            IngredientInRecipe.objects.bulk_create(rows, batch_size=5000)
+            Comment.objects.bulk_create(comment_rows, batch_size=5000)
+            counters.reconcile_recipes(list(recipe_ids.values()))
+            counters.reconcile_authors(user_ids)
+        if not skip_search_index:
+            refresh_index(list(recipe_ids.values()))
+        return len(new)
@@ -0,0 +1,39 @@
+import sys
+import time
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.transfer import FORMATS, guess_format, import_records, read_records
+
+
+class Command(BaseCommand):
+    """Importuje przepisy z pliku JSONL lub CSV paczkami, pomijając przepisy już zaimportowane."""
+    help = 'Importuje przepisy z pliku JSONL lub CSV (- oznacza standardowe wejście).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=FORMATS, help='Domyślnie według rozszerzenia pliku.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Liczba przepisów w jednej transakcji.')
+
+    def handle(self, *args, path, format, batch_size, **options):
+        format = format or guess_format(path)
+        stream = sys.stdin if path == '-' else open(path, encoding='utf-8', newline='')
+        started = time.monotonic()
+        read = created = 0
+        try:
+            for batch_read, batch_created in import_records(read_records(stream, format), batch_size):
+                read += batch_read
+                created += batch_created
+                self.stdout.write(f'Przeczytano {read}, dodano {created} ({self._rate(read, started)} wierszy/s)')
+        except ValidationError as error:
+            raise CommandError(error.messages[0])
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        self.stdout.write(self.style.SUCCESS(
+            f'Zaimportowano przepisów: {created}, pominięto istniejących: {read - created}, '
+            f'{self._rate(read, started)} wierszy/s'))
+
+    def _rate(self, count, started):
+        return round(count / max(time.monotonic() - started, 1e-6))
@@ -0,0 +1,30 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from recipes import deletion
+
+
+class Command(BaseCommand):
+    """Usuwa na stałe przepisy i konta usunięte miękko dawniej niż `DELETED_RETENTION_DAYS` dni.
+
+    Wiersze są usuwane surowymi DELETE w ograniczonych paczkach, każda w krótkiej
+    transakcji, więc polecenie można uruchamiać okresowo na działającej bazie.
+    """
+    help = 'Usuwa na stałe, paczkami, przepisy i konta usunięte przez użytkowników.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=deletion.BATCH_SIZE)
+        parser.add_argument('--days', type=float, default=None,
+                            help='Usuń dane usunięte dawniej niż tyle dni temu (domyślnie DELETED_RETENTION_DAYS).')
+
+    def handle(self, *args, batch_size, days, **options):
+        retention = deletion.retention() if days is None else datetime.timedelta(days=days)
+        before = timezone.now() - retention
+        recipes = 0
+        for count in deletion.purge_recipes(before, batch_size):
+            recipes += count
+            self.stdout.write(f'Usunięte przepisy: {recipes}')
+        accounts = sum(1 for _ in deletion.purge_accounts(before, batch_size))
+        self.stdout.write(self.style.SUCCESS(f'Usunięto na stałe przepisów: {recipes}, kont: {accounts}'))
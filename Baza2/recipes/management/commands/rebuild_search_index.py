@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import Recipe
+from recipes.search import refresh_index
+
+
+class Command(BaseCommand):
+    """Przebudowuje indeks wyszukiwania pełnotekstowego dla wszystkich przepisów."""
+    help = 'Przebudowuje indeks wyszukiwania pełnotekstowego przepisów.'
+
+    def handle(self, *args, **options):
+        recipe_ids = list(Recipe.objects.values_list('pk', flat=True))
+        refresh_index(recipe_ids)
+        self.stdout.write(self.style.SUCCESS(f'Zindeksowano przepisów: {len(recipe_ids)}'))
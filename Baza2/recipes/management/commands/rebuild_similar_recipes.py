@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.similar import rebuild
+
+
+class Command(BaseCommand):
+    """Przelicza podobne przepisy dla wszystkich przepisów z jednej macierzy składników w pamięci."""
+    help = 'Przelicza tabelę podobnych przepisów dla całego katalogu, paczkami.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, batch_size, **options):
+        started = time.monotonic()
+        done = 0
+        for count in rebuild(batch_size):
+            done += count
+            self.stdout.write(f'{done} przepisów ({round(done / (time.monotonic() - started))}/s)')
+        self.stdout.write(self.style.SUCCESS(f'Przeliczono przepisów: {done} w {time.monotonic() - started:.1f} s'))
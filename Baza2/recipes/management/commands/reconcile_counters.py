@@ -0,0 +1,37 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes import counters
+from recipes.models import Recipe
+
+
+def _id_batches(queryset, batch_size):
+    """Zwraca kolejne listy id po `batch_size`, czytane kursorem po kluczu głównym."""
+    last = 0
+    while ids := list(queryset.filter(pk__gt=last).order_by('pk').values_list('pk', flat=True)[:batch_size]):
+        yield ids
+        last = ids[-1]
+
+
+class Command(BaseCommand):
+    """Przelicza zdenormalizowane liczniki przepisów i autorów od zera i naprawia rozbieżności.
+
+    Każda paczka to kilka zapytań grupujących i jeden zbiorczy zapis w osobnej
+    transakcji, więc polecenie można uruchamiać na działającej bazie.
+    """
+    help = 'Naprawia liczniki komentarzy, składników i przepisów autorów, paczkami.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, batch_size, **options):
+        fixed_recipes = fixed_authors = 0
+        for recipe_ids in _id_batches(Recipe.objects.all(), batch_size):
+            with transaction.atomic():
+                fixed_recipes += counters.reconcile_recipes(recipe_ids)
+        for user_ids in _id_batches(User.objects.all(), batch_size):
+            with transaction.atomic():
+                fixed_authors += counters.reconcile_authors(user_ids)
+        self.stdout.write(self.style.SUCCESS(
+            f'Naprawiono liczniki przepisów: {fixed_recipes}, autorów: {fixed_authors}'))
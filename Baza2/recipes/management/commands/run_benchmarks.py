@@ -0,0 +1,60 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+
+from recipes.benchmark import VIEW_BUDGETS, run_view_benchmarks
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    """Uruchamia benchmarki widoków, zapisuje wyniki w JSON i kończy się błędem po przekroczeniu budżetu zapytań."""
+    help = 'Mierzy liczbę zapytań i czas odpowiedzi głównych widoków na bieżącej bazie danych.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipe', type=int, help='Przepis do benchmarków; domyślnie najnowszy ze składnikami.')
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--view', action='append', choices=[name for name, _, _ in VIEW_BUDGETS])
+        parser.add_argument('--output', help='Plik JSON, do którego trafią wyniki.')
+        parser.add_argument('--compare', help='Plik JSON z poprzedniego przebiegu do porównania.')
+
+    def _recipe(self, pk):
+        recipes = Recipe.objects.select_related('author')
+        recipe = (recipes.filter(pk=pk) if pk else recipes.filter(ingredients__isnull=False).order_by('-pk')).first()
+        if recipe is None:
+            raise CommandError('Brak przepisu do benchmarków; najpierw uruchom generate_catalogue.')
+        return recipe
+
+    def handle(self, *args, recipe, iterations, view, output, compare, **options):
+        recipe = self._recipe(recipe)
+        # DEBUG zapisuje każde zapytanie w connection.queries, co zafałszowałoby pomiar czasu
+        with override_settings(DEBUG=False, ALLOWED_HOSTS=['testserver']):
+            results = run_view_benchmarks(recipe, iterations=iterations, views=view)
+        report = {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'database': connection.vendor,
+            'recipes': Recipe.objects.count(),
+            'recipe': recipe.pk,
+            'iterations': iterations,
+            'views': results,
+        }
+        previous = {}
+        if compare:
+            with open(compare, encoding='utf-8') as stream:
+                previous = json.load(stream).get('views', {})
+        for name, result in results.items():
+            line = (f"{name:<14} zapytania {result['queries']:>3}/{result['query_budget']:<3} "
+                    f"mediana {result['median_ms']:>8.2f} ms  p95 {result['p95_ms']:>8.2f} ms")
+            if name in previous:
+                before = previous[name]
+                change = (result['median_ms'] - before['median_ms']) / before['median_ms'] * 100
+                line += f"  ({change:+.1f}% czasu, {result['queries'] - before['queries']:+d} zapytań)"
+            self.stdout.write(line)
+        if output:
+            with open(output, 'w', encoding='utf-8') as stream:
+                json.dump(report, stream, indent=2)
+        failed = [name for name, result in results.items() if result['over_budget'] or result['status'] >= 400]
+        if failed:
+            raise CommandError(f'Przekroczony budżet zapytań lub błąd odpowiedzi: {", ".join(failed)}')
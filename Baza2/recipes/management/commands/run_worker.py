@@ -0,0 +1,72 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+
+def _init_process():
+    # proces uruchomiony metodą spawn zaczyna od zera i musi sam skonfigurować Django
+    django.setup()
+
+
+def work(poll_interval, batch_size, once, stop=None):
+    """Pętla jednego workera: przydziela i wykonuje paczki zadań, a przy pustej kolejce czeka `poll_interval` s."""
+    # import dopiero tutaj, bo proces potomny wczytuje ten moduł przed django.setup()
+    from recipes.tasks import run_pending, worker_name
+
+    name = worker_name()
+    done = failed = 0
+    try:
+        while stop is None or not stop.is_set():
+            close_old_connections()
+            batch_done, batch_failed = run_pending(name, batch_size)
+            done, failed = done + batch_done, failed + batch_failed
+            if not batch_done and not batch_failed:
+                if once:
+                    break
+                time.sleep(poll_interval)
+    finally:
+        connections.close_all()
+    return done, failed
+
+
+class Command(BaseCommand):
+    """Uruchamia workery kolejki zadań w tle zapisanej w tabeli recipes_task.
+
+    Każdy wątek lub proces puli samodzielnie pobiera zadania z bazy, więc workery
+    można uruchamiać na kilku maszynach jednocześnie.
+    """
+    help = 'Wykonuje zadania w tle z kolejki w bazie danych.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=2, help='Liczba równoległych workerów.')
+        parser.add_argument('--pool', choices=['thread', 'process'], default='thread',
+                            help='Wątki wystarczą dla zadań czekających na bazę; procesy dla zadań liczących.')
+        parser.add_argument('--batch-size', type=int, default=10, help='Liczba zadań przydzielanych naraz.')
+        parser.add_argument('--poll-interval', type=float, default=1.0)
+        parser.add_argument('--once', action='store_true', help='Zakończ, gdy kolejka będzie pusta.')
+
+    def handle(self, *args, concurrency, pool, batch_size, poll_interval, once, **options):
+        stop = None
+        if pool == 'process':
+            executor = ProcessPoolExecutor(concurrency, mp_context=multiprocessing.get_context('spawn'),
+                                           initializer=_init_process)
+        else:
+            executor = ThreadPoolExecutor(concurrency)
+            stop = threading.Event()
+        self.stdout.write(f'Uruchamiam {concurrency} workerów ({pool})')
+        with executor:
+            futures = [executor.submit(work, poll_interval, batch_size, once, stop) for _ in range(concurrency)]
+            try:
+                results = [future.result() for future in futures]
+            except KeyboardInterrupt:
+                if stop is not None:
+                    stop.set()
+                raise
+        done = sum(result[0] for result in results)
+        failed = sum(result[1] for result in results)
+        self.stdout.write(self.style.SUCCESS(f'Wykonane zadania: {done}, nieudane próby: {failed}'))
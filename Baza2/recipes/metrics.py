@@ -0,0 +1,199 @@
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+UNRESOLVED = '<unresolved>'
+
+_current = ContextVar('recipes_request_metrics', default=None)
+
+
+class _RequestMetrics:
+    """Liczniki zapytań do bazy w trakcie jednego żądania."""
+    __slots__ = ('queries', 'db_seconds')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+def _record_query(execute, sql, params, many, context):
+    """Wrapper `execute_wrapper` doliczający zapytanie i jego czas do bieżącego żądania."""
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.db_seconds += time.perf_counter() - started
+        metrics.queries += 1
+
+
+def install(connection):
+    """Dodaje wrapper liczący zapytania do połączenia, jeśli jeszcze go nie ma."""
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+@receiver(connection_created)
+def install_on_new_connection(sender, connection, **kwargs):
+    """Instaluje wrapper w każdym nowym połączeniu, także w wątkach, w których działa asynchroniczny ORM."""
+    install(connection)
+
+
+class _ViewStats:
+    __slots__ = ('latency_buckets', 'latency_sum', 'query_buckets', 'queries', 'db_seconds', 'response_bytes',
+                 'count')
+
+    def __init__(self):
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.query_buckets = [0] * (len(QUERY_BUCKETS) + 1)
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.response_bytes = 0
+        self.count = 0
+
+    def as_dict(self):
+        return {name: list(value) if isinstance(value, list) else value
+                for name, value in ((name, getattr(self, name)) for name in self.__slots__)}
+
+
+class Registry:
+    """Zbiorcze statystyki żądań w pamięci procesu, pogrupowane według nazwy widoku z `recipes.urls`.
+
+    Zapis jednego żądania to kilka dodawań pod jedną blokadą, a histogramy mają stałe
+    przedziały, więc pamięć nie rośnie z liczbą żądań. Każdy proces serwera ma własne
+    statystyki, które Prometheus zbiera i sumuje osobno.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def record(self, view, seconds, queries, db_seconds, response_bytes):
+        latency_bucket = bisect_left(LATENCY_BUCKETS, seconds)
+        query_bucket = bisect_left(QUERY_BUCKETS, queries)
+        with self._lock:
+            stats = self._views.get(view)
+            if stats is None:
+                stats = self._views[view] = _ViewStats()
+            stats.latency_buckets[latency_bucket] += 1
+            stats.latency_sum += seconds
+            stats.query_buckets[query_bucket] += 1
+            stats.queries += queries
+            stats.db_seconds += db_seconds
+            stats.response_bytes += response_bytes
+            stats.count += 1
+
+    def reset(self):
+        with self._lock:
+            self._views = {}
+
+    def snapshot(self):
+        """Zwraca kopię statystyk jako słownik widok -> słownik wartości."""
+        with self._lock:
+            return {view: stats.as_dict() for view, stats in self._views.items()}
+
+
+registry = Registry()
+
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _histogram(lines, name, view, bounds, counts, total, count):
+    cumulative = 0
+    for bound, bucket_count in zip(bounds, counts):
+        cumulative += bucket_count
+        lines.append(f'{name}_bucket{{view="{view}",le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{view="{view}",le="+Inf"}} {count}')
+    lines.append(f'{name}_sum{{view="{view}"}} {total}')
+    lines.append(f'{name}_count{{view="{view}"}} {count}')
+
+
+METRICS = [
+    ('recipes_request_duration_seconds', 'histogram', 'Czas obsługi żądania w sekundach.'),
+    ('recipes_request_db_queries', 'histogram', 'Liczba zapytań do bazy w jednym żądaniu.'),
+    ('recipes_request_db_duration_seconds_total', 'counter', 'Łączny czas zapytań do bazy w sekundach.'),
+    ('recipes_response_size_bytes_total', 'counter', 'Łączny rozmiar odpowiedzi w bajtach.'),
+]
+
+
+def render_prometheus(snapshot=None):
+    """Zwraca statystyki w formacie tekstowym Prometheusa."""
+    snapshot = registry.snapshot() if snapshot is None else snapshot
+    lines = []
+    for name, kind, help_text in METRICS:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for view, stats in sorted(snapshot.items()):
+            label = _label(view)
+            if name == 'recipes_request_duration_seconds':
+                _histogram(lines, name, label, LATENCY_BUCKETS, stats['latency_buckets'],
+                           stats['latency_sum'], stats['count'])
+            elif name == 'recipes_request_db_queries':
+                _histogram(lines, name, label, QUERY_BUCKETS, stats['query_buckets'],
+                           stats['queries'], stats['count'])
+            elif name == 'recipes_request_db_duration_seconds_total':
+                lines.append(f'{name}{{view="{label}"}} {stats["db_seconds"]}')
+            else:
+                lines.append(f'{name}{{view="{label}"}} {stats["response_bytes"]}')
+    return '\n'.join(lines) + '\n'
+
+
+def _finish(request, response, started, metrics):
+    view = request.resolver_match.view_name if getattr(request, 'resolver_match', None) else UNRESOLVED
+    size = 0 if getattr(response, 'streaming', False) else len(response.content)
+    registry.record(view, time.perf_counter() - started, metrics.queries, metrics.db_seconds, size)
+
+
+class MetricsMiddleware:
+    """Mierzy czas, liczbę i czas zapytań do bazy oraz rozmiar odpowiedzi każdego żądania.
+
+    Zapytania są liczone wrapperem `execute_wrapper` zainstalowanym w połączeniach, a
+    liczniki bieżącego żądania są w zmiennej kontekstowej, więc trafiają do niego także
+    zapytania z wątków asynchronicznego ORM.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        for connection in connections.all(initialized_only=True):
+            install(connection)
+        metrics = _RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        _finish(request, response, started, metrics)
+        return response
+
+    async def __acall__(self, request):
+        metrics = _RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        _finish(request, response, started, metrics)
+        return response
@@ -0,0 +1,51 @@
+from django.db import migrations
+
+
+POSTGRES_CREATE = [
+    'CREATE TABLE recipes_recipesearch ('
+    ' recipe_id bigint PRIMARY KEY REFERENCES recipes_recipe (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,'
+    ' document tsvector NOT NULL)',
+    'CREATE INDEX recipes_recipesearch_document_gin ON recipes_recipesearch USING GIN (document)',
+    'INSERT INTO recipes_recipesearch (recipe_id, document) '
+    "SELECT r.id, setweight(to_tsvector('simple', r.title), 'A') "
+    "|| setweight(to_tsvector('simple', COALESCE(string_agg(i.name, ' '), '')), 'B') "
+    "|| setweight(to_tsvector('simple', r.instructions), 'C') "
+    'FROM recipes_recipe r '
+    'LEFT JOIN recipes_ingredientinrecipe ir ON ir.recipe_id = r.id '
+    'LEFT JOIN recipes_ingredient i ON i.id = ir.ingredient_id '
+    'GROUP BY r.id',
+]
+
+SQLITE_CREATE = [
+    'CREATE VIRTUAL TABLE recipes_recipesearch USING fts5('
+    ' title, ingredients, instructions, tokenize = "unicode61 remove_diacritics 2")',
+    'INSERT INTO recipes_recipesearch (rowid, title, ingredients, instructions) '
+    "SELECT r.id, r.title, COALESCE(GROUP_CONCAT(i.name, ' '), ''), r.instructions "
+    'FROM recipes_recipe r '
+    'LEFT JOIN recipes_ingredientinrecipe ir ON ir.recipe_id = r.id '
+    'LEFT JOIN recipes_ingredient i ON i.id = ir.ingredient_id '
+    'GROUP BY r.id',
+]
+
+CREATE = {'postgresql': POSTGRES_CREATE, 'sqlite': SQLITE_CREATE}
+
+
+def create_search_index(apps, schema_editor):
+    for statement in CREATE.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in CREATE:
+        schema_editor.execute('DROP TABLE IF EXISTS recipes_recipesearch')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
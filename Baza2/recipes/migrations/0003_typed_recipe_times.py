@@ -0,0 +1,167 @@
+import re
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+# kopie parserów z recipes/durations.py z chwili tej migracji, żeby późniejsze zmiany ich nie dotyczyły
+HOUR_UNITS = ('h', 'godz')
+DURATION_RE = re.compile(r'(\d+(?:[.,]\d+)?)\s*([^\d\s.,]*)')
+NUMBER_RE = re.compile(r'\d+')
+
+
+def parse_minutes(text):
+    if text is None:
+        return None
+    parts = DURATION_RE.findall(str(text).lower())
+    if not parts:
+        return None
+    total = 0
+    for number, unit in parts:
+        value = float(number.replace(',', '.'))
+        total += value * 60 if unit.startswith(HOUR_UNITS) else value
+    return round(total)
+
+
+def parse_servings(text):
+    if text is None:
+        return None
+    match = NUMBER_RE.search(str(text))
+    return int(match.group()) if match else None
+
+
+def batches(queryset):
+    # kolejne paczki po kluczu, żeby nie wczytywać całej tabeli naraz
+    last_pk = 0
+    while batch := list(queryset.filter(pk__gt=last_pk).order_by('pk')[:BATCH_SIZE]):
+        yield batch
+        last_pk = batch[-1].pk
+
+
+def parse_recipe_times(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    for recipes in batches(Recipe.objects.only('preparation_time', 'cooking_time', 'number')):
+        for recipe in recipes:
+            recipe.preparation_minutes = parse_minutes(recipe.preparation_time)
+            recipe.cooking_minutes = parse_minutes(recipe.cooking_time)
+            recipe.servings = parse_servings(recipe.number)
+        Recipe.objects.bulk_update(recipes, ['preparation_minutes', 'cooking_minutes', 'servings'])
+
+
+def format_recipe_times(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    for recipes in batches(Recipe.objects.only('preparation_minutes', 'cooking_minutes', 'servings')):
+        for recipe in recipes:
+            recipe.preparation_time = '' if recipe.preparation_minutes is None else f'{recipe.preparation_minutes} min'
+            recipe.cooking_time = '' if recipe.cooking_minutes is None else f'{recipe.cooking_minutes} min'
+            recipe.number = '' if recipe.servings is None else str(recipe.servings)
+        Recipe.objects.bulk_update(recipes, ['preparation_time', 'cooking_time', 'number'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0002_recipe_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='preparation_minutes',
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='cooking_minutes',
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='servings',
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.RunPython(parse_recipe_times, format_recipe_times),
+        # domyślne wartości pozwalają odtworzyć stare kolumny przy cofaniu migracji
+        migrations.AlterField(
+            model_name='recipe',
+            name='preparation_time',
+            field=models.CharField(default='', max_length=100, verbose_name='Czas przygotowania'),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='cooking_time',
+            field=models.CharField(default='', max_length=100, verbose_name='Czas pieczenia/gotowania/smażenia'),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='number',
+            field=models.CharField(default='', max_length=100, verbose_name='Liczba porcji'),
+        ),
+        migrations.RemoveField(
+            model_name='recipe',
+            name='preparation_time',
+        ),
+        migrations.RemoveField(
+            model_name='recipe',
+            name='cooking_time',
+        ),
+        migrations.RemoveField(
+            model_name='recipe',
+            name='number',
+        ),
+        migrations.RenameField(
+            model_name='recipe',
+            old_name='preparation_minutes',
+            new_name='preparation_time',
+        ),
+        migrations.RenameField(
+            model_name='recipe',
+            old_name='cooking_minutes',
+            new_name='cooking_time',
+        ),
+        migrations.RenameField(
+            model_name='recipe',
+            old_name='servings',
+            new_name='number',
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='preparation_time',
+            field=models.PositiveIntegerField(null=True, verbose_name='Czas przygotowania (min)'),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='cooking_time',
+            field=models.PositiveIntegerField(null=True, verbose_name='Czas pieczenia/gotowania/smażenia (min)'),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='number',
+            field=models.PositiveIntegerField(null=True, verbose_name='Liczba porcji'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='total_time',
+            field=models.GeneratedField(
+                db_persist=True,
+                expression=models.F('preparation_time') + models.F('cooking_time'),
+                output_field=models.PositiveIntegerField(null=True),
+                verbose_name='Łączny czas (min)',
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['total_time', 'id'], name='recipe_total_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['preparation_time', 'id'], name='recipe_preparation_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['number', 'id'], name='recipe_servings_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', 'total_time', 'id'], name='recipe_author_total_time_idx'),
+        ),
+    ]
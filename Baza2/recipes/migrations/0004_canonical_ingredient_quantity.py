@@ -0,0 +1,56 @@
+from decimal import Decimal
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+FACTORS = {'g': Decimal(1), 'kg': Decimal(1000), 'ml': Decimal(1), 'l': Decimal(1000)}
+
+
+def batches(queryset):
+    # kolejne paczki po kluczu, żeby nie wczytywać całej tabeli naraz
+    last_pk = 0
+    while batch := list(queryset.filter(pk__gt=last_pk).order_by('pk')[:BATCH_SIZE]):
+        yield batch
+        last_pk = batch[-1].pk
+
+
+def amount_to_quantity(apps, schema_editor):
+    IngredientInRecipe = apps.get_model('recipes', 'IngredientInRecipe')
+    for rows in batches(IngredientInRecipe.objects.only('amount', 'unit')):
+        for row in rows:
+            row.quantity = Decimal(row.amount) * FACTORS.get(row.unit, Decimal(1))
+        IngredientInRecipe.objects.bulk_update(rows, ['quantity'])
+
+
+def quantity_to_amount(apps, schema_editor):
+    IngredientInRecipe = apps.get_model('recipes', 'IngredientInRecipe')
+    for rows in batches(IngredientInRecipe.objects.only('quantity', 'unit')):
+        for row in rows:
+            row.amount = round(row.quantity / FACTORS.get(row.unit, Decimal(1)))
+        IngredientInRecipe.objects.bulk_update(rows, ['amount'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0003_typed_recipe_times'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredientinrecipe',
+            name='quantity',
+            field=models.DecimalField(decimal_places=3, max_digits=15, null=True, verbose_name='Ilość w g/ml'),
+        ),
+        migrations.RunPython(amount_to_quantity, quantity_to_amount),
+        migrations.RemoveField(
+            model_name='ingredientinrecipe',
+            name='amount',
+        ),
+        migrations.AlterField(
+            model_name='ingredientinrecipe',
+            name='quantity',
+            field=models.DecimalField(decimal_places=3, default=0, max_digits=15, verbose_name='Ilość w g/ml'),
+            preserve_default=False,
+        ),
+    ]
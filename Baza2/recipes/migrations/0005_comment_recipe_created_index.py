@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:55
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_canonical_ingredient_quantity'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['recipe', '-created_at', '-id'], name='comment_recipe_created_idx'),
+        ),
+    ]
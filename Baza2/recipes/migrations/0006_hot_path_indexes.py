@@ -0,0 +1,84 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:57
+
+import django.db.models.deletion
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+POSTGRES_TRIGRAM_INDEXES = [
+    ('recipe_title_trgm_idx', 'recipes_recipe', 'title'),
+    ('ingredient_name_trgm_idx', 'recipes_ingredient', 'name'),
+]
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    """Łączy powtórzone wiersze (przepis, składnik, jednostka) w jeden, sumując ilości."""
+    IngredientInRecipe = apps.get_model('recipes', 'IngredientInRecipe')
+    duplicates = (IngredientInRecipe.objects.values('recipe_id', 'ingredient_id', 'unit')
+                  .annotate(rows=Count('id'), total=Sum('quantity'), keep=Min('id')).filter(rows__gt=1))
+    for group in duplicates:
+        same = IngredientInRecipe.objects.filter(
+            recipe_id=group['recipe_id'], ingredient_id=group['ingredient_id'], unit=group['unit'])
+        same.filter(pk=group['keep']).update(quantity=group['total'])
+        same.exclude(pk=group['keep']).delete()
+
+
+def create_trigram_indexes(apps, schema_editor):
+    """Na PostgreSQL dodaje indeksy trigramowe na UPPER(kolumna::text), czyli wyrażeniu, którego Django używa w icontains."""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, table, column in POSTGRES_TRIGRAM_INDEXES:
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} USING gin (UPPER({column}::text) gin_trgm_ops)')
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _, _ in POSTGRES_TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_comment_recipe_created_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_ingredients, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='ingredient',
+            index=models.Index(django.db.models.functions.text.Upper('name'), name='ingredient_name_upper_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ingredientinrecipe',
+            index=models.Index(fields=['ingredient', 'recipe'], name='ingredient_recipe_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', '-id'], name='recipe_author_id_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='ingredientinrecipe',
+            constraint=models.UniqueConstraint(fields=('recipe', 'ingredient', 'unit'), name='unique_ingredient_unit_in_recipe'),
+        ),
+        migrations.AlterField(
+            model_name='ingredientinrecipe',
+            name='ingredient',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='recipes.ingredient'),
+        ),
+        migrations.AlterField(
+            model_name='ingredientinrecipe',
+            name='recipe',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='recipes.recipe'),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='author',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Autor'),
+        ),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+BATCH_SIZE = 5000
+
+
+def _count(queryset, field):
+    return Coalesce(Subquery(queryset.filter(**{field: OuterRef('pk')}).order_by().values(field)
+                             .annotate(count=Count('pk')).values('count'), output_field=IntegerField()), 0)
+
+
+def fill_counters(apps, schema_editor):
+    """Wypełnia liczniki istniejących przepisów i autorów zapytaniami UPDATE po zakresach id."""
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Comment = apps.get_model('recipes', 'Comment')
+    IngredientInRecipe = apps.get_model('recipes', 'IngredientInRecipe')
+    AuthorStats = apps.get_model('recipes', 'AuthorStats')
+    last_comment = (Comment.objects.filter(recipe=OuterRef('pk')).order_by().values('recipe')
+                    .annotate(latest=Max('created_at')).values('latest'))
+    highest = Recipe.objects.aggregate(highest=Max('pk'))['highest'] or 0
+    for start in range(0, highest, BATCH_SIZE):
+        Recipe.objects.filter(pk__gt=start, pk__lte=start + BATCH_SIZE).update(
+            comment_count=_count(Comment.objects, 'recipe'),
+            ingredient_count=_count(IngredientInRecipe.objects, 'recipe'),
+            last_commented_at=Subquery(last_comment),
+        )
+    recipe_counts = Recipe.objects.values('author').annotate(count=Count('pk')).order_by()
+    AuthorStats.objects.bulk_create(
+        [AuthorStats(user_id=row['author'], recipe_count=row['count']) for row in recipe_counts.iterator()],
+        batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('recipes', '0007_recipe_import_key'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthorStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='author_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('recipe_count', models.PositiveIntegerField(default=0, verbose_name='Liczba przepisów')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Liczba komentarzy'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='ingredient_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Liczba składników'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='last_commented_at',
+            field=models.DateTimeField(editable=False, null=True, verbose_name='Ostatni komentarz'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['comment_count', 'id'], name='recipe_comment_count_idx'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:31
+
+import recipes.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_task'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='photo',
+            field=models.ImageField(blank=True, height_field='photo_height', upload_to=recipes.models.photo_upload_to, verbose_name='Zdjęcie', width_field='photo_width'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='photo_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='photo_height',
+            field=models.PositiveIntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='photo_width',
+            field=models.PositiveIntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='thumbnails_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+    ]
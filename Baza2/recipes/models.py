@@ -1,10 +1,42 @@
+import hashlib
+from decimal import Decimal
+
 from django.db import models
+from django.db.models.functions import Upper
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+from . import units
+
+LATEST_COMMENTS = 3
+# pola utrzymywane osobno (liczniki przez recipes.counters, miniatury przez recipes.photos,
+# usunięcie przez recipes.deletion), których zwykły zapis przepisu nie nadpisuje
+DERIVED_FIELDS = ('comment_count', 'ingredient_count', 'last_commented_at', 'thumbnails_hash', 'deleted_at')
+
+
+def photo_upload_to(recipe, filename):
+    """Nazwa pliku zdjęcia to skrót jego treści, więc to samo zdjęcie zawsze trafia pod ten sam adres."""
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else 'jpg'
+    return f'photos/{recipe.photo_hash[:2]}/{recipe.photo_hash}.{extension}'
+
+
+def _content_hash(file):
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
 
 
 class Ingredient(models.Model):
     """Klasa reprezentująca składnik, który może być przypisany do wielu przepisów."""
     name = models.CharField(max_length=100, verbose_name='Składnik')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Zmieniono')
+
+    class Meta:
+        indexes = [
+            models.Index(Upper('name'), name='ingredient_name_upper_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -12,45 +44,181 @@ class Ingredient(models.Model):
 
 class Unit(models.Model):
     """Klasa reprezentująca jednostki miary"""
-    UNIT_CHOICES = [
-        ('g', 'g'),
-        ('kg', 'kg'),
-        ('ml', 'ml'),
-        ('l', 'l')
-    ]
+    UNIT_CHOICES = units.UNIT_CHOICES
     name = models.CharField(max_length=2, choices=UNIT_CHOICES, verbose_name='Jednostka miary')
 
     def __str__(self):
         return self.get_name_display()
 
 
+class RecipeQuerySet(models.QuerySet):
+    """Zapytania dla przepisów używane przez widoki list."""
+
+    def touch(self):
+        """Oznacza przepisy jako zmienione, gdy zmieniło się coś, co pokazują ich strony, np. komentarze."""
+        return self.update(updated_at=timezone.now())
+
+    def with_listing_data(self):
+        """Dołącza autora, składniki i najnowsze komentarze stałą liczbą zapytań, niezależnie od liczby przepisów."""
+        return self.select_related('author').prefetch_related(
+            models.Prefetch(
+                'ingredientinrecipe_set',
+                queryset=IngredientInRecipe.objects.select_related('ingredient'),
+            ),
+            models.Prefetch(
+                'comments',
+                queryset=Comment.objects.select_related('user').order_by('-created_at', '-pk')[:LATEST_COMMENTS],
+                to_attr='latest_comments',
+            ),
+        )
+
+
+class RecipeManager(models.Manager.from_queryset(RecipeQuerySet)):
+    """Domyślny menedżer przepisów, pomijający przepisy usunięte, które czekają na polecenie purge_deleted."""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
 class Recipe(models.Model):
     """Klasa reprezentująca przepis kulinarny z nazwą, instrukcją, czasami przygotowania i pieczenia, składnikami, liczbą porcji oraz autorem."""
     title = models.CharField(max_length=100, verbose_name='Nazwa przepisu')
     instructions = models.TextField(verbose_name='Instrukcje')
-    preparation_time = models.CharField(max_length=100, verbose_name='Czas przygotowania')
-    cooking_time = models.CharField(max_length=100, verbose_name='Czas pieczenia/gotowania/smażenia')
-    number = models.CharField(max_length=100, verbose_name='Liczba porcji')
-    author = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='Autor')
+    preparation_time = models.PositiveIntegerField(null=True, verbose_name='Czas przygotowania (min)')
+    cooking_time = models.PositiveIntegerField(null=True, verbose_name='Czas pieczenia/gotowania/smażenia (min)')
+    total_time = models.GeneratedField(
+        expression=models.F('preparation_time') + models.F('cooking_time'),
+        output_field=models.PositiveIntegerField(null=True),
+        db_persist=True,
+        verbose_name='Łączny czas (min)',
+    )
+    number = models.PositiveIntegerField(null=True, verbose_name='Liczba porcji')
+    # indeks na autorze zapewniają indeksy złożone zaczynające się od tej kolumny
+    author = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False, verbose_name='Autor')
     ingredients = models.ManyToManyField('Ingredient', through='IngredientInRecipe', verbose_name='Składniki')
+    # klucz z pliku importu, dzięki któremu ponowny import tego samego pliku niczego nie dubluje
+    import_key = models.CharField(max_length=100, null=True, blank=True, unique=True, editable=False)
+    comment_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='Liczba komentarzy')
+    ingredient_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='Liczba składników')
+    last_commented_at = models.DateTimeField(null=True, editable=False, verbose_name='Ostatni komentarz')
+    photo = models.ImageField(upload_to=photo_upload_to, blank=True, width_field='photo_width',
+                              height_field='photo_height', verbose_name='Zdjęcie')
+    photo_width = models.PositiveIntegerField(null=True, editable=False)
+    photo_height = models.PositiveIntegerField(null=True, editable=False)
+    # SHA-256 treści zdjęcia oraz skrót zdjęcia, dla którego miniatury są już gotowe
+    photo_hash = models.CharField(max_length=64, blank=True, editable=False)
+    thumbnails_hash = models.CharField(max_length=64, blank=True, editable=False)
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False, verbose_name='Usunięto')
+    # zmienia się także po zmianie składników, komentarzy, miniatur i podobnych przepisów;
+    # od niej zależą nagłówki ETag i Last-Modified stron
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Zmieniono')
+
+    objects = RecipeManager()
+    # także przepisy usunięte, np. do sprawdzania kluczy importu i do purge_deleted
+    all_objects = RecipeQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['total_time', 'id'], name='recipe_total_time_idx'),
+            models.Index(fields=['preparation_time', 'id'], name='recipe_preparation_time_idx'),
+            models.Index(fields=['number', 'id'], name='recipe_servings_idx'),
+            models.Index(fields=['author', 'total_time', 'id'], name='recipe_author_total_time_idx'),
+            models.Index(fields=['author', '-id'], name='recipe_author_id_idx'),
+            models.Index(fields=['comment_count', 'id'], name='recipe_comment_count_idx'),
+            # usuniętych przepisów jest niewiele, więc indeks częściowy jest mały
+            models.Index(fields=['deleted_at', 'id'], condition=models.Q(deleted_at__isnull=False),
+                         name='recipe_deleted_at_idx'),
+            models.Index(fields=['updated_at'], name='recipe_updated_at_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        """Zapisuje przepis, pomijając przy zmianie pola pochodne, żeby nie nadpisać ich wartością sprzed odczytu.
+
+        Nowo przesłane zdjęcie dostaje skrót treści, liczony po kawałkach pliku.
+        """
+        if self.photo and not self.photo._committed:
+            self.photo_hash = getattr(self.photo.file, 'content_hash', None) or _content_hash(self.photo)
+        elif not self.photo:
+            self.photo_hash = ''
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and not field.generated
+                                       and field.name not in DERIVED_FIELDS]
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.title
 
 
+class AuthorStats(models.Model):
+    """Liczniki użytkownika jako autora, utrzymywane przez recipes.counters."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='author_stats')
+    recipe_count = models.PositiveIntegerField(default=0, verbose_name='Liczba przepisów')
+
+    def __str__(self):
+        return f'Statystyki {self.user}'
+
+
+class DeletedAccount(models.Model):
+    """Konto usunięte przez użytkownika; nieaktywne konto razem z jego danymi usuwa na stałe polecenie purge_deleted."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='deletion')
+    deleted_at = models.DateTimeField(default=timezone.now, db_index=True, verbose_name='Usunięto')
+
+    def __str__(self):
+        return f'Usunięte konto {self.user}'
+
+
+class IngredientInRecipeQuerySet(models.QuerySet):
+    """Zapytania dla składników przepisu."""
+
+    def with_display_amounts(self, scale=1):
+        """Dodaje `display_amount`: ilość przeskalowaną o `scale` i przeliczoną na jednostkę wyświetlania.
+
+        Przeliczenie odbywa się w bazie danych na ilościach w jednostkach bazowych,
+        jednym zapytaniem dla wszystkich składników.
+        """
+        unit_factor = models.Case(
+            *[models.When(unit=unit, then=models.Value(factor)) for unit, (_, factor) in units.UNITS.items()],
+            output_field=models.DecimalField(),
+        )
+        return self.annotate(display_amount=models.ExpressionWrapper(
+            models.F('quantity') * models.Value(Decimal(scale)) / unit_factor,
+            output_field=models.DecimalField(max_digits=18, decimal_places=3),
+        ))
+
+
 class IngredientInRecipe(models.Model):
-    """Klasa reprezentująca składnik w przepisie"""
-    UNIT_CHOICES = [
-        ('g', 'g'),
-        ('kg', 'kg'),
-        ('ml', 'ml'),
-        ('l', 'l')
-    ]
-    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE)
-    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
-    amount = models.IntegerField(verbose_name='Ilość', default=1)
+    """Klasa reprezentująca składnik w przepisie.
+
+    Ilość przechowywana jest w jednostkach bazowych (gramach lub mililitrach) w polu
+    `quantity`, a `unit` to jednostka, w której składnik jest wyświetlany.
+    """
+    UNIT_CHOICES = units.UNIT_CHOICES
+    # pojedyncze indeksy kluczy obcych zastępują indeks ingredient_recipe_idx i ograniczenie unikalności
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE, db_index=False)
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE, db_index=False)
+    quantity = models.DecimalField(max_digits=15, decimal_places=3, verbose_name='Ilość w g/ml')
     unit = models.CharField(max_length=2, choices=UNIT_CHOICES, verbose_name='Jednostka miary')
 
+    objects = IngredientInRecipeQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['recipe', 'ingredient', 'unit'], name='unique_ingredient_unit_in_recipe'),
+        ]
+        indexes = [
+            models.Index(fields=['ingredient', 'recipe'], name='ingredient_recipe_idx'),
+        ]
+
+    @property
+    def amount(self):
+        """Ilość w jednostce wyświetlania."""
+        return units.from_base(self.quantity, self.unit)
+
+    @amount.setter
+    def amount(self, value):
+        self.quantity = units.to_base(value, self.unit)
+
     def __str__(self):
         return f"{self.ingredient.name} w {self.recipe.title}"
 
@@ -61,6 +229,58 @@ class Comment(models.Model):
     recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE, related_name='comments', verbose_name='Przepis')
     text = models.TextField(verbose_name='Treść komentarza')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Data utworzenia')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Zmieniono')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['recipe', '-created_at', '-id'], name='comment_recipe_created_idx'),
+        ]
 
     def __str__(self):
         return f'Komentarz do {self.recipe.title}'
+
+
+class SimilarRecipe(models.Model):
+    """Przepis podobny do danego pod względem składników, z miarą podobieństwa Jaccarda; wyliczany przez recipes.similar."""
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE, related_name='similar_links')
+    similar = models.ForeignKey(Recipe, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField(verbose_name='Podobieństwo')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['recipe', 'similar'], name='unique_similar_recipe'),
+        ]
+
+    def __str__(self):
+        return f'{self.similar.title} podobny do {self.recipe.title}'
+
+
+class Task(models.Model):
+    """Zadanie w tle zapisane w bazie, wykonywane przez polecenie run_worker (recipes.tasks)."""
+    PENDING, RUNNING, FAILED = 'pending', 'running', 'failed'
+    STATUS_CHOICES = [(PENDING, 'Oczekuje'), (RUNNING, 'W trakcie'), (FAILED, 'Nieudane')]
+
+    name = models.CharField(max_length=200, verbose_name='Funkcja')
+    args = models.JSONField(default=list, verbose_name='Argumenty')
+    # skrót nazwy i argumentów; drugie takie samo zadanie nie trafia do kolejki, dopóki pierwsze czeka
+    dedup_key = models.CharField(max_length=64)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(verbose_name='Nie wcześniej niż')
+    locked_at = models.DateTimeField(null=True, blank=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['dedup_key'], condition=models.Q(status='pending'),
+                                    name='unique_pending_task'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'run_at', 'id'], name='task_status_run_at_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.name} ({self.get_status_display()})'
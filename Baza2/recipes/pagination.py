@@ -0,0 +1,139 @@
+import base64
+import binascii
+import datetime
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+PAGE_SIZE = 20
+# dalsze strony wyników nie są pokazywane, a bez limitu przesunięcie nie mieściłoby się w LIMIT/OFFSET
+MAX_PAGE = 500
+# największa wartość klucza BigAutoField; większe id nie mieszczą się w zapytaniu
+MAX_ID = 2 ** 63 - 1
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """Koder JSON zachowujący pełną precyzję dat, bez której kursor po dacie gubiłby obiekty."""
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def parse_int(value):
+    """Zamienia parametr GET na liczbę całkowitą lub zwraca None, gdy jest pusty lub błędny."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_id(value):
+    """Zamienia parametr GET na id obiektu lub zwraca None, gdy jest błędny albo spoza zakresu klucza."""
+    value = parse_int(value)
+    return value if value is not None and 0 < value <= MAX_ID else None
+
+
+def parse_page(value):
+    """Zamienia parametr GET na numer strony z zakresu od 1 do MAX_PAGE."""
+    return min(max(parse_int(value) or 1, 1), MAX_PAGE)
+
+
+def encode_cursor(values):
+    """Koduje wartości kluczy sortowania ostatniego obiektu strony jako kursor do użycia w adresie URL."""
+    return base64.urlsafe_b64encode(json.dumps(values, cls=CursorEncoder).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, fields=None):
+    """Odczytuje wartości kluczy sortowania z kursora lub zwraca None, gdy kursor jest pusty lub błędny.
+
+    Z listą pól modelu `fields`, po jednym na klucz sortowania, sprawdza też liczbę wartości
+    i zamienia każdą na typ swojego pola; kursor z wartością, której pole nie przyjmie, np.
+    tekstem zamiast daty albo liczbą spoza zakresu kolumny, jest błędny.
+    """
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    if not isinstance(values, list):
+        return None
+    if fields is None:
+        return values
+    if len(values) != len(fields):
+        return None
+    parsed = []
+    for field, value in zip(fields, values):
+        try:
+            value = field.to_python(value)
+            if value is None or isinstance(value, (list, dict)):
+                return None
+            field.run_validators(value)
+        except (ValidationError, TypeError, ValueError):
+            return None
+        parsed.append(value)
+    return parsed
+
+
+def _sort_field(model, name):
+    field = model._meta.pk if name == 'pk' else model._meta.get_field(name)
+    # kolumna generowana ma typ pola wyniku
+    return getattr(field, 'output_field', None) or field
+
+
+def _after(ordering, values):
+    """Buduje warunek "za kursorem" dla sortowania po kilku polach, np. (a > x) OR (a = x AND pk > y)."""
+    condition = Q()
+    equal = Q()
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= equal & Q(**{f'{name}__{lookup}': value})
+        equal &= Q(**{name: value})
+    return condition
+
+
+def _field_value(item, name):
+    return item[name] if isinstance(item, dict) else getattr(item, name)
+
+
+def _keyset_queryset(queryset, after, page_size, ordering):
+    for field in ordering[:-1]:
+        queryset = queryset.filter(**{f'{field.lstrip("-")}__isnull': False})
+    queryset = queryset.order_by(*ordering)
+    values = decode_cursor(after, [_sort_field(queryset.model, field.lstrip('-')) for field in ordering])
+    if values is not None:
+        queryset = queryset.filter(_after(ordering, values))
+    return queryset[:page_size + 1]
+
+
+def _keyset_page(items, page_size, ordering):
+    next_cursor = None
+    if len(items) > page_size:
+        last = items[page_size - 1]
+        next_cursor = encode_cursor([_field_value(last, field.lstrip('-')) for field in ordering])
+    return items[:page_size], next_cursor
+
+
+def keyset_paginate(queryset, after=None, page_size=PAGE_SIZE, ordering=('-pk',)):
+    """Zwraca stronę obiektów oraz kursor następnej strony.
+
+    `ordering` to lista pól sortowania zakończona kluczem głównym, żeby kolejność była
+    jednoznaczna. Kursor zawiera wartości tych pól dla ostatniego obiektu na stronie, więc
+    kolejna strona to zapytanie "za kursorem" z LIMIT obsługiwane przez indeks złożony
+    z tych samych pól, bez względu na to, jak daleko od początku się znajduje.
+    Obiekty z pustą wartością w polu sortowania są pomijane. Zapytanie może zwracać
+    słowniki z `.values()`, jeśli zawierają wszystkie pola sortowania.
+    """
+    items = list(_keyset_queryset(queryset, after, page_size, ordering))
+    return _keyset_page(items, page_size, ordering)
+
+
+async def akeyset_paginate(queryset, after=None, page_size=PAGE_SIZE, ordering=('-pk',)):
+    """Asynchroniczna wersja `keyset_paginate` dla widoków ASGI."""
+    items = [item async for item in _keyset_queryset(queryset, after, page_size, ordering)]
+    return _keyset_page(items, page_size, ordering)
@@ -0,0 +1,139 @@
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+from django.conf import settings
+
+from .batching import defer_until_commit
+from .models import IngredientInRecipe, Recipe
+from .pagination import MAX_PAGE, PAGE_SIZE
+
+
+def _insert(postings, recipe_id):
+    position = bisect_left(postings, recipe_id)
+    if position == len(postings) or postings[position] != recipe_id:
+        postings.insert(position, recipe_id)
+
+
+def _remove(postings, recipe_id):
+    position = bisect_left(postings, recipe_id)
+    if position < len(postings) and postings[position] == recipe_id:
+        del postings[position]
+
+
+class PantryIndex:
+    """Indeks odwrócony składnik -> posortowana tablica id przepisów, trzymany w pamięci procesu.
+
+    Obok list przepisów dla składników indeks pamięta zbiór składników każdego przepisu,
+    więc zmiana jednego przepisu aktualizuje tylko jego wpisy. Indeks jest budowany przy
+    pierwszym użyciu i przebudowywany po `PANTRY_INDEX_MAX_AGE` sekundach, żeby procesy,
+    które nie widziały sygnałów z innych procesów, nie rozjechały się z bazą na stałe.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings = {}
+        self._recipes = {}
+        self._built_at = None
+
+    @property
+    def max_age(self):
+        return getattr(settings, 'PANTRY_INDEX_MAX_AGE', 300)
+
+    def build(self):
+        """Buduje indeks od nowa jednym przebiegiem po tabeli IngredientInRecipe."""
+        postings = {}
+        recipes = {}
+        rows = (IngredientInRecipe.objects.filter(recipe__deleted_at__isnull=True).order_by('recipe_id')
+                .values_list('recipe_id', 'ingredient_id').distinct().iterator(chunk_size=10000))
+        for recipe_id, ingredient_id in rows:
+            postings.setdefault(ingredient_id, array('q')).append(recipe_id)
+            recipes.setdefault(recipe_id, set()).add(ingredient_id)
+        with self._lock:
+            self._postings = postings
+            self._recipes = {recipe_id: frozenset(ids) for recipe_id, ids in recipes.items()}
+            self._built_at = time.monotonic()
+
+    def ensure_built(self):
+        """Buduje indeks, jeśli jeszcze nie istnieje lub jest starszy niż dopuszcza konfiguracja."""
+        if self._built_at is None or time.monotonic() - self._built_at > self.max_age:
+            self.build()
+
+    def set_recipe(self, recipe_id, ingredient_ids):
+        """Zastępuje zbiór składników przepisu; pusty zbiór usuwa przepis z indeksu."""
+        ingredient_ids = frozenset(ingredient_ids)
+        with self._lock:
+            previous = self._recipes.pop(recipe_id, frozenset())
+            for ingredient_id in previous - ingredient_ids:
+                _remove(self._postings[ingredient_id], recipe_id)
+            for ingredient_id in ingredient_ids - previous:
+                _insert(self._postings.setdefault(ingredient_id, array('q')), recipe_id)
+            if ingredient_ids:
+                self._recipes[recipe_id] = ingredient_ids
+
+    def refresh(self, recipe_ids):
+        """Wczytuje z bazy aktualne składniki podanych przepisów i aktualizuje ich wpisy."""
+        if self._built_at is None:
+            return
+        current = {recipe_id: set() for recipe_id in recipe_ids}
+        rows = (IngredientInRecipe.objects.filter(recipe_id__in=recipe_ids, recipe__deleted_at__isnull=True)
+                .values_list('recipe_id', 'ingredient_id'))
+        for recipe_id, ingredient_id in rows:
+            current[recipe_id].add(ingredient_id)
+        for recipe_id, ingredient_ids in current.items():
+            self.set_recipe(recipe_id, ingredient_ids)
+
+    def query(self, ingredient_ids, limit, offset=0):
+        """Zwraca listę (id_przepisu, liczba_posiadanych, liczba_brakujących) dla przepisów z choć jednym składnikiem.
+
+        Najpierw przepisy z najmniejszą liczbą brakujących składników, potem z największym
+        pokryciem, a przy remisie nowsze.
+        """
+        self.ensure_built()
+        with self._lock:
+            matched = Counter()
+            for ingredient_id in set(ingredient_ids):
+                matched.update(self._postings.get(ingredient_id, ()))
+            recipes = self._recipes
+            buckets = {}
+            for recipe_id, count in matched.items():
+                buckets.setdefault(len(recipes[recipe_id]) - count, []).append((recipe_id, count))
+        ranked = []
+        for missing in sorted(buckets):
+            # przy tej samej liczbie brakujących więcej posiadanych składników oznacza większe pokrycie
+            bucket = sorted(buckets[missing], key=lambda item: (-item[1], -item[0]))
+            ranked.extend((recipe_id, count, missing) for recipe_id, count in bucket)
+            if len(ranked) >= offset + limit:
+                break
+        return ranked[offset:offset + limit]
+
+
+pantry_index = PantryIndex()
+
+
+def find_recipes(ingredient_ids, page=1, page_size=PAGE_SIZE):
+    """Zwraca przepisy, które można przygotować z podanych składników, oraz informację, czy jest kolejna strona.
+
+    Każdy przepis ma dodane atrybuty `matched_count` i `missing_count`.
+    """
+    if not ingredient_ids:
+        return [], False
+    ranked = pantry_index.query(ingredient_ids, page_size + 1, (min(page, MAX_PAGE) - 1) * page_size)
+    has_next = len(ranked) > page_size
+    ranked = ranked[:page_size]
+    recipes = Recipe.objects.with_listing_data().in_bulk([recipe_id for recipe_id, _, _ in ranked])
+    results = []
+    for recipe_id, matched_count, missing_count in ranked:
+        recipe = recipes.get(recipe_id)
+        if recipe is not None:
+            recipe.matched_count = matched_count
+            recipe.missing_count = missing_count
+            results.append(recipe)
+    return results, has_next
+
+
+def schedule_refresh(recipe_ids):
+    """Odkłada aktualizację indeksu spiżarni do zatwierdzenia transakcji."""
+    defer_until_commit(pantry_index.refresh, recipe_ids)
@@ -0,0 +1,116 @@
+import hashlib
+import io
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import StopUpload, TemporaryFileUploadHandler
+from django.utils import timezone
+
+from .models import Recipe
+from .tasks import enqueue_on_commit, task
+
+THUMBNAIL_WIDTHS = (320, 640, 1280)
+# format zapisu Pillow, rozszerzenie i typ MIME; przeglądarki bez WebP dostają JPEG
+THUMBNAIL_FORMATS = [
+    ('WEBP', 'webp', 'image/webp', {'quality': 80, 'method': 4}),
+    ('JPEG', 'jpg', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}),
+]
+
+
+class HashingUploadHandler(TemporaryFileUploadHandler):
+    """Zapisuje przesyłany plik kawałkami do pliku tymczasowego, licząc po drodze SHA-256 jego treści.
+
+    Plik nigdy nie jest w całości w pamięci, a skrót jest gotowy bez ponownego czytania.
+    Przesyłanie przerywa się, gdy plik przekroczy `PHOTO_MAX_UPLOAD_SIZE` bajtów.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.digest = hashlib.sha256()
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > getattr(settings, 'PHOTO_MAX_UPLOAD_SIZE', 20 * 1024 * 1024):
+            self.file.close()
+            raise StopUpload(connection_reset=True)
+        self.digest.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded = super().file_complete(file_size)
+        uploaded.content_hash = self.digest.hexdigest()
+        return uploaded
+
+
+def thumbnail_widths(width):
+    """Szerokości miniatur zdjęcia o podanej szerokości; zdjęcia nie są powiększane."""
+    return [size for size in THUMBNAIL_WIDTHS if size <= width] or [width]
+
+
+def thumbnail_name(photo_hash, width, extension):
+    return f'thumbnails/{photo_hash[:2]}/{photo_hash}/{width}.{extension}'
+
+
+def sources(recipe):
+    """Zwraca listę (typ MIME, srcset) miniatur przepisu oraz adres najmniejszej miniatury JPEG.
+
+    Dopóki miniatury bieżącego zdjęcia nie są gotowe, zwraca ([], None), żeby lista nie
+    pobierała pełnego zdjęcia.
+    """
+    if not recipe.photo_hash or recipe.thumbnails_hash != recipe.photo_hash:
+        return [], None
+    widths = thumbnail_widths(recipe.photo_width)
+    result = [
+        (mime, ', '.join(f'{default_storage.url(thumbnail_name(recipe.photo_hash, width, extension))} {width}w'
+                         for width in widths))
+        for _, extension, mime, _ in THUMBNAIL_FORMATS
+    ]
+    return result, default_storage.url(thumbnail_name(recipe.photo_hash, widths[0], 'jpg'))
+
+
+def render_thumbnails(name, photo_hash):
+    """Tworzy brakujące miniatury zdjęcia; istniejące pliki o tym samym skrócie są pomijane."""
+    from PIL import Image, ImageOps
+
+    with default_storage.open(name) as original, Image.open(original) as image:
+        widths = thumbnail_widths(image.width)
+        missing = {(width, extension) for width in widths for _, extension, _, _ in THUMBNAIL_FORMATS
+                   if not default_storage.exists(thumbnail_name(photo_hash, width, extension))}
+        if not missing:
+            return 0
+        # JPEG można zdekodować od razu w mniejszej skali, co oszczędza pamięć i czas
+        image.draft('RGB', (max(widths), image.height * max(widths) // image.width))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        for width in sorted({width for width, _ in missing}, reverse=True):
+            # każda mniejsza miniatura powstaje z poprzedniej, a nie z pełnego zdjęcia
+            image = image.resize((width, max(1, round(image.height * width / image.width))),
+                                 Image.Resampling.LANCZOS, reducing_gap=3.0)
+            for pillow_format, extension, _, options in THUMBNAIL_FORMATS:
+                if (width, extension) in missing:
+                    buffer = io.BytesIO()
+                    image.save(buffer, pillow_format, **options)
+                    default_storage.save(thumbnail_name(photo_hash, width, extension),
+                                         ContentFile(buffer.getvalue()))
+    return len(missing)
+
+
+@task
+def generate_thumbnails(recipe_ids):
+    """Tworzy miniatury zdjęć podanych przepisów i oznacza je jako gotowe, jeśli zdjęcie w międzyczasie się nie zmieniło.
+
+    Zadanie działa w workerze, więc strony przepisów zmienia tylko nowy updated_at, od
+    którego zależą klucze pamięci podręcznej we wszystkich procesach.
+    """
+    photos = (Recipe.objects.filter(pk__in=recipe_ids).exclude(photo='')
+              .values_list('pk', 'photo', 'photo_hash'))
+    for recipe_id, name, photo_hash in photos:
+        render_thumbnails(name, photo_hash)
+        Recipe.objects.filter(pk=recipe_id, photo_hash=photo_hash).update(thumbnails_hash=photo_hash,
+                                                                          updated_at=timezone.now())
+
+
+def schedule_thumbnails(recipe_ids):
+    """Po zatwierdzeniu transakcji dodaje do kolejki tworzenie miniatur."""
+    enqueue_on_commit(generate_thumbnails, recipe_ids)
@@ -0,0 +1,151 @@
+import random
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+PRIMARY_COOKIE = 'db_primary_until'
+SAFE_METHODS = ('GET', 'HEAD')
+# modele tej aplikacji mogą być czytane z replik; sesje i użytkownicy zawsze z bazy głównej,
+# żeby świeżo zalogowany użytkownik nie został wylogowany przez opóźnienie repliki
+REPLICA_APPS = {'recipes'}
+
+_current = ContextVar('recipes_db_routing', default=None)
+# repliki, które nie odpowiedziały, są pomijane do zapisanego czasu
+_unavailable = {}
+
+
+class _RoutingState:
+    """Stan wyboru bazy w trakcie jednego żądania."""
+    __slots__ = ('replica_allowed', 'replica', 'wrote')
+
+    def __init__(self, replica_allowed=False):
+        self.replica_allowed = replica_allowed
+        self.replica = None
+        self.wrote = False
+
+
+def replicas():
+    return list(getattr(settings, 'DATABASE_REPLICAS', ()))
+
+
+def _sticky_seconds():
+    return getattr(settings, 'DATABASE_PRIMARY_STICKY_SECONDS', 10)
+
+
+def _healthy(alias):
+    """Sprawdza, czy da się połączyć z repliką; niedostępna jest pomijana przez `DATABASE_REPLICA_RETRY` s."""
+    if _unavailable.get(alias, 0) > time.monotonic():
+        return False
+    try:
+        connections[alias].ensure_connection()
+    except DatabaseError:
+        _unavailable[alias] = time.monotonic() + getattr(settings, 'DATABASE_REPLICA_RETRY', 30)
+        return False
+    _unavailable.pop(alias, None)
+    return True
+
+
+def _choose_replica():
+    available = [alias for alias in replicas() if _healthy(alias)]
+    return random.choice(available) if available else DEFAULT_DB_ALIAS
+
+
+def replica_reads(view):
+    """Oznacza widok, który tylko czyta dane, więc przy GET i HEAD może czytać z repliki."""
+    view.replica_reads = True
+    return view
+
+
+class PrimaryReplicaRouter:
+    """Kieruje zapisy do bazy głównej, a odczyty widoków oznaczonych `replica_reads` do jednej z replik.
+
+    Poza żądaniami, np. w poleceniach i workerze kolejki, w transakcji i po zapisie w tym
+    samym żądaniu odczyty idą do bazy głównej. Replika jest wybierana raz na żądanie, żeby
+    wszystkie zapytania strony widziały ten sam stan danych.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _current.get()
+        if (state is None or not state.replica_allowed or state.wrote
+                or model._meta.app_label not in REPLICA_APPS
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return DEFAULT_DB_ALIAS
+        if state.replica is None:
+            state.replica = _choose_replica()
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _current.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # repliki dostają schemat przez replikację z bazy głównej
+        return False if db in replicas() else None
+
+
+def _sticky(request):
+    try:
+        return float(request.COOKIES.get(PRIMARY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+class ReplicaRoutingMiddleware:
+    """Zapewnia, że użytkownik widzi własne zapisy: po żądaniu, które coś zapisało, przez
+    `DATABASE_PRIMARY_STICKY_SECONDS` s jego odczyty idą do bazy głównej.
+
+    Czas jest w ciasteczku, więc działa także dla niezalogowanych i nie wymaga sesji.
+    Strony z ciasteczkiem nie trafiają do pamięci podręcznej `cache_anonymous_page`.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = _RoutingState()
+        token = _current.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(state, response)
+
+    async def __acall__(self, request):
+        state = _RoutingState()
+        token = _current.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(state, response)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = _current.get()
+        if state is not None:
+            state.replica_allowed = (getattr(view_func, 'replica_reads', False) and request.method in SAFE_METHODS
+                                     and not _sticky(request))
+        return None
+
+    def _finish(self, state, response):
+        if state.wrote and replicas():
+            seconds = _sticky_seconds()
+            response.set_cookie(PRIMARY_COOKIE, f'{time.time() + seconds:.0f}', max_age=seconds,
+                                httponly=True, samesite='Lax')
+        return response
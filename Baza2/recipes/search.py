@@ -0,0 +1,199 @@
+import re
+
+from asgiref.sync import sync_to_async
+from django.db import connection, connections, router
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Recipe
+from .pagination import MAX_PAGE, PAGE_SIZE
+from .tasks import enqueue_on_commit, task
+
+SEARCH_TABLE = 'recipes_recipesearch'
+MAX_TERMS = 8
+BATCH_SIZE = 500
+TERM_RE = re.compile(r'\w+')
+
+
+def parse_terms(query):
+    """Dzieli zapytanie użytkownika na słowa, które można bezpiecznie przekazać do silnika wyszukiwania."""
+    return TERM_RE.findall((query or '').lower())[:MAX_TERMS]
+
+
+def _placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+
+def _restriction(column, queryset):
+    """Zwraca fragment SQL ograniczający wyniki do id przepisów z podanego zapytania ORM."""
+    if queryset is None:
+        return '', []
+    sql, params = queryset.values('pk').query.sql_with_params()
+    return f' AND {column} IN ({sql})', list(params)
+
+
+def _batches(values):
+    values = list(values)
+    for start in range(0, len(values), BATCH_SIZE):
+        yield values[start:start + BATCH_SIZE]
+
+
+class PostgresSearchBackend:
+    """Indeks tsvector z wagami (tytuł A, składniki B, instrukcje C) i indeksem GIN."""
+
+    def _tsquery(self, terms):
+        return ' & '.join(f'{term}:*' for term in terms)
+
+    def match_filter(self, terms):
+        """Zwraca warunek ORM ograniczający przepisy do pasujących do wszystkich słów."""
+        return Q(pk__in=RawSQL(
+            f'SELECT recipe_id FROM {SEARCH_TABLE} WHERE document @@ to_tsquery(\'simple\', %s)',
+            [self._tsquery(terms)],
+        ))
+
+    def search(self, terms, limit, offset, queryset=None):
+        """Zwraca id przepisów pasujących do wszystkich słów, posortowane według ts_rank.
+
+        Jeśli podano `queryset`, wyniki są dodatkowo zawężone do przepisów z tego zapytania.
+        """
+        restriction, restriction_params = _restriction('s.recipe_id', queryset)
+        with connections[router.db_for_read(Recipe)].cursor() as cursor:
+            cursor.execute(
+                f'SELECT s.recipe_id FROM {SEARCH_TABLE} s, to_tsquery(\'simple\', %s) q '
+                f'WHERE s.document @@ q{restriction} ORDER BY ts_rank(s.document, q) DESC, s.recipe_id DESC '
+                'LIMIT %s OFFSET %s',
+                [self._tsquery(terms)] + restriction_params + [limit, offset],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def refresh(self, recipe_ids):
+        """Przelicza dokumenty wyszukiwania podanych przepisów; usunięte, także miękko, znikają z indeksu."""
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE recipe_id = ANY(%s)', [recipe_ids])
+            cursor.execute(
+                f'INSERT INTO {SEARCH_TABLE} (recipe_id, document) '
+                "SELECT r.id, setweight(to_tsvector('simple', r.title), 'A') "
+                "|| setweight(to_tsvector('simple', COALESCE(string_agg(i.name, ' '), '')), 'B') "
+                "|| setweight(to_tsvector('simple', r.instructions), 'C') "
+                'FROM recipes_recipe r '
+                'LEFT JOIN recipes_ingredientinrecipe ir ON ir.recipe_id = r.id '
+                'LEFT JOIN recipes_ingredient i ON i.id = ir.ingredient_id '
+                'WHERE r.id = ANY(%s) AND r.deleted_at IS NULL GROUP BY r.id',
+                [recipe_ids],
+            )
+
+
+class SqliteSearchBackend:
+    """Lokalny odpowiednik indeksu oparty o tabelę wirtualną FTS5 i ranking bm25."""
+
+    def _match(self, terms):
+        return ' '.join(f'"{term}"*' for term in terms)
+
+    def match_filter(self, terms):
+        """Zwraca warunek ORM ograniczający przepisy do pasujących do wszystkich słów."""
+        return Q(pk__in=RawSQL(
+            f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s', [self._match(terms)],
+        ))
+
+    def search(self, terms, limit, offset, queryset=None):
+        """Zwraca id przepisów pasujących do wszystkich słów, posortowane według bm25.
+
+        Jeśli podano `queryset`, wyniki są dodatkowo zawężone do przepisów z tego zapytania.
+        """
+        restriction, restriction_params = _restriction('rowid', queryset)
+        with connections[router.db_for_read(Recipe)].cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s{restriction} '
+                f'ORDER BY bm25({SEARCH_TABLE}, 10.0, 5.0, 1.0), rowid DESC LIMIT %s OFFSET %s',
+                [self._match(terms)] + restriction_params + [limit, offset],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def refresh(self, recipe_ids):
+        """Przelicza dokumenty wyszukiwania podanych przepisów; usunięte, także miękko, znikają z indeksu."""
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({_placeholders(recipe_ids)})', recipe_ids)
+            cursor.execute(
+                f'INSERT INTO {SEARCH_TABLE} (rowid, title, ingredients, instructions) '
+                "SELECT r.id, r.title, COALESCE(GROUP_CONCAT(i.name, ' '), ''), r.instructions "
+                'FROM recipes_recipe r '
+                'LEFT JOIN recipes_ingredientinrecipe ir ON ir.recipe_id = r.id '
+                'LEFT JOIN recipes_ingredient i ON i.id = ir.ingredient_id '
+                f'WHERE r.id IN ({_placeholders(recipe_ids)}) AND r.deleted_at IS NULL GROUP BY r.id',
+                recipe_ids,
+            )
+
+
+class FallbackSearchBackend:
+    """Wyszukiwanie bez indeksu dla pozostałych baz danych."""
+
+    def match_filter(self, terms):
+        """Zwraca warunek ORM ograniczający przepisy do tych, których tytuł, instrukcje lub składniki zawierają wszystkie słowa."""
+        matching = Recipe.objects.all()
+        for term in terms:
+            matching = matching.filter(
+                Q(title__icontains=term) | Q(instructions__icontains=term) | Q(ingredients__name__icontains=term)
+            )
+        return Q(pk__in=matching.values('pk'))
+
+    def search(self, terms, limit, offset, queryset=None):
+        """Zwraca id pasujących przepisów, od najnowszych."""
+        queryset = Recipe.objects.all() if queryset is None else queryset
+        matching = queryset.filter(self.match_filter(terms)).order_by('-pk')
+        return list(matching.values_list('pk', flat=True)[offset:offset + limit])
+
+    def refresh(self, recipe_ids):
+        """Nie ma indeksu do odświeżenia."""
+
+
+BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SqliteSearchBackend,
+}
+
+
+def get_backend():
+    """Zwraca silnik wyszukiwania odpowiedni dla bieżącej bazy danych."""
+    return BACKENDS.get(connection.vendor, FallbackSearchBackend)()
+
+
+async def asearch_recipes(query, page=1, page_size=PAGE_SIZE, queryset=None, ordering=None):
+    """Zwraca przepisy pasujące do zapytania oraz informację, czy jest kolejna strona.
+
+    `queryset` zawęża wyniki (np. do filtrów zakresu), a `ordering` zastępuje sortowanie
+    według trafności sortowaniem po kolumnach przepisu. Zapytania do indeksu pełnotekstowego
+    to surowy SQL, dla którego Django nie ma asynchronicznego kursora, więc ta jedna część
+    działa w wątku przez sync_to_async.
+    """
+    terms = parse_terms(query)
+    if not terms:
+        return [], False
+    backend = get_backend()
+    offset = (min(page, MAX_PAGE) - 1) * page_size
+    if ordering:
+        queryset = Recipe.objects.all() if queryset is None else queryset
+        matching = queryset.filter(backend.match_filter(terms)).with_listing_data().order_by(*ordering)
+        results = [recipe async for recipe in matching[offset:offset + page_size + 1]]
+        return results[:page_size], len(results) > page_size
+    ids = await sync_to_async(backend.search)(terms, page_size + 1, offset, queryset)
+    has_next = len(ids) > page_size
+    ids = ids[:page_size]
+    recipes = await Recipe.objects.with_listing_data().ain_bulk(ids)
+    return [recipes[pk] for pk in ids if pk in recipes], has_next
+
+
+@task
+def refresh_index(recipe_ids):
+    """Odświeża indeks wyszukiwania dla podanych przepisów, w paczkach.
+
+    Przepisy są oznaczane jako zmienione, bo wyniki wyszukiwania, a z nimi ETag strony, zmieniają się dopiero teraz.
+    """
+    backend = get_backend()
+    for batch in _batches(recipe_ids):
+        backend.refresh(batch)
+        Recipe.all_objects.filter(pk__in=batch).touch()
+
+
+def schedule_refresh(recipe_ids):
+    """Po zatwierdzeniu transakcji dodaje do kolejki odświeżenie indeksu, łącząc wiele zmian jednego przepisu w jedną."""
+    enqueue_on_commit(refresh_index, recipe_ids)
@@ -0,0 +1,77 @@
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+
+from . import counters
+from .models import Ingredient, IngredientInRecipe
+from .signals import ingredients_changed
+from .units import to_base
+
+
+def parse_ingredient_rows(ingredients, amounts, units):
+    """Zamienia listy z formularza na słownik {(id_składnika, jednostka): ilość w tej jednostce}.
+
+    Puste wiersze są pomijane, a powtórzone pary składnik-jednostka sumowane.
+    Zgłasza ValidationError dla błędnych id, ilości lub jednostek oraz dla ilości, które
+    po przeliczeniu na jednostki bazowe nie zmieszczą się w bazie.
+    """
+    valid_units = {value for value, _ in IngredientInRecipe.UNIT_CHOICES}
+    rows = {}
+    for ingredient_id, amount, unit in zip(ingredients, amounts, units):
+        if not (ingredient_id and amount and unit):
+            continue
+        try:
+            ingredient_id, amount = int(ingredient_id), Decimal(str(amount).replace(',', '.'))
+        except (ValueError, InvalidOperation):
+            raise ValidationError('Nieprawidłowy składnik lub ilość.')
+        if not amount.is_finite() or amount <= 0:
+            raise ValidationError('Ilość musi być większa od zera.')
+        if unit not in valid_units:
+            raise ValidationError(f'Nieznana jednostka miary: {unit}.')
+        to_base(amount, unit)
+        rows[ingredient_id, unit] = rows.get((ingredient_id, unit), 0) + amount
+        # także suma powtórzonych wierszy musi się zmieścić w bazie
+        to_base(rows[ingredient_id, unit], unit)
+    return rows
+
+
+def save_recipe_ingredients(recipe, ingredients, amounts, units):
+    """Zapisuje składniki przepisu jako różnicę względem istniejących wierszy.
+
+    Wszystkie id składników są sprawdzane jednym zapytaniem, a zmiany trafiają do bazy
+    przez bulk_create, bulk_update i jedno usunięcie w jednej transakcji, więc liczba
+    zapytań nie zależy od liczby składników, a błąd nie zostawia przepisu bez składników.
+    """
+    rows = parse_ingredient_rows(ingredients, amounts, units)
+    requested_ids = {ingredient_id for ingredient_id, _ in rows}
+    known_ids = set(Ingredient.objects.filter(pk__in=requested_ids).values_list('pk', flat=True))
+    if requested_ids - known_ids:
+        raise ValidationError('Wybrany składnik nie istnieje.')
+
+    with transaction.atomic():
+        existing = {(row.ingredient_id, row.unit): row for row in IngredientInRecipe.objects.filter(recipe=recipe)}
+        to_create = [
+            IngredientInRecipe(recipe=recipe, ingredient_id=ingredient_id, unit=unit, amount=amount)
+            for (ingredient_id, unit), amount in rows.items() if (ingredient_id, unit) not in existing
+        ]
+        to_update = []
+        for key, row in existing.items():
+            if key in rows and row.amount != rows[key]:
+                row.amount = rows[key]
+                to_update.append(row)
+        to_delete = [row.pk for key, row in existing.items() if key not in rows]
+
+        IngredientInRecipe.objects.bulk_create(to_create)
+        IngredientInRecipe.objects.bulk_update(to_update, ['quantity'])
+        if to_delete:
+            # surowy DELETE, bez sygnałów: post_delete zmieniałby licznik i updated_at przepisu
+            # osobnym UPDATE na każdy wiersz
+            table, pk = IngredientInRecipe._meta.db_table, IngredientInRecipe._meta.pk.column
+            placeholders = ', '.join(['%s'] * len(to_delete))
+            with connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {table} WHERE {pk} IN ({placeholders})', to_delete)
+
+        # żadna z tych operacji nie wysyła sygnałów, więc licznik i zależne indeksy są odświeżane raz, jawnie
+        counters.ingredients_added(recipe.pk, len(to_create) - len(to_delete))
+        ingredients_changed([recipe.pk])
@@ -0,0 +1,89 @@
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Case, DecimalField, F, Sum, Value, When
+
+from . import units
+from .models import IngredientInRecipe
+from .pagination import MAX_ID
+
+MAX_RECIPES = 50
+# większy mnożnik przepełniłby sumę ilości w zapytaniu, więc taki wpis jest pomijany
+MAX_MULTIPLIER = 100
+SESSION_KEY = 'shopping_list'
+
+
+def parse_plan(recipe_ids, multipliers):
+    """Zamienia listy z formularza lub adresu na plan {id_przepisu: mnożnik porcji}.
+
+    Brakujący mnożnik oznacza 1, a błędne, niedodatnie lub większe niż MAX_MULTIPLIER
+    wartości (także po zsumowaniu powtórzonych przepisów) są pomijane, podobnie jak
+    id przepisów spoza zakresu klucza.
+    """
+    plan = {}
+    multipliers = list(multipliers)
+    for index, recipe_id in enumerate(recipe_ids):
+        raw = multipliers[index] if index < len(multipliers) and multipliers[index] else '1'
+        try:
+            recipe_id, multiplier = int(recipe_id), Decimal(str(raw).replace(',', '.'))
+        except (ValueError, InvalidOperation):
+            continue
+        if not 0 < recipe_id <= MAX_ID:
+            continue
+        if not multiplier.is_finite() or multiplier <= 0:
+            continue
+        total = plan.get(recipe_id, 0) + multiplier
+        if total <= MAX_MULTIPLIER:
+            plan[recipe_id] = total
+    return dict(list(plan.items())[:MAX_RECIPES])
+
+
+def load_plan(session):
+    """Odczytuje plan zapisany w sesji użytkownika."""
+    stored = session.get(SESSION_KEY, {})
+    return parse_plan(stored.keys(), stored.values())
+
+
+def save_plan(session, plan):
+    """Zapisuje plan w sesji użytkownika."""
+    session[SESSION_KEY] = {str(recipe_id): str(multiplier) for recipe_id, multiplier in plan.items()}
+
+
+def _display(quantity, unit_family):
+    """Wybiera jednostkę wyświetlania: kg/l od 1000 g/ml, w przeciwnym razie g/ml."""
+    unit = units.LARGE_UNITS[unit_family]
+    if quantity < units.factor(unit):
+        unit = units.BASE_UNITS[unit_family]
+    return units.from_base(Decimal(quantity).quantize(units.QUANTITY_PRECISION), unit), unit
+
+
+def build_shopping_list(plan):
+    """Sumuje składniki przepisów z planu, pomnożone przez ich mnożniki, jednym zapytaniem GROUP BY.
+
+    Ilości są sumowane w jednostkach bazowych osobno dla masy i objętości, a na kg/l
+    przeliczane dopiero po agregacji. Zwraca listę słowników z kluczami
+    `ingredient_id`, `ingredient`, `amount` i `unit`, posortowaną po nazwie składnika.
+    """
+    if not plan:
+        return []
+    multiplier = Case(
+        *[When(recipe_id=recipe_id, then=Value(multiplier)) for recipe_id, multiplier in plan.items()],
+        output_field=DecimalField(),
+    )
+    mass_units = [unit for unit in units.UNITS if units.family(unit) == units.MASS]
+    unit_family = Case(When(unit__in=mass_units, then=Value(units.MASS)), default=Value(units.VOLUME))
+    rows = (IngredientInRecipe.objects.filter(recipe_id__in=plan, recipe__deleted_at__isnull=True)
+            .annotate(unit_family=unit_family)
+            .values('ingredient_id', 'ingredient__name', 'unit_family')
+            .annotate(total=Sum(F('quantity') * multiplier,
+                                output_field=DecimalField(max_digits=18, decimal_places=3)))
+            .order_by('ingredient__name', 'unit_family'))
+    shopping_list = []
+    for row in rows:
+        amount, unit = _display(row['total'], row['unit_family'])
+        shopping_list.append({
+            'ingredient_id': row['ingredient_id'],
+            'ingredient': row['ingredient__name'],
+            'amount': amount,
+            'unit': unit,
+        })
+    return shopping_list
@@ -0,0 +1,132 @@
+from django.contrib.auth.models import User
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import autocomplete, counters, live, pantry, photos, search, similar
+from .models import Comment, Ingredient, IngredientInRecipe, Recipe
+
+
+def ingredients_changed(recipe_ids):
+    """Oznacza przepisy, których składniki się zmieniły, jako zmienione i odświeża ich indeksy.
+
+    Wywoływane przez sygnały i jawnie po operacjach zbiorczych, które sygnałów nie wysyłają.
+    """
+    Recipe.all_objects.filter(pk__in=recipe_ids).touch()
+    search.schedule_refresh(recipe_ids)
+    pantry.schedule_refresh(recipe_ids)
+    similar.schedule_refresh(recipe_ids)
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def refresh_recipe(sender, instance, **kwargs):
+    """Odświeża dokument wyszukiwania po zapisaniu lub usunięciu przepisu."""
+    search.schedule_refresh([instance.pk])
+
+
+def _origin_model(origin):
+    """Model, od którego zaczęło się usuwanie: obiektu albo zbioru zapytań."""
+    return origin.model if isinstance(origin, QuerySet) else type(origin)
+
+
+def _deleted_with(origin, model, pk):
+    """Sprawdza, czy obiekt jest usuwany kaskadowo razem z obiektem, którego licznik miałby zmienić."""
+    return isinstance(origin, model) and origin.pk == pk
+
+
+@receiver(post_save, sender=Recipe)
+def count_created_recipe(sender, instance, created, **kwargs):
+    if created:
+        counters.recipes_added(instance.author_id, 1)
+
+
+@receiver(post_save, sender=Recipe)
+def schedule_recipe_thumbnails(sender, instance, **kwargs):
+    """Zleca miniatury zdjęcia, dla którego jeszcze ich nie ma; gotowe miniatury są pomijane."""
+    if instance.photo_hash and instance.photo_hash != instance.thumbnails_hash:
+        photos.schedule_thumbnails([instance.pk])
+
+
+@receiver(post_delete, sender=Recipe)
+def count_deleted_recipe(sender, instance, origin=None, **kwargs):
+    if not _deleted_with(origin, User, instance.author_id):
+        counters.recipes_added(instance.author_id, -1)
+
+
+@receiver(post_save, sender=IngredientInRecipe)
+def count_created_ingredient_row(sender, instance, created, **kwargs):
+    if created:
+        counters.ingredients_added(instance.recipe_id, 1)
+
+
+@receiver(post_delete, sender=IngredientInRecipe)
+def count_deleted_ingredient_row(sender, instance, origin=None, **kwargs):
+    if not _deleted_with(origin, Recipe, instance.recipe_id):
+        counters.ingredients_added(instance.recipe_id, -1)
+
+
+@receiver(post_save, sender=Comment)
+def count_created_comment(sender, instance, created, **kwargs):
+    if created:
+        counters.comment_added(instance.recipe_id, instance.created_at)
+
+
+@receiver(post_save, sender=Comment)
+def publish_created_comment(sender, instance, created, **kwargs):
+    """Po zatwierdzeniu wysyła nowy komentarz przeglądarkom, które mają otwarty przepis."""
+    if created:
+        live.schedule_publish(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, origin=None, **kwargs):
+    if not _deleted_with(origin, Recipe, instance.recipe_id):
+        counters.comment_removed(instance.recipe_id)
+
+
+@receiver([post_save, post_delete], sender=IngredientInRecipe)
+def refresh_ingredient_in_recipe(sender, instance, origin=None, **kwargs):
+    """Odświeża wszystko, co zależy od składników przepisu, po zmianie pojedynczego wiersza.
+
+    Operacje zbiorcze nie przechodzą przez ten sygnał: save_recipe_ingredients i import
+    wywołują `ingredients_changed` raz, a wierszy usuwanych kaskadowo z przepisem lub
+    składnikiem nie trzeba odświeżać po jednym, bo robią to sygnały przepisu i składnika.
+    """
+    if _origin_model(origin) in (Recipe, Ingredient):
+        return
+    ingredients_changed([instance.recipe_id])
+
+
+@receiver(post_delete, sender=Recipe)
+def forget_deleted_recipe(sender, instance, **kwargs):
+    """Usuwa przepis z indeksu spiżarni po usunięciu go na stałe."""
+    pantry.schedule_refresh([instance.pk])
+
+
+@receiver(pre_delete, sender=Ingredient)
+def refresh_recipes_of_deleted_ingredient(sender, instance, **kwargs):
+    """Przed usunięciem składnika odświeża raz przepisy, z których kaskadowo zniknie."""
+    recipe_ids = list(IngredientInRecipe.objects.filter(ingredient=instance).values_list('recipe_id', flat=True))
+    if recipe_ids:
+        ingredients_changed(recipe_ids)
+
+
+@receiver(post_save, sender=Ingredient)
+def refresh_ingredient(sender, instance, created, **kwargs):
+    """Odświeża przepisy używające składnika, którego nazwa się zmieniła."""
+    if not created:
+        recipe_ids = list(IngredientInRecipe.objects.filter(ingredient=instance).values_list('recipe_id', flat=True))
+        Recipe.all_objects.filter(pk__in=recipe_ids).touch()
+        search.schedule_refresh(recipe_ids)
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def refresh_ingredient_list(sender, instance, **kwargs):
+    """Aktualizuje indeks podpowiedzi po dodaniu, zmianie lub usunięciu składnika."""
+    autocomplete.schedule_refresh([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Comment)
+def refresh_comment(sender, instance, **kwargs):
+    """Oznacza przepis jako zmieniony po dodaniu, zmianie lub usunięciu komentarza."""
+    Recipe.all_objects.filter(pk=instance.recipe_id).touch()
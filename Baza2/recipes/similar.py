@@ -0,0 +1,110 @@
+import heapq
+from array import array
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import IngredientInRecipe, Recipe, SimilarRecipe
+from .tasks import enqueue_on_commit, task
+
+
+def _top_count():
+    return getattr(settings, 'SIMILAR_RECIPES_COUNT', 6)
+
+
+class IngredientMatrix:
+    """Rzadka macierz przepis × składnik zapisana kolumnami: składnik -> tablica id przepisów.
+
+    Wiersz przepisu pomnożony przez macierz transponowaną to zliczenie przepisów z list
+    jego składników, więc koszt zależy od liczby niezerowych pól, a nie od liczby par
+    przepisów. Liczba składników przepisu pochodzi z licznika `Recipe.ingredient_count`.
+    """
+
+    def __init__(self, rows):
+        self.columns = {}
+        self.rows = {}
+        self.sizes = {}
+        for ingredient_id, recipe_id, size in rows:
+            row = self.rows.setdefault(recipe_id, set())
+            # ten sam składnik w dwóch jednostkach to jedno pole macierzy
+            if ingredient_id not in row:
+                row.add(ingredient_id)
+                self.columns.setdefault(ingredient_id, array('q')).append(recipe_id)
+            self.sizes[recipe_id] = size
+
+    @classmethod
+    def load(cls, ingredient_ids=None):
+        """Wczytuje całą macierz albo tylko kolumny podanych składników, jednym zapytaniem."""
+        rows = IngredientInRecipe.objects.filter(recipe__deleted_at__isnull=True).order_by()
+        if ingredient_ids is not None:
+            rows = rows.filter(ingredient_id__in=ingredient_ids)
+        return cls(rows.values_list('ingredient_id', 'recipe_id', 'recipe__ingredient_count')
+                   .iterator(chunk_size=10000))
+
+    def neighbours(self, recipe_id, ingredient_ids, count):
+        """Zwraca do `count` par (podobieństwo Jaccarda, id) przepisów o wspólnych składnikach, od najbardziej podobnych."""
+        shared = Counter()
+        for ingredient_id in ingredient_ids:
+            # Counter.update na tablicy liczy wystąpienia w C, bez pętli w Pythonie
+            shared.update(self.columns.get(ingredient_id, ()))
+        shared.pop(recipe_id, None)
+        # licznik składników mógł się rozjechać, nawet do zera; przepis ma co najmniej te składniki
+        size = max(self.sizes.get(recipe_id, 0), len(ingredient_ids), 1)
+        best = []
+        # przy `common` wspólnych składnikach podobieństwo nie przekracza common / size, więc po
+        # przeglądaniu kandydatów od największej liczby wspólnych można przerwać, gdy nie pobiją najgorszego z `count`
+        for other, common in shared.most_common():
+            if len(best) == count and common / size < best[0][0]:
+                break
+            item = (common / max(size + self.sizes[other] - common, common), other)
+            if len(best) < count:
+                heapq.heappush(best, item)
+            elif item > best[0]:
+                heapq.heapreplace(best, item)
+        return sorted(best, reverse=True)
+
+
+def _store(results):
+    """Zastępuje zapisanych sąsiadów podanych przepisów nowymi wynikami; strony tych przepisów są od teraz zmienione."""
+    with transaction.atomic():
+        Recipe.all_objects.filter(pk__in=list(results)).touch()
+        SimilarRecipe.objects.filter(recipe_id__in=list(results)).delete()
+        SimilarRecipe.objects.bulk_create([
+            SimilarRecipe(recipe_id=recipe_id, similar_id=other, score=score)
+            for recipe_id, neighbours in results.items() for score, other in neighbours
+        ])
+
+
+@task
+def refresh(recipe_ids):
+    """Przelicza podobne przepisy tylko dla podanych przepisów, wczytując kolumny ich składników.
+
+    Listy innych przepisów, w których te przepisy mogłyby się pojawić, zmieni dopiero
+    `rebuild`, uruchamiany poleceniem rebuild_similar_recipes.
+    """
+    own = {recipe_id: set() for recipe_id in recipe_ids}
+    for recipe_id, ingredient_id in (IngredientInRecipe.objects.filter(recipe_id__in=recipe_ids)
+                                     .values_list('recipe_id', 'ingredient_id')):
+        own[recipe_id].add(ingredient_id)
+    matrix = IngredientMatrix.load({ingredient_id for ids in own.values() for ingredient_id in ids})
+    _store({recipe_id: matrix.neighbours(recipe_id, ids, _top_count()) for recipe_id, ids in own.items()})
+
+
+def rebuild(batch_size=1000):
+    """Przelicza podobne przepisy wszystkich przepisów z jednej macierzy, zapisując wyniki paczkami.
+
+    Zwraca kolejno liczby przeliczonych przepisów, żeby polecenie mogło pokazywać postęp.
+    """
+    matrix = IngredientMatrix.load()
+    recipe_ids = sorted(Recipe.objects.values_list('pk', flat=True).iterator(chunk_size=10000))
+    for start in range(0, len(recipe_ids), batch_size):
+        batch = recipe_ids[start:start + batch_size]
+        _store({recipe_id: matrix.neighbours(recipe_id, matrix.rows.get(recipe_id, ()), _top_count())
+                for recipe_id in batch})
+        yield len(batch)
+
+
+def schedule_refresh(recipe_ids):
+    """Po zatwierdzeniu transakcji dodaje do kolejki przeliczenie podobnych przepisów."""
+    enqueue_on_commit(refresh, recipe_ids)
@@ -0,0 +1,135 @@
+import datetime
+import hashlib
+import json
+import os
+import random
+import socket
+import threading
+import traceback
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .batching import defer_until_commit
+from .models import Task
+
+TASKS = {}
+
+
+def task(func):
+    """Rejestruje funkcję jako zadanie w tle pod nazwą `moduł.funkcja`.
+
+    Worker wykonuje tylko zarejestrowane funkcje, więc wiersz w tabeli nie może
+    wywołać dowolnego kodu. Argumenty muszą dać się zapisać jako JSON.
+    """
+    func.task_name = f'{func.__module__}.{func.__qualname__}'
+    TASKS[func.task_name] = func
+    # jedna funkcja na zadanie, żeby defer_until_commit łączył id z kolejnych wywołań
+    func.enqueue_ids = lambda ids: enqueue(func, sorted(ids))
+    return func
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _dedup_key(name, args):
+    return hashlib.sha256(json.dumps([name, args], sort_keys=True, default=str).encode()).hexdigest()
+
+
+def enqueue(func, *args, delay=0, max_attempts=None):
+    """Dodaje zadanie do kolejki; takie samo zadanie, które jeszcze czeka, nie jest dublowane.
+
+    Przy TASKS_EAGER zadanie jest wykonywane od razu, bez kolejki, np. w testach.
+    """
+    if _setting('TASKS_EAGER', False):
+        func(*args)
+        return
+    Task.objects.bulk_create([Task(
+        name=func.task_name, args=list(args), dedup_key=_dedup_key(func.task_name, list(args)),
+        run_at=timezone.now() + datetime.timedelta(seconds=delay),
+        max_attempts=max_attempts or _setting('TASKS_MAX_ATTEMPTS', 5),
+    )], ignore_conflicts=True)
+
+
+def enqueue_on_commit(func, ids):
+    """Dodaje zadanie dla podanych id po zatwierdzeniu transakcji, łącząc id z całej transakcji w jedno zadanie."""
+    defer_until_commit(func.enqueue_ids, ids)
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+
+
+def _claimable():
+    now = timezone.now()
+    stale = now - datetime.timedelta(seconds=_setting('TASKS_LOCK_TIMEOUT', 600))
+    # zadanie, którego worker nie skończył w czasie blokady, uznaje się za porzucone
+    return (Task.objects.filter(Q(status=Task.PENDING, run_at__lte=now) | Q(status=Task.RUNNING, locked_at__lt=stale))
+            .order_by('run_at', 'pk'))
+
+
+def claim(worker, limit=1):
+    """Przydziela workerowi do `limit` zadań gotowych do wykonania i zwraca je.
+
+    Na PostgreSQL wiersze są blokowane przez SELECT ... FOR UPDATE SKIP LOCKED, więc
+    równoległe workery pomijają cudze zadania zamiast na nie czekać. SQLite nie ma
+    blokad wierszy, ale zapisy wykonuje po kolei, więc zadanie przejmuje warunkowy
+    UPDATE: wygrywa ten worker, któremu zmienił on wiersz.
+    """
+    changes = {'status': Task.RUNNING, 'locked_at': timezone.now(), 'locked_by': worker,
+               'attempts': F('attempts') + 1}
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(_claimable().select_for_update(skip_locked=True).values_list('pk', flat=True)[:limit])
+            Task.objects.filter(pk__in=ids).update(**changes)
+    else:
+        ids = []
+        for task_id, status, locked_at in _claimable().values_list('pk', 'status', 'locked_at')[:limit]:
+            if Task.objects.filter(pk=task_id, status=status, locked_at=locked_at).update(**changes):
+                ids.append(task_id)
+    return list(Task.objects.filter(pk__in=ids).order_by('run_at', 'pk'))
+
+
+def _backoff(attempts):
+    """Czas do ponowienia rośnie wykładniczo, z losowym rozrzutem, żeby ponowienia się nie skupiały."""
+    base = _setting('TASKS_RETRY_DELAY', 10)
+    return min(base * 2 ** (attempts - 1), _setting('TASKS_MAX_RETRY_DELAY', 3600)) * random.uniform(0.8, 1.2)
+
+
+def execute(task):
+    """Wykonuje przydzielone zadanie; udane jest usuwane, nieudane wraca do kolejki z opóźnieniem lub zostaje jako failed."""
+    func = TASKS.get(task.name)
+    try:
+        if func is None:
+            raise LookupError(f'Nieznane zadanie: {task.name}')
+        func(*task.args)
+    except Exception:
+        error = traceback.format_exc()
+        if task.attempts >= task.max_attempts or func is None:
+            Task.objects.filter(pk=task.pk).update(status=Task.FAILED, last_error=error)
+            return False
+        retry_at = timezone.now() + datetime.timedelta(seconds=_backoff(task.attempts))
+        try:
+            with transaction.atomic():
+                Task.objects.filter(pk=task.pk).update(status=Task.PENDING, run_at=retry_at, last_error=error,
+                                                       locked_at=None, locked_by='')
+        except IntegrityError:
+            # w kolejce czeka już takie samo zadanie, które wykona tę pracę
+            Task.objects.filter(pk=task.pk).delete()
+        return False
+    Task.objects.filter(pk=task.pk).delete()
+    return True
+
+
+def run_pending(worker, limit=10):
+    """Przydziela i wykonuje jedną paczkę zadań; zwraca liczby (udane, nieudane)."""
+    done = failed = 0
+    for claimed in claim(worker, limit):
+        if execute(claimed):
+            done += 1
+        else:
+            failed += 1
+    return done, failed
@@ -0,0 +1,12 @@
+from django import template
+
+from recipes.photos import sources
+
+register = template.Library()
+
+
+@register.inclusion_tag('recipes/photo.html')
+def recipe_photo(recipe, sizes='100vw'):
+    """Wstawia zdjęcie przepisu jako <picture> z miniaturami WebP i JPEG, z których przeglądarka wybiera według `sizes`."""
+    formats, fallback = sources(recipe)
+    return {'recipe': recipe, 'sources': formats, 'fallback': fallback, 'sizes': sizes}
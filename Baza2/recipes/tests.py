@@ -1,12 +1,33 @@
+import asyncio
+import gzip
+import hashlib
+import io
+import json
 import os
+from decimal import Decimal
 
 import django
 import pytest
+from asgiref.sync import async_to_sync, sync_to_async
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.contrib.staticfiles import storage
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Value
+from django.db.models.functions import Upper
+from django.http import HttpResponse
 from django.urls import reverse
+from django.utils import timezone
 
 from django.test import Client
-from .models import Recipe, Ingredient, IngredientInRecipe
+from .models import AuthorStats, DeletedAccount, Recipe, Ingredient, IngredientInRecipe, Comment, SimilarRecipe, Task
+from .pagination import MAX_PAGE, PAGE_SIZE, encode_cursor
+from . import caching, live, metrics, routing, shopping, tasks, views
+from .pantry import pantry_index
+from .autocomplete import fold, ingredient_index
+from .durations import parse_minutes
 from .forms import RecipeForm, IngredientInRecipeForm, IngredientForm
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Baza2.settings')
@@ -74,6 +95,18 @@ def test_search_view_template_used(client):
     assert 'recipes/search.html' in [t.name for t in response.templates]
 
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    """Fixture czyszcząca pamięć podręczną przed każdym testem."""
+    cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def eager_tasks(settings):
+    """Fixture wykonująca zadania w tle od razu, bez workera."""
+    settings.TASKS_EAGER = True
+
+
 @pytest.fixture
 def client():
     """Fixture do tworzenia klienta."""
@@ -131,7 +164,7 @@ def recipe(user):
     """Fixture do tworzenia przepisu."""
     return Recipe.objects.create(
         title='Test Recipe', instructions='Test Instructions',
-        preparation_time='30 min', cooking_time='45 min', number='4', author=user
+        preparation_time=30, cooking_time=45, number=4, author=user
     )
 
 
@@ -266,3 +299,1065 @@ def test_ingredient_form_invalid():
     form_data = {'name': ''}
     form = IngredientForm(data=form_data)
     assert not form.is_valid()
+
+
+def _create_recipes(user, ingredient, count):
+    """Tworzy podaną liczbę przepisów ze składnikiem i komentarzem."""
+    recipes = Recipe.objects.bulk_create([
+        Recipe(title=f'Przepis {i}', instructions='Instrukcje', preparation_time=10,
+               cooking_time=20, number=2, author=user)
+        for i in range(count)
+    ])
+    IngredientInRecipe.objects.bulk_create([
+        IngredientInRecipe(recipe=recipe, ingredient=ingredient, amount=1, unit='g') for recipe in recipes
+    ])
+    Comment.objects.bulk_create([Comment(recipe=recipe, user=user, text='Pyszne') for recipe in recipes])
+    return recipes
+
+
+@pytest.mark.django_db
+def test_home_view_query_count_does_not_depend_on_page_size(client, user, ingredient, django_assert_max_num_queries):
+    """Widok home wykonuje stałą liczbę zapytań niezależnie od liczby przepisów na stronie."""
+    _create_recipes(user, ingredient, PAGE_SIZE + 5)
+    with django_assert_max_num_queries(4):
+        response = client.get(reverse('home'))
+    assert response.status_code == 200
+    assert len(response.context['recipes']) == PAGE_SIZE
+
+
+@pytest.mark.django_db
+def test_home_view_keyset_pagination(client, user, ingredient):
+    """Kolejna strona widoku home zaczyna się od przepisu starszego niż kursor."""
+    recipes = _create_recipes(user, ingredient, PAGE_SIZE + 5)
+    first_page = client.get(reverse('home'))
+    next_cursor = first_page.context['next_cursor']
+    assert next_cursor is not None
+    second_page = client.get(reverse('home'), {'after': next_cursor})
+    assert len(second_page.context['recipes']) == 5
+    assert second_page.context['next_cursor'] is None
+    assert max(r.pk for r in second_page.context['recipes']) < min(r.pk for r in first_page.context['recipes'])
+    assert {r.pk for r in first_page.context['recipes']} | {r.pk for r in second_page.context['recipes']} == \
+        {r.pk for r in recipes}
+
+
+@pytest.mark.django_db
+def test_crafted_cursor_is_ignored(client, user, recipe):
+    """Kursor o złej liczbie wartości lub wartościach złego typu daje pierwszą stronę zamiast błędu serwera."""
+    urls = [reverse('home'), reverse('recipe_comments', args=[recipe.pk]), reverse('ingredient_list'),
+            reverse('api_recipe_list'), reverse('api_ingredient_list')]
+    client.login(username='testuser', password='testpassword')
+    for values in ([1, 2, 3], ['abc', 'abc'], [10 ** 30, 1], [{'a': 1}], [None]):
+        for url in urls:
+            assert client.get(url, {'after': encode_cursor(values)}).status_code == 200, (url, values)
+    response = client.get(reverse('home'), {'after': encode_cursor(['abc'])})
+    assert [r.pk for r in response.context['recipes']] == [recipe.pk]
+
+
+@pytest.mark.django_db
+def test_search_view_ranks_title_matches_first(client, user, ingredient, django_capture_on_commit_callbacks):
+    """Wyszukiwarka znajduje przepisy po tytule, instrukcjach i składnikach, stawiając trafienia w tytule wyżej."""
+    with django_capture_on_commit_callbacks(execute=True):
+        in_instructions = Recipe.objects.create(
+            title='Zupa', instructions='Podawać z chlebem', preparation_time=10,
+            cooking_time=20, number=2, author=user)
+        in_title = Recipe.objects.create(
+            title='Chleb żytni', instructions='Upiec', preparation_time=10,
+            cooking_time=60, number=4, author=user)
+        with_ingredient = Recipe.objects.create(
+            title='Naleśniki', instructions='Usmażyć', preparation_time=10,
+            cooking_time=10, number=4, author=user)
+        IngredientInRecipe.objects.create(recipe=with_ingredient, ingredient=ingredient, amount=1, unit='g')
+
+    response = client.get(reverse('search'), {'q': 'chleb'})
+    assert [recipe.pk for recipe in response.context['results']] == [in_title.pk, in_instructions.pk]
+
+    response = client.get(reverse('search'), {'q': 'MĄKA'})
+    assert [recipe.pk for recipe in response.context['results']] == [with_ingredient.pk]
+
+
+@pytest.mark.django_db
+def test_search_index_follows_deleted_recipes(client, recipe, django_capture_on_commit_callbacks):
+    """Usunięty przepis znika z wyników wyszukiwania."""
+    with django_capture_on_commit_callbacks(execute=True):
+        Recipe.objects.filter(pk=recipe.pk).first().save()
+    assert client.get(reverse('search'), {'q': 'test'}).context['results']
+    with django_capture_on_commit_callbacks(execute=True):
+        recipe.delete()
+    assert not client.get(reverse('search'), {'q': 'test'}).context['results']
+
+
+@pytest.mark.django_db
+def test_pantry_view_ranks_by_missing_ingredients(client, user, django_capture_on_commit_callbacks):
+    """Wyszukiwarka spiżarni stawia wyżej przepisy, w których brakuje mniej składników."""
+    pantry_index.build()
+    flour, eggs, milk = Ingredient.objects.bulk_create(
+        [Ingredient(name='mąka'), Ingredient(name='jajka'), Ingredient(name='mleko')])
+    with django_capture_on_commit_callbacks(execute=True):
+        pancakes = Recipe.objects.create(title='Naleśniki', instructions='Usmażyć', preparation_time=10,
+                                         cooking_time=10, number=4, author=user)
+        bread = Recipe.objects.create(title='Chleb', instructions='Upiec', preparation_time=10,
+                                      cooking_time=60, number=4, author=user)
+        for ingredient in (flour, eggs, milk):
+            IngredientInRecipe.objects.create(recipe=pancakes, ingredient=ingredient, amount=1, unit='g')
+        IngredientInRecipe.objects.create(recipe=bread, ingredient=flour, amount=1, unit='kg')
+
+    response = client.get(reverse('pantry'), {'ingredient': [flour.id, eggs.id]})
+    results = response.context['results']
+    assert [recipe.pk for recipe in results] == [bread.pk, pancakes.pk]
+    assert (results[1].matched_count, results[1].missing_count) == (2, 1)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        pancakes.delete()
+    response = client.get(reverse('pantry'), {'ingredient': [eggs.id]})
+    assert response.context['results'] == []
+
+
+@pytest.mark.django_db
+def test_pantry_view_ignores_out_of_range_ids_and_pages(client, recipe, ingredient):
+    """Spiżarnia pomija id składników spoza zakresu klucza i ogranicza numer strony do MAX_PAGE."""
+    IngredientInRecipe.objects.create(recipe=recipe, ingredient=ingredient, amount=1, unit='g')
+    pantry_index.build()
+    response = client.get(reverse('pantry'), {'ingredient': ['9' * 25, '-1', '0', ingredient.id]})
+    assert response.status_code == 200
+    assert response.context['selected'] == {ingredient.id}
+    assert [result.pk for result in response.context['results']] == [recipe.pk]
+
+    response = client.get(reverse('pantry'), {'ingredient': ingredient.id, 'page': '9' * 25})
+    assert response.status_code == 200
+    assert response.context['page'] == MAX_PAGE
+    assert response.context['results'] == []
+
+
+@pytest.mark.django_db
+def test_recipe_edit_applies_ingredient_diff(client, user, recipe, django_assert_max_num_queries):
+    """Edycja przepisu zapisuje różnicę składników stałą liczbą zapytań."""
+    ingredients = Ingredient.objects.bulk_create([Ingredient(name=f'Składnik {i}') for i in range(40)])
+    kept, changed, removed = IngredientInRecipe.objects.bulk_create([
+        IngredientInRecipe(recipe=recipe, ingredient=ingredients[0], amount=1, unit='g'),
+        IngredientInRecipe(recipe=recipe, ingredient=ingredients[1], amount=1, unit='g'),
+        IngredientInRecipe(recipe=recipe, ingredient=ingredients[2], amount=1, unit='g'),
+    ])
+    submitted = [ingredients[0], ingredients[1]] + ingredients[3:]
+    client.login(username='testuser', password='testpassword')
+    with django_assert_max_num_queries(19):
+        response = client.post(reverse('recipe_edit', args=[recipe.id]), {
+            'title': 'Test Recipe',
+            'instructions': 'Test Instructions',
+            'preparation_time': '30 min',
+            'cooking_time': '45 min',
+            'number': '4',
+            'ingredient': [ingredient.id for ingredient in submitted],
+            'amount': [1, 5] + [2] * (len(submitted) - 2),
+            'unit': ['g'] * len(submitted),
+        })
+    assert response.status_code == 302
+    rows = {row.ingredient_id: row for row in IngredientInRecipe.objects.filter(recipe=recipe)}
+    assert set(rows) == {ingredient.id for ingredient in submitted}
+    assert rows[kept.ingredient_id].pk == kept.pk
+    assert rows[changed.ingredient_id].amount == 5
+    assert removed.ingredient_id not in rows
+
+
+@pytest.mark.django_db
+def test_removing_ingredients_takes_constant_queries_and_keeps_counter(user):
+    """Usunięcie 5 i 40 składników z przepisu kosztuje tyle samo zapytań, a licznik składników się zgadza."""
+    from django.test.utils import CaptureQueriesContext
+    from .services import save_recipe_ingredients
+
+    ingredients = Ingredient.objects.bulk_create([Ingredient(name=f'Składnik {i}') for i in range(41)])
+    query_counts = []
+    for removed in (5, 40):
+        recipe = Recipe.objects.create(title='Test Recipe', instructions='-', author=user)
+        kept = ingredients[:removed + 1]
+        save_recipe_ingredients(recipe, [i.pk for i in kept], [1] * len(kept), ['g'] * len(kept))
+        with CaptureQueriesContext(connection) as queries:
+            save_recipe_ingredients(recipe, [kept[0].pk], [1], ['g'])
+        query_counts.append(len(queries))
+        recipe.refresh_from_db()
+        assert recipe.ingredient_count == 1 == IngredientInRecipe.objects.filter(recipe=recipe).count()
+    assert query_counts[0] == query_counts[1]
+
+
+@pytest.mark.django_db
+def test_ingredient_changes_touch_recipe_once(client, user, recipe, ingredient, settings):
+    """Edycja składników przepisu i usunięcie składnika z kilkoma wierszami zmieniają updated_at jednym UPDATE."""
+    from django.test.utils import CaptureQueriesContext
+
+    settings.TASKS_EAGER = False
+
+    def touches(queries):
+        return sum(query['sql'].startswith('UPDATE "recipes_recipe" SET "updated_at"') for query in queries)
+
+    IngredientInRecipe.objects.bulk_create([IngredientInRecipe(recipe=recipe, ingredient=ingredient, amount=1, unit=unit)
+                                            for unit in ('g', 'kg', 'ml')])
+    client.login(username='testuser', password='testpassword')
+    with CaptureQueriesContext(connection) as queries:
+        client.post(reverse('recipe_edit', args=[recipe.id]), {
+            'title': 'Test Recipe', 'instructions': '-', 'preparation_time': '30 min', 'cooking_time': '45 min',
+            'number': '4', 'ingredient': [ingredient.id], 'amount': [1], 'unit': ['l'],
+        })
+    assert touches(queries) == 1
+    IngredientInRecipe.objects.bulk_create([IngredientInRecipe(recipe=recipe, ingredient=ingredient, amount=1, unit=unit)
+                                            for unit in ('g', 'kg')])
+    with CaptureQueriesContext(connection) as queries:
+        ingredient.delete()
+    assert touches(queries) == 1
+
+
+@pytest.mark.django_db
+def test_recipe_edit_with_unknown_ingredient_keeps_existing_rows(client, user, recipe, ingredient):
+    """Nieistniejący składnik w formularzu nie zmienia przepisu ani jego składników."""
+    IngredientInRecipe.objects.create(recipe=recipe, ingredient=ingredient, amount=1, unit='g')
+    client.login(username='testuser', password='testpassword')
+    response = client.post(reverse('recipe_edit', args=[recipe.id]), {
+        'title': 'Updated Recipe',
+        'instructions': 'Updated Instructions',
+        'preparation_time': '40 min',
+        'cooking_time': '50 min',
+        'number': '5',
+        'ingredient': [ingredient.id + 1000],
+        'amount': [2],
+        'unit': ['g'],
+    })
+    assert response.status_code == 200
+    recipe.refresh_from_db()
+    assert recipe.title == 'Test Recipe'
+    assert list(IngredientInRecipe.objects.filter(recipe=recipe).values_list('ingredient_id', flat=True)) == \
+        [ingredient.id]
+
+
+@pytest.mark.django_db
+def test_recipe_edit_with_too_large_amount_shows_error(client, user, recipe, ingredient):
+    """Ilość, która po przeliczeniu na gramy nie mieści się w bazie, to błąd formularza, a nie błąd serwera."""
+    client.login(username='testuser', password='testpassword')
+    for amounts, units in (([1e20], ['g']), ([99999999999999], ['kg']), (['1e999999999'], ['l']),
+                           ([600000000000, 600000000000], ['g', 'g'])):
+        response = client.post(reverse('recipe_edit', args=[recipe.id]), {
+            'title': 'Test Recipe', 'instructions': '-', 'preparation_time': '30 min', 'cooking_time': '45 min',
+            'number': '4', 'ingredient': [ingredient.id] * len(amounts), 'amount': amounts, 'unit': units,
+        })
+        assert response.status_code == 200
+        assert 'Ilość składnika jest zbyt duża.' in response.content.decode()
+    assert not IngredientInRecipe.objects.filter(recipe=recipe).exists()
+
+
+def test_parse_minutes_understands_hours_and_minutes():
+    """Opisy czasu z formularza są zamieniane na liczbę minut."""
+    assert parse_minutes('1 h 30 min') == 90
+    assert parse_minutes('1,5 godziny') == 90
+    assert parse_minutes('45') == 45
+    assert parse_minutes('brak') is None
+
+
+@pytest.mark.django_db
+def test_home_view_filters_and_sorts_by_total_time(client, user):
+    """Strona główna filtruje po łącznym czasie i stronicuje kursorem w kolejności od najszybszych."""
+    Recipe.objects.bulk_create([
+        Recipe(title=f'Przepis {minutes}', instructions='Instrukcje', preparation_time=minutes,
+               cooking_time=minutes, number=2, author=user)
+        for minutes in (40, 5, 25, 10, 15) * 5
+    ])
+    response = client.get(reverse('home'), {'max_total_time': 50, 'sort': 'quickest'})
+    first_page = response.context['recipes']
+    assert [recipe.total_time for recipe in first_page] == [10] * 5 + [20] * 5 + [30] * 5 + [50] * 5
+    assert response.context['next_cursor'] is None
+
+    response = client.get(reverse('home'), {'sort': 'quickest'})
+    second_page = client.get(reverse('home'), {'sort': 'quickest', 'after': response.context['next_cursor']})
+    assert [recipe.total_time for recipe in second_page.context['recipes']] == [80] * 5
+
+
+@pytest.mark.django_db
+def test_search_view_applies_range_filters_and_sort(client, user, django_capture_on_commit_callbacks):
+    """Wyszukiwarka łączy wyniki z indeksu z filtrami zakresu i sortowaniem po łącznym czasie."""
+    with django_capture_on_commit_callbacks(execute=True):
+        quick, slow, too_slow = [
+            Recipe.objects.create(title=f'Zupa {minutes}', instructions='Ugotować', preparation_time=minutes,
+                                  cooking_time=minutes, number=2, author=user)
+            for minutes in (10, 20, 60)
+        ]
+    response = client.get(reverse('search'), {'q': 'zupa', 'max_total_time': 60})
+    assert {recipe.pk for recipe in response.context['results']} == {quick.pk, slow.pk}
+    response = client.get(reverse('search'), {'q': 'zupa', 'sort': 'slowest'})
+    assert [recipe.pk for recipe in response.context['results']] == [too_slow.pk, slow.pk, quick.pk]
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('sort', ['', 'slowest'])
+def test_search_view_clamps_oversized_page(client, recipe, sort, django_capture_on_commit_callbacks):
+    """Zbyt duży numer strony wyszukiwania jest ograniczany do MAX_PAGE zamiast przepełniać OFFSET."""
+    with django_capture_on_commit_callbacks(execute=True):
+        Recipe.objects.filter(pk=recipe.pk).first().save()
+    response = client.get(reverse('search'), {'q': 'test', 'sort': sort, 'page': '9' * 25})
+    assert response.status_code == 200
+    assert response.context['page'] == MAX_PAGE
+    assert response.context['results'] == []
+
+
+@pytest.mark.django_db
+def test_ingredient_amount_is_stored_in_base_units(recipe, ingredient):
+    """Ilość składnika jest przechowywana w gramach, a wyświetlana w wybranej jednostce."""
+    row = IngredientInRecipe.objects.create(recipe=recipe, ingredient=ingredient, amount='1.5', unit='kg')
+    row.refresh_from_db()
+    assert row.quantity == Decimal('1500')
+    assert row.amount == Decimal('1.5')
+
+
+@pytest.mark.django_db
+def test_recipe_detail_scales_ingredients_to_servings(client, recipe, ingredient):
+    """Szczegóły przepisu przeliczają ilości składników na podaną liczbę porcji."""
+    IngredientInRecipe.objects.create(recipe=recipe, ingredient=ingredient, amount='0.5', unit='kg')
+    response = client.get(reverse('recipe_detail', args=[recipe.pk]), {'servings': 6})
+    assert 'mąka - 0.75 kg' in response.content.decode()
+
+
+@pytest.mark.django_db
+def test_recipe_detail_clamps_servings(client, recipe, ingredient):
+    """Liczba porcji jest ograniczana do MAX_SERVINGS, więc nie tworzy dowolnie wielu wpisów w pamięci podręcznej."""
+    IngredientInRecipe.objects.create(recipe=recipe, ingredient=ingredient, amount='0.5', unit='kg')
+    for servings in ('101', '9' * 25):
+        response = client.get(reverse('recipe_detail', args=[recipe.pk]), {'servings': servings})
+        assert response.status_code == 200
+        assert f'na {views.MAX_SERVINGS} porcji' in response.content.decode()
+
+
+@pytest.mark.django_db
+def test_shopping_list_aggregates_quantities_in_one_query(client, user, ingredient, django_assert_num_queries):
+    """Lista zakupów sumuje składniki wielu przepisów z mnożnikami i przelicza je na kg/l po agregacji."""
+    milk = Ingredient.objects.create(name='mleko')
+    recipes = _create_recipes(user, ingredient, 3)
+    IngredientInRecipe.objects.filter(recipe__in=recipes).update(quantity=400)
+    IngredientInRecipe.objects.create(recipe=recipes[0], ingredient=milk, amount='0.5', unit='l')
+    IngredientInRecipe.objects.create(recipe=recipes[1], ingredient=milk, amount=250, unit='ml')
+
+    params = {'recipe': [recipe.pk for recipe in recipes], 'multiplier': ['1', '2', '0,5']}
+    with django_assert_num_queries(1):
+        response = client.get(reverse('shopping_list_json'), params)
+    items = {item['ingredient']: (item['amount'], item['unit']) for item in response.json()['items']}
+    assert items == {'mleko': ('1', 'l'), 'mąka': ('1.4', 'kg')}
+
+
+@pytest.mark.django_db
+def test_shopping_list_keeps_plan_in_session(client, recipe, ingredient):
+    """Przepisy dodane do listy zakupów są pamiętane w sesji."""
+    IngredientInRecipe.objects.create(recipe=recipe, ingredient=ingredient, amount=200, unit='g')
+    client.post(reverse('shopping_list'), {'recipe': recipe.pk, 'multiplier': 2})
+    response = client.get(reverse('shopping_list'))
+    assert response.context['items'][0]['amount'] == Decimal('400')
+    client.post(reverse('shopping_list'), {'clear': 1})
+    assert client.get(reverse('shopping_list')).context['items'] == []
+
+
+@pytest.mark.django_db
+def test_shopping_list_drops_too_large_multipliers(client, user, ingredient):
+    """Mnożniki większe niż MAX_MULTIPLIER są pomijane, także w planie zapisanym w sesji."""
+    recipes = _create_recipes(user, ingredient, 3)
+    params = {'recipe': [recipe.pk for recipe in recipes], 'multiplier': ['1e30', '101', '100']}
+    assert shopping.parse_plan(params['recipe'], params['multiplier']) == {recipes[2].pk: 100}
+    assert shopping.parse_plan([recipes[0].pk, recipes[0].pk], ['60', '60']) == {recipes[0].pk: 60}
+
+    session = client.session
+    session[shopping.SESSION_KEY] = {str(recipes[0].pk): '1e30', str(recipes[1].pk): '2'}
+    session.save()
+    response = client.get(reverse('shopping_list'))
+    assert response.status_code == 200
+    assert len(response.context['items']) == 1
+
+
+@pytest.mark.django_db
+def test_shopping_list_skips_out_of_range_recipe_ids(client, recipe, ingredient):
+    """Id przepisów spoza zakresu klucza są pomijane w planie listy zakupów."""
+    IngredientInRecipe.objects.create(recipe=recipe, ingredient=ingredient, amount=200, unit='g')
+    assert shopping.parse_plan(['9' * 25, '0', '-3', recipe.pk], []) == {recipe.pk: 1}
+    response = client.get(reverse('shopping_list_json'), {'recipe': ['9' * 25, recipe.pk]})
+    assert response.status_code == 200
+    assert response.json()['recipes'] == {str(recipe.pk): '1'}
+
+
+@pytest.mark.django_db
+def test_recipe_detail_page_cache_is_invalidated_by_comments(client, user, recipe, django_capture_on_commit_callbacks,
+                                                              django_assert_max_num_queries):
+    """Strona przepisu dla niezalogowanych jest brana z pamięci podręcznej do czasu dodania komentarza."""
+    url = reverse('recipe_detail', args=[recipe.pk])
+    before = caching.stats()
+    client.get(url)
+    # tylko odczyt updated_at dla nagłówka ETag
+    with django_assert_max_num_queries(1):
+        client.get(url)
+    after = caching.stats()
+    assert after['page_hits'] == before['page_hits'] + 1
+    assert after['page_misses'] == before['page_misses'] + 1
+
+    with django_capture_on_commit_callbacks(execute=True):
+        Comment.objects.create(recipe=recipe, user=user, text='Nowy komentarz')
+    assert 'Nowy komentarz' in client.get(url).content.decode()
+
+
+@pytest.mark.django_db
+def test_recipe_detail_answers_conditional_get_until_recipe_changes(client, user, recipe, ingredient,
+                                                                    django_assert_max_num_queries):
+    """Strona przepisu z aktualnym ETagiem to 304 po jednym zapytaniu; nowy komentarz lub składnik zmienia ETag."""
+    url = reverse('recipe_detail', args=[recipe.pk])
+    response = client.get(url)
+    etag = response['ETag']
+    assert 'public' in response['Cache-Control']
+    with django_assert_max_num_queries(1):
+        assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 304
+
+    Comment.objects.create(recipe=recipe, user=user, text='Nowy komentarz')
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response['ETag'] != etag
+    etag = response['ETag']
+    IngredientInRecipe.objects.create(recipe=recipe, ingredient=ingredient, amount=1, unit='g')
+    assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 200
+
+    client.login(username='testuser', password='testpassword')
+    response = client.get(url)
+    assert 'private' in response['Cache-Control']
+    assert client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code == 304
+    client.logout()
+    assert client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code == 200
+
+
+@pytest.mark.django_db
+def test_recipe_detail_page_cache_follows_changes_from_other_processes(client, recipe):
+    """Zmiana zapisana poza tym procesem, bez unieważniania pamięci podręcznej, zmienia i ETag, i treść strony."""
+    url = reverse('recipe_detail', args=[recipe.pk])
+    etag = client.get(url)['ETag']
+    Recipe.objects.filter(pk=recipe.pk).update(title='Zmieniony tytuł', updated_at=timezone.now())
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response['ETag'] != etag
+    assert 'Zmieniony tytuł' in response.content.decode()
+
+
+@pytest.mark.django_db
+def test_recipe_detail_fragments_are_shared_with_logged_in_users(client, user, recipe):
+    """Zalogowany użytkownik dostaje stronę złożoną z zapamiętanych fragmentów, z własnym formularzem."""
+    client.login(username='testuser', password='testpassword')
+    url = reverse('recipe_detail', args=[recipe.pk])
+    client.get(url)
+    before = caching.stats()
+    response = client.get(url)
+    assert caching.stats()['fragment_hits'] == before['fragment_hits'] + 2
+    assert 'Dodaj komentarz' in response.content.decode()
+
+
+@pytest.mark.django_db
+def test_recipe_comments_are_paginated_from_newest(client, user, recipe):
+    """Strona przepisu pokazuje tylko najnowsze komentarze, a kolejne są ładowane fragmentami."""
+    Comment.objects.bulk_create([Comment(recipe=recipe, user=user, text=f'Komentarz {i}') for i in range(25)])
+    newest = list(Comment.objects.filter(recipe=recipe).order_by('-created_at', '-pk'))
+    content = client.get(reverse('recipe_detail', args=[recipe.pk])).content.decode()
+    assert newest[0].text + '<' in content
+    assert newest[20].text + '<' not in content
+
+    first = client.get(reverse('recipe_comments', args=[recipe.pk]))
+    assert [comment.pk for comment in first.context['comments']] == [comment.pk for comment in newest[:20]]
+    rest = client.get(reverse('recipe_comments', args=[recipe.pk]), {'after': first.context['next_cursor']})
+    assert [comment.pk for comment in rest.context['comments']] == [comment.pk for comment in newest[20:]]
+    assert rest.context['next_cursor'] is None
+
+
+@pytest.mark.django_db
+def test_ingredient_form_rejects_duplicate_name():
+    """Formularz składnika odrzuca nazwę istniejącą w innej wielkości liter."""
+    Ingredient.objects.create(name='Cukier')
+    form = IngredientForm(data={'name': 'CUKIER '})
+    assert not form.is_valid()
+
+
+def _assert_uses_index(queryset, *index_names):
+    """Sprawdza w planie zapytania, że baza korzysta z indeksu zamiast przeglądać całą tabelę."""
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            # na małych tabelach testowych planista i tak wybrałby skan sekwencyjny
+            cursor.execute('SET enable_seqscan = off')
+        plan = queryset.explain()
+        assert 'Seq Scan' not in plan
+    else:
+        plan = queryset.explain()
+        assert all(' USING ' in line for line in plan.splitlines() if 'SCAN ' in line), plan
+    assert any(name in plan for name in index_names), plan
+
+
+@pytest.mark.django_db
+def test_hot_queries_use_indexes(user, ingredient, recipe):
+    """Zapytania list, wyszukiwania składników i złączeń przepis-składnik korzystają z indeksów."""
+    _assert_uses_index(Recipe.objects.filter(author=user).order_by('-pk')[:20], 'recipe_author_id_idx')
+    _assert_uses_index(
+        Ingredient.objects.alias(upper_name=Upper('name')).filter(upper_name=Upper(Value('MĄKA'))),
+        'ingredient_name_upper_idx',
+    )
+    _assert_uses_index(
+        IngredientInRecipe.objects.filter(recipe=recipe),
+        # SQLite tworzy indeks ograniczenia unikalności pod własną nazwą
+        'unique_ingredient_unit_in_recipe', 'sqlite_autoindex_recipes_ingredientinrecipe',
+    )
+    _assert_uses_index(IngredientInRecipe.objects.filter(ingredient=ingredient), 'ingredient_recipe_idx')
+
+
+@pytest.mark.django_db
+def test_ingredient_unit_is_unique_per_recipe(recipe, ingredient):
+    """Ten sam składnik w tej samej jednostce nie może wystąpić w przepisie dwa razy."""
+    IngredientInRecipe.objects.create(recipe=recipe, ingredient=ingredient, unit='g', quantity=100)
+    with pytest.raises(IntegrityError), transaction.atomic():
+        IngredientInRecipe.objects.create(recipe=recipe, ingredient=ingredient, unit='g', quantity=50)
+
+
+@pytest.mark.django_db
+def test_api_recipe_list_is_cursor_paginated(client, user, ingredient):
+    """Lista przepisów w API zwraca kolejne strony po kursorze i nie dubluje przepisów."""
+    _create_recipes(user, ingredient, PAGE_SIZE + 5)
+    url = reverse('api_recipe_list')
+    first = client.get(url).json()
+    assert len(first['results']) == PAGE_SIZE
+    assert first['results'][0]['author_name'] == 'testuser'
+    second = client.get(url, {'after': first['next']}).json()
+    ids = [recipe['id'] for recipe in first['results'] + second['results']]
+    assert ids == sorted(Recipe.objects.values_list('pk', flat=True), reverse=True)
+    assert second['next'] is None
+
+
+@pytest.mark.django_db
+def test_api_recipe_detail_answers_304_after_one_query(client, recipe, ingredient, django_assert_num_queries,
+                                                       django_capture_on_commit_callbacks):
+    """Szczegóły przepisu mają ETag, a klient z aktualną wersją dostaje 304 po odczycie samego updated_at."""
+    with django_capture_on_commit_callbacks(execute=True):
+        IngredientInRecipe.objects.create(recipe=recipe, ingredient=ingredient, unit='kg', quantity=Decimal('1500'))
+    url = reverse('api_recipe_detail', args=[recipe.pk])
+    response = client.get(url)
+    assert response.json()['ingredients'] == [{'id': ingredient.pk, 'name': 'mąka', 'amount': '1.5', 'unit': 'kg'}]
+    assert response.has_header('Last-Modified')
+
+    with django_assert_num_queries(1):
+        assert client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code == 304
+
+    # zapis bez sygnałów, jak w innym procesie, który nie może unieważnić pamięci podręcznej tego
+    Recipe.objects.filter(pk=recipe.pk).update(title='Nowy tytuł', updated_at=timezone.now())
+    changed = client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+    assert changed.status_code == 200
+    assert changed.json()['title'] == 'Nowy tytuł'
+    assert client.get(reverse('api_recipe_detail', args=[recipe.pk + 1])).status_code == 404
+
+
+@pytest.mark.django_db
+def test_api_ingredient_list_changes_etag_after_new_ingredient(client, ingredient, django_capture_on_commit_callbacks):
+    """Dodanie i usunięcie składnika zmienia ETag listy składników."""
+    url = reverse('api_ingredient_list')
+    response = client.get(url)
+    assert response.json()['results'] == [{'id': ingredient.pk, 'name': 'mąka'}]
+    assert client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code == 304
+    with django_capture_on_commit_callbacks(execute=True):
+        sugar = Ingredient.objects.create(name='cukier')
+    response = client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+    assert response.status_code == 200
+    sugar.delete()
+    assert client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code == 200
+
+
+@pytest.mark.django_db
+def test_import_recipes_is_idempotent(tmp_path, user, ingredient, django_capture_on_commit_callbacks):
+    """Import pliku JSONL dodaje przepisy ze składnikami, a ponowny import niczego nie dubluje."""
+    path = tmp_path / 'recipes.jsonl'
+    path.write_text('\n'.join(json.dumps(record) for record in [
+        {'key': 'nalesniki', 'title': 'Naleśniki', 'author': 'testuser', 'preparation_time': '1 h',
+         'servings': 4, 'ingredients': [{'name': 'mąka', 'amount': '0,5', 'unit': 'kg'},
+                                        {'name': 'mleko', 'amount': '500', 'unit': 'ml'}]},
+        {'key': 'zupa', 'title': 'Zupa', 'author': 'nowy_autor', 'ingredients': []},
+    ]), encoding='utf-8')
+    for _ in range(2):
+        with django_capture_on_commit_callbacks(execute=True):
+            call_command('import_recipes', str(path), '--batch-size', '1', stdout=io.StringIO())
+    assert Recipe.objects.count() == 2
+    recipe = Recipe.objects.get(import_key='nalesniki')
+    assert (recipe.author, recipe.preparation_time, recipe.number) == (user, 60, 4)
+    assert {(row.ingredient.name, row.amount, row.unit) for row in recipe.ingredientinrecipe_set.all()} == {
+        ('mąka', Decimal('0.5'), 'kg'), ('mleko', Decimal('500'), 'ml')}
+    assert Ingredient.objects.filter(name='mąka').count() == 1
+    assert not User.objects.get(username='nowy_autor').has_usable_password()
+
+
+@pytest.mark.django_db
+def test_export_recipes_to_csv_can_be_imported(tmp_path, user, recipe, ingredient):
+    """Eksport do CSV zapisuje przepis w wierszu na składnik, a plik można zaimportować z powrotem."""
+    IngredientInRecipe.objects.create(recipe=recipe, ingredient=ingredient, unit='kg', quantity=Decimal('1500'))
+    path = tmp_path / 'recipes.csv'
+    call_command('export_recipes', '--output', str(path), '--chunk-size', '1', stderr=io.StringIO())
+    content = path.read_text(encoding='utf-8')
+    assert f'recipe:{recipe.pk},Test Recipe,Test Instructions,30,45,4,testuser,mąka,1.5,kg' in content
+    Recipe.objects.all().delete()
+    call_command('import_recipes', str(path), stdout=io.StringIO())
+    imported = Recipe.objects.get()
+    assert (imported.title, imported.total_time) == ('Test Recipe', 75)
+    assert imported.ingredientinrecipe_set.get().quantity == Decimal('1500')
+
+
+def test_fold_removes_polish_diacritics():
+    """Klucz wyszukiwania podpowiedzi nie zależy od wielkości liter ani polskich znaków."""
+    assert fold('  Łosoś  Wędzony ') == 'losos wedzony'
+    assert fold('ŻÓŁĆ') == 'zolc'
+
+
+@pytest.mark.django_db
+def test_ingredient_autocomplete_matches_prefix_without_diacritics(client, django_capture_on_commit_callbacks):
+    """Podpowiedzi znajdują składniki po początku nazwy lub słowa i od razu widzą nowe oraz zmienione składniki."""
+    Ingredient.objects.bulk_create([Ingredient(name=name) for name in ['mąka pszenna', 'makaron', 'łosoś', 'masło']])
+    ingredient_index.build()
+    url = reverse('ingredient_autocomplete')
+    assert [item['name'] for item in client.get(url, {'q': 'MAK'}).json()['results']] == ['mąka pszenna', 'makaron']
+    assert [item['name'] for item in client.get(url, {'q': 'psz'}).json()['results']] == ['mąka pszenna']
+
+    with django_capture_on_commit_callbacks(execute=True):
+        salmon = Ingredient.objects.create(name='łopatka')
+    assert [item['id'] for item in client.get(url, {'q': 'lo'}).json()['results']][0] == salmon.pk
+    with django_capture_on_commit_callbacks(execute=True):
+        salmon.name = 'szynka'
+        salmon.save()
+    assert salmon.pk not in [item['id'] for item in client.get(url, {'q': 'lo'}).json()['results']]
+    assert client.get(url, {'q': ''}).json()['results'] == []
+
+
+@pytest.mark.django_db
+def test_add_recipe_page_does_not_embed_ingredients(client, user, ingredient):
+    """Formularz przepisu nie zawiera listy wszystkich składników, tylko pole z podpowiedziami."""
+    client.login(username='testuser', password='testpassword')
+    content = client.get(reverse('add_recipe')).content.decode()
+    assert ingredient.name not in content
+    assert reverse('ingredient_autocomplete') in content
+
+
+@pytest.mark.django_db
+def test_async_views_return_404_for_missing_recipe(client, recipe):
+    """Asynchroniczne widoki przepisu i komentarzy zwracają 404 dla nieistniejącego przepisu."""
+    assert client.get(reverse('recipe_detail', args=[recipe.pk + 1])).status_code == 404
+    assert client.get(reverse('recipe_comments', args=[recipe.pk + 1])).status_code == 404
+    assert client.get(reverse('recipe_comments', args=[recipe.pk])).status_code == 200
+
+
+@pytest.mark.django_db
+def test_metrics_endpoint_reports_latency_queries_and_size(client, recipe):
+    """Endpoint /metrics pokazuje w formacie Prometheusa czas, zapytania i rozmiar odpowiedzi każdego widoku."""
+    metrics.registry.reset()
+    response = client.get(reverse('recipe_comments', args=[recipe.pk]))
+    client.get(reverse('home'))
+    stats = metrics.registry.snapshot()['recipe_comments']
+    assert stats['count'] == 1
+    assert stats['queries'] == 2
+    assert stats['response_bytes'] == len(response.content)
+
+    content = client.get(reverse('metrics')).content.decode()
+    assert 'recipes_request_duration_seconds_count{view="recipe_comments"} 1' in content
+    assert 'recipes_request_db_queries_sum{view="recipe_comments"} 2' in content
+    assert 'recipes_response_size_bytes_total{view="home"}' in content
+    assert client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.1').status_code == 403
+
+
+@pytest.mark.django_db
+def test_generated_catalogue_passes_view_query_budgets(tmp_path):
+    """Wygenerowany katalog jest idempotentny, a główne widoki mieszczą się w budżetach zapytań."""
+    options = {'recipes': 20, 'ingredients': 30, 'users': 3, 'comments_per_recipe': 2, 'stdout': io.StringIO()}
+    call_command('generate_catalogue', **options)
+    call_command('generate_catalogue', **options)
+    assert Recipe.objects.count() == 20
+    assert IngredientInRecipe.objects.count() == 20 * 8
+
+    output = tmp_path / 'benchmark.json'
+    call_command('run_benchmarks', '--iterations', '1', '--output', str(output), stdout=io.StringIO())
+    report = json.loads(output.read_text())
+    assert report['recipes'] == 20
+    assert all(0 < result['queries'] <= result['query_budget'] for result in report['views'].values())
+
+
+@pytest.mark.django_db
+def test_counters_follow_comments_ingredients_and_recipes(client, user, recipe, ingredient):
+    """Liczniki komentarzy, składników i przepisów autora zmieniają się razem z zapisami i usunięciami."""
+    first = Comment.objects.create(recipe=recipe, user=user, text='Pierwszy')
+    second = Comment.objects.create(recipe=recipe, user=user, text='Drugi')
+    IngredientInRecipe.objects.create(recipe=recipe, ingredient=ingredient, amount=1, unit='g')
+    recipe.refresh_from_db()
+    assert (recipe.comment_count, recipe.ingredient_count) == (2, 1)
+    assert recipe.last_commented_at == second.created_at
+
+    second.delete()
+    recipe.refresh_from_db()
+    assert recipe.comment_count == 1
+    assert recipe.last_commented_at == first.created_at
+
+    client.login(username='testuser', password='testpassword')
+    other = Ingredient.objects.create(name='Pieprz')
+    client.post(reverse('recipe_edit', args=[recipe.pk]), {
+        'title': 'Test Recipe', 'instructions': 'Test', 'number': '4',
+        'ingredient': [other.pk], 'amount': [1], 'unit': ['g'],
+    })
+    recipe.refresh_from_db()
+    assert (recipe.comment_count, recipe.ingredient_count) == (1, 1)
+    assert AuthorStats.objects.get(user=user).recipe_count == 1
+    recipe.delete()
+    assert AuthorStats.objects.get(user=user).recipe_count == 0
+
+
+@pytest.mark.django_db
+def test_recipe_save_does_not_overwrite_counters(recipe, user):
+    """Zapis przepisu odczytanego przed dodaniem komentarza nie cofa licznika."""
+    stale = Recipe.objects.get(pk=recipe.pk)
+    Comment.objects.create(recipe=recipe, user=user, text='Komentarz')
+    stale.title = 'Nowy tytuł'
+    stale.save()
+    recipe.refresh_from_db()
+    assert (recipe.title, recipe.comment_count) == ('Nowy tytuł', 1)
+
+
+@pytest.mark.django_db
+def test_reconcile_counters_repairs_drift_and_popular_sort_uses_it(client, user, recipe):
+    """Polecenie reconcile_counters naprawia rozjechane liczniki, a sortowanie "popular" korzysta z nich."""
+    quiet = Recipe.objects.create(title='Cichy', instructions='-', author=user)
+    Comment.objects.bulk_create([Comment(recipe=recipe, user=user, text=str(i)) for i in range(3)])
+    Recipe.objects.filter(pk=quiet.pk).update(comment_count=7)
+    AuthorStats.objects.filter(user=user).update(recipe_count=0)
+
+    out = io.StringIO()
+    call_command('reconcile_counters', '--batch-size', '1', stdout=out)
+    assert 'przepisów: 2, autorów: 1' in out.getvalue()
+    assert list(Recipe.objects.order_by('pk').values_list('comment_count', flat=True)) == [3, 0]
+    assert AuthorStats.objects.get(user=user).recipe_count == 2
+
+    response = client.get(reverse('home'), {'sort': 'popular'})
+    assert [item.pk for item in response.context['recipes']] == [recipe.pk, quiet.pk]
+
+
+@pytest.mark.django_db
+def test_similar_recipes_are_ranked_by_shared_ingredients(client, user, django_capture_on_commit_callbacks):
+    """Podobne przepisy są liczone miarą Jaccarda po zmianie składników i pokazywane na stronie przepisu."""
+    flour, sugar, eggs, salt = Ingredient.objects.bulk_create([Ingredient(name=name) for name in
+                                                              ('Mąka', 'Cukier', 'Jajka', 'Sól')])
+    with django_capture_on_commit_callbacks(execute=True):
+        cake, pancakes, bread, soup = [Recipe.objects.create(title=title, instructions='-', author=user)
+                                       for title in ('Ciasto', 'Naleśniki', 'Chleb', 'Zupa')]
+        for recipe, ingredients in ((cake, [flour, sugar, eggs]), (pancakes, [flour, eggs]),
+                                    (bread, [flour, salt]), (soup, [salt])):
+            for ingredient in ingredients:
+                IngredientInRecipe.objects.create(recipe=recipe, ingredient=ingredient, amount=1, unit='g')
+
+    scores = dict(SimilarRecipe.objects.filter(recipe=cake).values_list('similar_id', 'score'))
+    assert scores == {pancakes.pk: pytest.approx(2 / 3), bread.pk: pytest.approx(1 / 4)}
+    content = client.get(reverse('recipe_detail', args=[cake.pk])).content.decode()
+    assert content.index('Naleśniki') < content.index('Chleb')
+
+    with django_capture_on_commit_callbacks(execute=True):
+        IngredientInRecipe.objects.create(recipe=soup, ingredient=flour, amount=1, unit='g')
+    assert set(SimilarRecipe.objects.filter(recipe=soup).values_list('similar_id', flat=True)) == {
+        cake.pk, pancakes.pk, bread.pk}
+    # lista ciasta zmienia się dopiero po pełnym przeliczeniu
+    assert soup.pk not in SimilarRecipe.objects.filter(recipe=cake).values_list('similar_id', flat=True)
+    call_command('rebuild_similar_recipes', '--batch-size', '2', stdout=io.StringIO())
+    assert soup.pk in SimilarRecipe.objects.filter(recipe=cake).values_list('similar_id', flat=True)
+
+
+def test_similar_recipes_survive_drifted_ingredient_count():
+    """Przepis z licznikiem składników rozjechanym do zera nadal dostaje podobne przepisy."""
+    from .similar import IngredientMatrix
+
+    matrix = IngredientMatrix([(1, 10, 0), (1, 20, 1), (1, 30, 2), (2, 30, 2)])
+    assert matrix.neighbours(10, {1}, 1) == [(1.0, 20)]
+
+
+@pytest.mark.django_db
+def test_similar_recipes_from_worker_replace_cached_anonymous_page(client, user, settings, ingredient,
+                                                                   django_capture_on_commit_callbacks):
+    """Strona zapamiętana, zanim worker policzył podobne przepisy, pokazuje je po jego zakończeniu."""
+    settings.TASKS_EAGER = False
+    cake, pancakes = [Recipe.objects.create(title=title, instructions='-', author=user)
+                      for title in ('Ciasto', 'Naleśniki')]
+    with django_capture_on_commit_callbacks(execute=True):
+        for recipe in (cake, pancakes):
+            IngredientInRecipe.objects.create(recipe=recipe, ingredient=ingredient, amount=1, unit='g')
+    url = reverse('recipe_detail', args=[cake.pk])
+    assert 'Naleśniki' not in client.get(url).content.decode()
+
+    tasks.run_pending('worker')
+    assert 'Naleśniki' in client.get(url).content.decode()
+
+
+@pytest.mark.django_db
+def test_collected_static_files_are_hashed_precompressed_and_immutable(client, settings, tmp_path):
+    """collectstatic tworzy pliki z sumą w nazwie i warianty .gz, a widok wysyła je z nagłówkiem immutable."""
+    settings.STATIC_ROOT = tmp_path
+    call_command('collectstatic', interactive=False, verbosity=0)
+    staticfiles_storage = storage.staticfiles_storage
+    hashed = staticfiles_storage.stored_name('recipes/css/styles.css')
+    assert hashed != 'recipes/css/styles.css'
+    assert (tmp_path / f'{hashed}.gz').exists()
+    assert staticfiles_storage.url('recipes/css/styles.css') in client.get(reverse('register')).content.decode()
+
+    response = client.get(f'/static/{hashed}', HTTP_ACCEPT_ENCODING='gzip, br;q=0')
+    assert response['Content-Encoding'] == 'gzip'
+    assert response['Cache-Control'] == 'public, max-age=31536000, immutable'
+    assert response['Vary'] == 'Accept-Encoding'
+    assert gzip.decompress(b''.join(response.streaming_content)) == (tmp_path / hashed).read_bytes()
+
+    plain = client.get('/static/recipes/css/styles.css')
+    assert 'Content-Encoding' not in plain
+    assert 'immutable' not in plain['Cache-Control']
+    assert client.get('/static/../settings.py').status_code == 404
+
+
+@tasks.task
+def _flaky_task(marker):
+    """Zadanie testowe, które za pierwszym razem się nie udaje."""
+    if not cache.get(marker):
+        cache.set(marker, True)
+        raise RuntimeError('pierwsza próba')
+
+
+@pytest.mark.django_db(transaction=True)
+def test_task_queue_deduplicates_and_runs_after_commit(settings, user, django_capture_on_commit_callbacks):
+    """Zmiany przepisu trafiają do kolejki po zatwierdzeniu jako jedno zadanie na funkcję, wykonywane przez workera."""
+    settings.TASKS_EAGER = False
+    with django_capture_on_commit_callbacks(execute=True):
+        recipe = Recipe.objects.create(title='Kolejkowa zupa', instructions='-', author=user)
+        recipe.title = 'Kolejkowa zupa pomidorowa'
+        recipe.save()
+    tasks.enqueue(tasks.TASKS['recipes.search.refresh_index'], [recipe.pk])
+    assert list(Task.objects.values_list('name', 'args')) == [('recipes.search.refresh_index', [[recipe.pk]])]
+
+    out = io.StringIO()
+    call_command('run_worker', '--once', '--concurrency', '1', stdout=out)
+    assert 'Wykonane zadania: 1' in out.getvalue()
+    assert not Task.objects.exists()
+    assert Client().get(reverse('search'), {'q': 'pomidorowa'}).context['results'] == [recipe]
+
+
+@pytest.mark.django_db
+def test_failed_task_is_retried_with_backoff(settings):
+    """Nieudane zadanie wraca do kolejki z opóźnieniem, a po wyczerpaniu prób zostaje oznaczone jako nieudane."""
+    settings.TASKS_EAGER = False
+    tasks.enqueue(_flaky_task, 'flaky', max_attempts=2)
+    assert tasks.run_pending('test') == (0, 1)
+    task = Task.objects.get()
+    assert task.status == Task.PENDING and task.run_at > task.created_at and 'pierwsza próba' in task.last_error
+    assert tasks.run_pending('test') == (0, 0)
+
+    Task.objects.update(run_at=task.created_at)
+    assert tasks.run_pending('test') == (1, 0)
+    assert not Task.objects.exists()
+
+    Task.objects.create(name='nieznane', dedup_key='x', run_at=task.created_at)
+    assert tasks.run_pending('test') == (0, 1)
+    assert Task.objects.get().status == Task.FAILED
+
+
+@pytest.mark.django_db
+def test_recipe_photo_gets_idempotent_thumbnails_and_srcset(client, user, settings, tmp_path,
+                                                           django_capture_on_commit_callbacks):
+    """Przesłane zdjęcie dostaje miniatury WebP i JPEG, a lista przepisów pokazuje tylko je przez srcset."""
+    from PIL import Image
+    from .photos import generate_thumbnails, render_thumbnails
+
+    settings.MEDIA_ROOT = tmp_path
+    buffer = io.BytesIO()
+    Image.new('RGB', (800, 600), 'orange').save(buffer, 'JPEG')
+    photo = SimpleUploadedFile('ciasto.jpg', buffer.getvalue(), content_type='image/jpeg')
+    client.login(username='testuser', password='testpassword')
+    with django_capture_on_commit_callbacks(execute=True):
+        client.post(reverse('add_recipe'), {'title': 'Ciasto ze zdjęciem', 'instructions': '-', 'preparation_time': 10,
+                                            'cooking_time': 20, 'number': 4, 'photo': photo})
+
+    recipe = Recipe.objects.get()
+    assert recipe.photo_hash == hashlib.sha256(buffer.getvalue()).hexdigest()
+    assert recipe.thumbnails_hash == recipe.photo_hash
+    assert recipe.photo.name == f'photos/{recipe.photo_hash[:2]}/{recipe.photo_hash}.jpg'
+    thumbnails = sorted(path.name for path in (tmp_path / 'thumbnails').rglob('*.*'))
+    assert thumbnails == ['320.jpg', '320.webp', '640.jpg', '640.webp']
+
+    content = client.get(reverse('home')).content.decode()
+    assert '640.webp 640w' in content and 'sizes="320px"' in content
+    assert recipe.photo.url not in content
+    assert render_thumbnails(recipe.photo.name, recipe.photo_hash) == 0
+    generate_thumbnails([recipe.pk])
+    assert len(list((tmp_path / 'thumbnails').rglob('*.*'))) == 4
+
+
+@pytest.mark.django_db
+def test_thumbnails_from_worker_replace_cached_anonymous_page(client, user, recipe, settings, tmp_path,
+                                                              django_capture_on_commit_callbacks):
+    """Strona zapamiętana przed zrobieniem miniatur przez worker dostaje je bez unieważniania w procesie WWW."""
+    from PIL import Image
+
+    settings.MEDIA_ROOT = tmp_path
+    settings.TASKS_EAGER = False
+    buffer = io.BytesIO()
+    Image.new('RGB', (800, 600), 'orange').save(buffer, 'JPEG')
+    with django_capture_on_commit_callbacks(execute=True):
+        recipe.photo = SimpleUploadedFile('ciasto.jpg', buffer.getvalue(), content_type='image/jpeg')
+        recipe.save()
+    url = reverse('recipe_detail', args=[recipe.pk])
+    assert '640.webp' not in client.get(url).content.decode()
+
+    tasks.run_pending('worker')
+    assert '640.webp 640w' in client.get(url).content.decode()
+
+
+def test_replica_reads_stick_to_primary_after_write(rf, settings, monkeypatch):
+    """Oznaczony widok czyta z repliki, a po zapisie ciasteczko kieruje odczyty użytkownika do bazy głównej."""
+    settings.DATABASE_REPLICAS = ['replica']
+    monkeypatch.setattr(routing, '_healthy', lambda alias: True)
+    router = routing.PrimaryReplicaRouter()
+    seen = []
+
+    @routing.replica_reads
+    def view(request):
+        seen.append((router.db_for_read(Recipe), router.db_for_read(User)))
+        if request.method == 'POST':
+            router.db_for_write(Comment)
+            seen.append((router.db_for_read(Recipe), router.db_for_read(User)))
+        return HttpResponse()
+
+    middleware = routing.ReplicaRoutingMiddleware(
+        lambda request: middleware.process_view(request, view, (), {}) or view(request))
+    assert routing.PRIMARY_COOKIE not in middleware(rf.get('/')).cookies
+    response = middleware(rf.post('/'))
+    assert seen == [('replica', 'default'), ('default', 'default'), ('default', 'default')]
+
+    seen.clear()
+    request = rf.get('/')
+    request.COOKIES[routing.PRIMARY_COOKIE] = response.cookies[routing.PRIMARY_COOKIE].value
+    middleware(request)
+    assert seen == [('default', 'default')]
+    assert router.db_for_read(Recipe) == 'default'
+
+
+@pytest.mark.django_db
+def test_recipe_fragments_are_keyed_by_updated_at_read_from_the_database(client, user, recipe):
+    """Fragment jest wymieniany dopiero, gdy baza, z której jest renderowany, widzi nowy updated_at przepisu."""
+    client.login(username='testuser', password='testpassword')
+    url = reverse('recipe_detail', args=[recipe.pk])
+    client.get(url)
+    # komentarz bez zmiany updated_at, jak na replice, do której dotarła tylko część zmian
+    Comment.objects.bulk_create([Comment(recipe=recipe, user=user, text='Z repliki')])
+    assert 'Z repliki' not in client.get(url).content.decode()
+    Recipe.objects.filter(pk=recipe.pk).touch()
+    assert 'Z repliki' in client.get(url).content.decode()
+
+
+@pytest.mark.django_db
+def test_deleted_recipe_is_hidden_and_purged_in_batches(client, user, recipe, ingredient):
+    """Usunięty przepis znika z widoków od razu, a jego wiersze usuwa dopiero purge_deleted, paczkami."""
+    IngredientInRecipe.objects.create(recipe=recipe, ingredient=ingredient, amount=1, unit='g')
+    Comment.objects.bulk_create([Comment(recipe=recipe, user=user, text=str(i)) for i in range(5)])
+    kept = Recipe.objects.create(title='Zostaje', instructions='-', author=user)
+    SimilarRecipe.objects.create(recipe=kept, similar=recipe, score=0.5)
+    client.login(username='testuser', password='testpassword')
+    client.post(reverse('recipe_delete', args=[recipe.pk]))
+
+    assert list(Recipe.objects.all()) == [kept] and Recipe.all_objects.get(pk=recipe.pk).deleted_at is not None
+    assert 'Test Recipe' not in client.get(reverse('recipe_detail', args=[kept.pk])).content.decode()
+    assert client.get(reverse('recipe_detail', args=[recipe.pk])).status_code == 404
+    assert recipe.title not in client.get(reverse('home')).content.decode()
+    assert AuthorStats.objects.get(user=user).recipe_count == 1
+    assert Comment.objects.count() == 5
+
+    call_command('purge_deleted', '--days', '1', stdout=io.StringIO())
+    assert Recipe.all_objects.filter(pk=recipe.pk).exists()
+    call_command('purge_deleted', '--days', '0', '--batch-size', '2', stdout=io.StringIO())
+    assert list(Recipe.all_objects.all()) == [kept]
+    assert not Comment.objects.exists() and not IngredientInRecipe.objects.exists()
+    assert not SimilarRecipe.objects.exists()
+
+
+@pytest.mark.django_db
+def test_deleted_account_is_deactivated_then_purged(client, user, recipe):
+    """Usunięcie konta dezaktywuje je i ukrywa przepisy; purge_deleted usuwa konto i jego komentarze pod cudzymi przepisami."""
+    other = Recipe.objects.create(title='Cudzy', instructions='-',
+                                  author=User.objects.create_user(username='inny', password='haslo'))
+    Comment.objects.create(recipe=other, user=user, text='Smaczne')
+    client.login(username='testuser', password='testpassword')
+    client.post(reverse('account_delete'))
+
+    user.refresh_from_db()
+    assert not user.is_active and DeletedAccount.objects.filter(user=user).exists()
+    assert list(Recipe.objects.values_list('pk', flat=True)) == [other.pk]
+    assert not client.login(username='testuser', password='testpassword')
+
+    call_command('purge_deleted', '--days', '0', stdout=io.StringIO())
+    assert not User.objects.filter(username='testuser').exists()
+    assert not Recipe.all_objects.filter(pk=recipe.pk).exists()
+    other.refresh_from_db()
+    assert other.comment_count == 0
+
+
+@pytest.mark.django_db
+def test_new_comments_are_streamed_as_fragments(client, user, recipe, settings, monkeypatch,
+                                               django_capture_on_commit_callbacks):
+    """Komentarz wysłany przez AJAX wraca jako sam fragment i trafia do strumienia SSE, tak jak komentarz z innego procesu."""
+    settings.LIVE_COMMENTS_POLL_INTERVAL = 0
+    monkeypatch.setattr(live, 'broker', live.CommentBroker())
+    client.login(username='testuser', password='testpassword')
+
+    def post_comment():
+        with django_capture_on_commit_callbacks(execute=True):
+            return client.post(reverse('recipe_detail', args=[recipe.pk]), {'text': 'Na żywo'},
+                               HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+    async def watch():
+        events = live.stream(recipe.pk)
+        assert await anext(events) == f'retry: {live.RECONNECT_MS}\n\n'
+        pending = asyncio.ensure_future(anext(events))
+        response = await sync_to_async(post_comment)()
+        posted = await asyncio.wait_for(pending, 5)
+        # komentarz zapisany bez sygnałów, jak w innym procesie, znajduje odpytywanie bazy
+        await sync_to_async(live.broker.poll)()
+        await Comment.objects.abulk_create([Comment(recipe=recipe, user=user, text='Z innego procesu')])
+        await sync_to_async(live.broker.poll)()
+        polled = await asyncio.wait_for(anext(events), 5)
+        await events.aclose()
+        return response, posted, polled
+
+    response, posted, polled = async_to_sync(watch)()
+    first, second = Comment.objects.order_by('pk')
+    assert response.status_code == 201
+    assert response.content.decode().strip() == f'<li id="comment-{first.pk}"><strong>testuser</strong>: Na żywo</li>'
+    assert posted == f'id: {first.pk}\nevent: comment\ndata: {response.content.decode().strip()}\n\n'
+    assert polled.startswith(f'id: {second.pk}\n') and 'Z innego procesu' in polled
+    assert not live.broker.watched()
+    assert client.get(reverse('recipe_comment_stream', args=[recipe.pk + 1])).status_code == 404
+
+
+@pytest.mark.django_db
+def test_comment_stream_ends_on_disconnect_and_is_off_under_wsgi(client, recipe, settings, monkeypatch):
+    """Pod WSGI strumień od razu zwraca 204, a pod ASGI kończy się, gdy przeglądarka się rozłączy."""
+    from django.core.asgi import get_asgi_application
+
+    settings.LIVE_COMMENTS_POLL_INTERVAL = 0
+    monkeypatch.setattr(live, 'broker', live.CommentBroker())
+    url = reverse('recipe_comment_stream', args=[recipe.pk])
+    assert client.get(url).status_code == 204
+    assert 'EventSource' not in client.get(reverse('recipe_detail', args=[recipe.pk])).content.decode()
+
+    async def watch():
+        sent, first_event = [], asyncio.Event()
+        messages = iter([{'type': 'http.request', 'body': b'', 'more_body': False}])
+
+        async def receive():
+            # po pierwszym zdarzeniu przeglądarka zamyka połączenie
+            for message in messages:
+                return message
+            await first_event.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+            if message['type'] == 'http.response.body' and message.get('body'):
+                first_event.set()
+
+        scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                 'scheme': 'http', 'path': url, 'raw_path': url.encode(), 'query_string': b'', 'headers': [],
+                 'client': ('127.0.0.1', 1234), 'server': ('testserver', 80)}
+        await asyncio.wait_for(get_asgi_application()(scope, receive, send), 5)
+        return sent
+
+    sent = async_to_sync(watch)()
+    assert sent[0]['status'] == 200
+    assert sent[1]['body'] == f'retry: {live.RECONNECT_MS}\n\n'.encode()
+    assert not live.broker.watched()
@@ -0,0 +1,205 @@
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+from itertools import groupby, islice
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+from . import autocomplete, counters, units
+from .durations import parse_minutes, parse_servings
+from .models import Ingredient, IngredientInRecipe, Recipe
+from .signals import ingredients_changed
+
+FORMATS = ('jsonl', 'csv')
+CSV_FIELDS = ['key', 'title', 'instructions', 'preparation_time', 'cooking_time', 'servings', 'author',
+              'ingredient', 'amount', 'unit']
+RECIPE_FIELDS = CSV_FIELDS[:7]
+
+
+def guess_format(path, default='jsonl'):
+    """Rozpoznaje format pliku po rozszerzeniu."""
+    return 'csv' if str(path).lower().endswith('.csv') else default
+
+
+def _read_jsonl(stream):
+    for line_number, line in enumerate(stream, 1):
+        if line.strip():
+            try:
+                yield line_number, json.loads(line)
+            except ValueError as error:
+                raise ValidationError(f'Wiersz {line_number}: nieprawidłowy JSON ({error}).')
+
+
+def _read_csv(stream):
+    """Składa przepis z kolejnych wierszy CSV o tym samym kluczu, po jednym wierszu na składnik."""
+    rows = enumerate(csv.DictReader(stream), 2)
+    for key, group in groupby(rows, key=lambda row: row[1].get('key')):
+        group = list(group)
+        line_number, first = group[0]
+        record = {field: first.get(field) for field in RECIPE_FIELDS}
+        record['ingredients'] = [
+            {'name': row['ingredient'], 'amount': row.get('amount'), 'unit': row.get('unit')}
+            for _, row in group if row.get('ingredient')
+        ]
+        yield line_number, record
+
+
+def read_records(stream, format='jsonl'):
+    """Czyta przepisy strumieniowo i zwraca pary (numer wiersza, słownik przepisu)."""
+    return _read_csv(stream) if format == 'csv' else _read_jsonl(stream)
+
+
+def _clean_record(line_number, record):
+    """Sprawdza i normalizuje przepis z pliku; ilości składników są przeliczane na jednostki bazowe."""
+    def error(message):
+        return ValidationError(f'Wiersz {line_number}: {message}')
+
+    if not isinstance(record, dict):
+        raise error('oczekiwano obiektu przepisu.')
+    key, title, author = (str(record.get(field) or '').strip() for field in ('key', 'title', 'author'))
+    if not key or not title or not author:
+        raise error('przepis musi mieć klucz, tytuł i autora.')
+    rows = {}
+    for item in record.get('ingredients') or []:
+        name, unit = str(item.get('name') or '').strip(), item.get('unit')
+        if not name or unit not in units.UNITS:
+            raise error(f'nieprawidłowy składnik {item!r}.')
+        try:
+            amount = Decimal(str(item.get('amount')).replace(',', '.'))
+        except InvalidOperation:
+            raise error(f'nieprawidłowa ilość składnika {name}.')
+        if not amount.is_finite() or amount <= 0:
+            raise error(f'ilość składnika {name} musi być większa od zera.')
+        try:
+            quantity = rows.get((name, unit), 0) + units.to_base(amount, unit)
+        except ValidationError:
+            quantity = None
+        if quantity is None or quantity > units.MAX_QUANTITY:
+            raise error(f'ilość składnika {name} jest zbyt duża.')
+        rows[name, unit] = quantity
+    return {
+        'key': key,
+        'title': title,
+        'instructions': record.get('instructions') or '',
+        'preparation_time': parse_minutes(record.get('preparation_time')),
+        'cooking_time': parse_minutes(record.get('cooking_time')),
+        'number': parse_servings(record.get('servings')),
+        'author': author,
+        'ingredients': rows,
+    }
+
+
+def _get_or_create(model, field, values, **defaults):
+    """Zwraca słownik wartość -> id, tworząc brakujące obiekty jednym bulk_create, oraz listę id nowych obiektów."""
+    found = dict(model.objects.filter(**{f'{field}__in': values}).values_list(field, 'pk'))
+    missing = [value for value in values if value not in found]
+    created = {}
+    if missing:
+        model.objects.bulk_create([model(**{field: value}, **defaults) for value in missing], ignore_conflicts=True)
+        created = dict(model.objects.filter(**{f'{field}__in': missing}).values_list(field, 'pk'))
+        found.update(created)
+    return found, list(created.values())
+
+
+def _import_batch(records):
+    """Zapisuje paczkę przepisów w jednej transakcji i zwraca liczbę nowych przepisów.
+
+    Przepisy, których klucz jest już w bazie, są pomijane, więc ponowny import
+    tego samego pliku niczego nie zmienia ani nie przywraca usuniętych przepisów.
+    """
+    with transaction.atomic():
+        existing = set(Recipe.all_objects.filter(import_key__in=[record['key'] for record in records])
+                       .values_list('import_key', flat=True))
+        new = {}
+        for record in records:
+            if record['key'] not in existing:
+                new.setdefault(record['key'], record)
+        if not new:
+            return 0
+
+        # nowi autorzy dostają nieużywalne hasło, które mogą zresetować
+        authors, _ = _get_or_create(User, 'username', sorted({record['author'] for record in new.values()}),
+                                    password=make_password(None))
+        names = sorted({name for record in new.values() for name, _ in record['ingredients']})
+        ingredients, created = _get_or_create(Ingredient, 'name', names)
+        if created:
+            autocomplete.schedule_refresh(created)
+
+        Recipe.objects.bulk_create([
+            Recipe(import_key=key, title=record['title'], instructions=record['instructions'],
+                   preparation_time=record['preparation_time'], cooking_time=record['cooking_time'],
+                   number=record['number'], author_id=authors[record['author']])
+            for key, record in new.items()
+        ])
+        # klucze są odczytywane ponownie, bo nie każda baza zwraca id z bulk_create
+        recipe_ids = dict(Recipe.objects.filter(import_key__in=list(new)).values_list('import_key', 'pk'))
+        IngredientInRecipe.objects.bulk_create([
+            IngredientInRecipe(recipe_id=recipe_ids[key], ingredient_id=ingredients[name], unit=unit, quantity=quantity)
+            for key, record in new.items()
+            for (name, unit), quantity in record['ingredients'].items()
+        ])
+        # operacje zbiorcze pomijają sygnały, więc liczniki i zależne indeksy trzeba odświeżyć jawnie
+        counters.reconcile_recipes(list(recipe_ids.values()))
+        counters.reconcile_authors(sorted(set(authors.values())))
+        ingredients_changed(list(recipe_ids.values()))
+        return len(new)
+
+
+def import_records(records, batch_size=1000):
+    """Importuje przepisy paczkami po `batch_size` i po każdej paczce zwraca (przeczytane, nowe)."""
+    records = (_clean_record(line_number, record) for line_number, record in records)
+    while batch := list(islice(records, batch_size)):
+        yield len(batch), _import_batch(batch)
+
+
+def export_records(chunk_size=2000):
+    """Zwraca wszystkie przepisy ze składnikami w kolejności id, bez wczytywania ich naraz do pamięci.
+
+    Przepisy i składniki są czytane dwoma strumieniami posortowanymi po id przepisu
+    i łączone po drodze, więc zużycie pamięci nie zależy od liczby przepisów.
+    """
+    recipes = (Recipe.objects.order_by('pk')
+               .values_list('pk', 'import_key', 'title', 'instructions', 'preparation_time', 'cooking_time',
+                            'number', 'author__username')
+               .iterator(chunk_size=chunk_size))
+    rows = (IngredientInRecipe.objects.order_by('recipe_id', 'pk')
+            .values_list('recipe_id', 'ingredient__name', 'quantity', 'unit')
+            .iterator(chunk_size=chunk_size))
+    row = next(rows, None)
+    for pk, import_key, title, instructions, preparation_time, cooking_time, number, author in recipes:
+        ingredients = []
+        while row is not None and row[0] <= pk:
+            if row[0] == pk:
+                ingredients.append({'name': row[1], 'amount': units.from_base(row[2], row[3]), 'unit': row[3]})
+            row = next(rows, None)
+        yield {
+            'key': import_key or f'recipe:{pk}',
+            'title': title,
+            'instructions': instructions,
+            'preparation_time': preparation_time,
+            'cooking_time': cooking_time,
+            'servings': number,
+            'author': author,
+            'ingredients': ingredients,
+        }
+
+
+def write_records(records, stream, format='jsonl'):
+    """Zapisuje przepisy strumieniowo jako JSONL (przepis w wierszu) lub CSV (składnik w wierszu)."""
+    if format == 'csv':
+        writer = csv.DictWriter(stream, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        for record in records:
+            recipe = {field: record[field] for field in RECIPE_FIELDS}
+            for item in record['ingredients'] or [{}]:
+                writer.writerow({**recipe, 'ingredient': item.get('name'), 'amount': item.get('amount'),
+                                 'unit': item.get('unit')})
+            yield record
+    else:
+        for record in records:
+            stream.write(json.dumps(record, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n')
+            yield record
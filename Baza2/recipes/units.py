@@ -0,0 +1,55 @@
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+
+MASS = 'mass'
+VOLUME = 'volume'
+
+# jednostka: (rodzaj, liczba jednostek bazowych w jednej jednostce)
+UNITS = {
+    'g': (MASS, Decimal(1)),
+    'kg': (MASS, Decimal(1000)),
+    'ml': (VOLUME, Decimal(1)),
+    'l': (VOLUME, Decimal(1000)),
+}
+UNIT_CHOICES = [(unit, unit) for unit in UNITS]
+BASE_UNITS = {MASS: 'g', VOLUME: 'ml'}
+LARGE_UNITS = {MASS: 'kg', VOLUME: 'l'}
+QUANTITY_PRECISION = Decimal('0.001')
+# kolumna ilości to DecimalField(max_digits=15, decimal_places=3), czyli 12 cyfr przed przecinkiem
+MAX_QUANTITY = Decimal('999999999999.999')
+
+
+def family(unit):
+    """Zwraca rodzaj jednostki: masa albo objętość."""
+    return UNITS[unit][0]
+
+
+def factor(unit):
+    """Zwraca liczbę jednostek bazowych (g lub ml) w jednej podanej jednostce."""
+    return UNITS[unit][1]
+
+
+def to_base(amount, unit):
+    """Przelicza ilość w podanej jednostce na gramy lub mililitry.
+
+    Zgłasza ValidationError, gdy wynik nie zmieści się w kolumnie ilości.
+    """
+    amount = Decimal(amount)
+    # porównanie przed mnożeniem, bo bardzo duża ilość przekroczyłaby zakres samego Decimal
+    if not amount.is_finite() or amount.copy_abs() > MAX_QUANTITY / factor(unit):
+        raise ValidationError('Ilość składnika jest zbyt duża.')
+    return (amount * factor(unit)).quantize(QUANTITY_PRECISION)
+
+
+def from_base(quantity, unit):
+    """Przelicza ilość w gramach lub mililitrach na podaną jednostkę."""
+    return normalize(Decimal(quantity) / factor(unit))
+
+
+def normalize(value):
+    """Usuwa zbędne zera po przecinku, np. 1.500 -> 1.5 i 2.000 -> 2."""
+    value = Decimal(value)
+    if value == value.to_integral_value():
+        return value.quantize(Decimal(1))
+    return value.normalize()
@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import api, views
 
 
 urlpatterns = [
@@ -7,11 +7,23 @@ urlpatterns = [
     path('my_recipes/', views.my_recipes, name='my_recipes'),
     path('add_recipe/', views.add_recipe, name='add_recipe'),
     path('recipe/<int:pk>/', views.recipe_detail, name='recipe_detail'),
+    path('recipe/<int:pk>/comments/', views.recipe_comments, name='recipe_comments'),
+    path('recipe/<int:pk>/comments/stream/', views.recipe_comment_stream, name='recipe_comment_stream'),
     path('search/', views.search, name='search'),
+    path('pantry/', views.pantry, name='pantry'),
+    path('shopping_list/', views.shopping_list, name='shopping_list'),
+    path('shopping_list.json', views.shopping_list_json, name='shopping_list_json'),
     path('profile/', views.profile, name='profile'),
+    path('profile/delete/', views.account_delete, name='account_delete'),
     path('recipe/new/', views.recipe_new, name='recipe_new'),
     path('recipe_edit/<int:pk>/', views.recipe_edit, name='recipe_edit'),
     path('recipe_delete/<int:pk>/', views.recipe_delete, name='recipe_delete'),
     path('add_comment/<int:recipe_id>/', views.add_comment, name='add_comment'),
+    path('cache_stats.json', views.cache_stats, name='cache_stats'),
+    path('metrics', views.metrics, name='metrics'),
     path('ingredient_list/', views.ingredient_list, name='ingredient_list'),
+    path('ingredients/autocomplete/', views.ingredient_autocomplete, name='ingredient_autocomplete'),
+    path('api/v1/recipes/', api.recipe_list, name='api_recipe_list'),
+    path('api/v1/recipes/<int:pk>/', api.recipe_detail, name='api_recipe_detail'),
+    path('api/v1/ingredients/', api.ingredient_list, name='api_ingredient_list'),
 ]
@@ -1,13 +1,38 @@
-from django.contrib.auth import login
+import asyncio
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.shortcuts import render, get_object_or_404, redirect
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Max
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse
+from django.http import StreamingHttpResponse
+from django.shortcuts import aget_object_or_404, render, get_object_or_404, redirect
+from django.template.loader import render_to_string
 from django.urls import reverse_lazy
 from django.views.generic import DetailView, CreateView, UpdateView, DeleteView
 
+from . import autocomplete, caching, deletion, live
+from .caching import acached_fragment, arequest_version, cache_anonymous_page, conditional_page
 from .forms import CustomUserCreationForm, IngredientForm, IngredientInRecipeForm
-from .forms import RecipeForm, CommentForm
-from .models import Recipe, IngredientInRecipe, Ingredient
+from .forms import RecipeForm, CommentForm, RecipeFilterForm, SearchFilterForm
+from .models import AuthorStats, Recipe, Ingredient, Comment, SimilarRecipe
+from .metrics import render_prometheus
+from .pagination import akeyset_paginate, keyset_paginate, parse_id, parse_int, parse_page
+from .pantry import find_recipes
+from .routing import replica_reads
+from .search import asearch_recipes
+from .services import save_recipe_ingredients
+from .shopping import build_shopping_list, load_plan, parse_plan, save_plan
+
+COMMENTS_PAGE_SIZE = 20
+# każda liczba porcji ma własny fragment w pamięci podręcznej, więc zakres jest ograniczony
+MAX_SERVINGS = 100
 
 
 class RecipeDetailView(DetailView):
@@ -38,35 +63,243 @@ class RecipeDeleteView(LoginRequiredMixin, DeleteView):
     success_url = reverse_lazy('recipe_list')
 
 
-def home(request):
-    """Wyświetla stronę główną z listą wszystkich przepisów."""
-    recipes = Recipe.objects.all()
-    return render(request, 'recipes/home.html', {'recipes': recipes})
+def _query_string(request, *excluded):
+    """Zwraca parametry GET żądania bez podanych kluczy, gotowe do doklejenia do linku."""
+    params = request.GET.copy()
+    for key in excluded:
+        params.pop(key, None)
+    return params.urlencode()
+
+
+def _list_context(request, filter_form, recipes, next_cursor):
+    return {'recipes': recipes, 'next_cursor': next_cursor, 'filter_form': filter_form,
+            'query_string': _query_string(request, 'after')}
+
+
+def _recipe_list_context(request, queryset):
+    """Filtruje, sortuje i stronicuje kursorem listę przepisów według parametrów GET."""
+    filter_form = RecipeFilterForm(request.GET)
+    recipes, next_cursor = keyset_paginate(filter_form.filter(queryset).with_listing_data(),
+                                           after=request.GET.get('after'), ordering=filter_form.ordering())
+    return _list_context(request, filter_form, recipes, next_cursor)
+
+
+async def _arecipe_list_context(request, queryset):
+    """Asynchroniczna wersja `_recipe_list_context`."""
+    filter_form = RecipeFilterForm(request.GET)
+    recipes, next_cursor = await akeyset_paginate(filter_form.filter(queryset).with_listing_data(),
+                                                  after=request.GET.get('after'), ordering=filter_form.ordering())
+    return _list_context(request, filter_form, recipes, next_cursor)
+
+
+async def _arender(request, template_name, context):
+    """Renderuje stronę w wątku, bo procesory kontekstu, np. `user`, odpytują bazę synchronicznie.
+
+    Widok asynchroniczny musi przed renderowaniem pobrać wszystkie dane, żeby szablon nie wykonywał zapytań.
+    """
+    return await sync_to_async(render)(request, template_name, context)
 
 
-def recipe_detail(request, pk):
-    """Wyświetla szczegóły wybranego przepisu oraz umożliwia dodanie komentarza."""
-    recipe = Recipe.objects.get(pk=pk)
-    comments = recipe.comments.all()
+async def _recipe_updated_at(pk):
+    return await Recipe.objects.filter(pk=pk).values_list('updated_at', flat=True).afirst()
+
+
+async def _recipes_updated_at():
+    # także usunięte przepisy, bo ich usunięcie zmienia listy
+    return (await Recipe.all_objects.aaggregate(last=Max('updated_at')))['last']
+
+
+@replica_reads
+@conditional_page(_recipes_updated_at)
+async def home(request):
+    """Wyświetla stronę główną z listą przepisów, z filtrami zakresu i sortowaniem, stronicowaną kursorem."""
+    return await _arender(request, 'recipes/home.html', await _arecipe_list_context(request, Recipe.objects.all()))
+
+
+async def _recipe_body_html(recipe, servings, scale):
+    ingredient_rows = [row async for row in recipe.ingredientinrecipe_set.select_related('ingredient')
+                       .with_display_amounts(scale)]
+    return render_to_string('recipes/recipe_body.html',
+                            {'recipe': recipe, 'servings': servings, 'ingredient_rows': ingredient_rows,
+                             'max_servings': MAX_SERVINGS})
+
+
+async def _similar_recipes(recipe_id):
+    return [link async for link in SimilarRecipe.objects.filter(recipe_id=recipe_id, similar__deleted_at__isnull=True)
+            .select_related('similar').only('score', 'similar__title').order_by('-score', '-similar_id')]
+
+
+def _is_ajax(request):
+    return request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+
+
+def _comment_added_response(request, comment):
+    """Na żądanie AJAX zwraca tylko fragment nowego komentarza, w innym razie przekierowuje do przepisu."""
+    if _is_ajax(request):
+        return HttpResponse(live.render_comment(comment), status=201)
+    return redirect('recipe_detail', pk=comment.recipe_id)
+
+
+async def _comment_list_html(recipe_id):
+    return render_to_string('recipes/comment_list.html', await _comment_page_context(recipe_id))
+
+
+@replica_reads
+@conditional_page(_recipe_updated_at)
+@cache_anonymous_page(_recipe_updated_at)
+async def recipe_detail(request, pk):
+    """Wyświetla szczegóły wybranego przepisu oraz umożliwia dodanie komentarza.
+
+    Parametr `servings` przelicza ilości wszystkich składników na podaną liczbę porcji,
+    najwyżej MAX_SERVINGS.
+    Treść przepisu i lista komentarzy są brane z pamięci podręcznej, dopóki przepis się nie zmieni.
+    Przepis, komentarze i podobne przepisy, które od siebie nie zależą, są pobierane równolegle.
+    Komentarz wysłany przez AJAX dostaje w odpowiedzi tylko swój fragment HTML.
+    """
+    comment_form = CommentForm(request.POST if request.method == 'POST' else None)
+    if comment_form.is_valid():
+        recipe = await aget_object_or_404(Recipe, pk=pk)
+        comment = comment_form.save(commit=False)
+        comment.user = await request.auser()
+        comment.recipe = recipe
+        await comment.asave()
+        return _comment_added_response(request, comment)
+    if comment_form.is_bound and _is_ajax(request):
+        return HttpResponseBadRequest(comment_form.errors.as_ul())
+    # fragmenty są renderowane z tej samej bazy, z której pochodzi wersja w ich kluczach
+    updated_at = await arequest_version(request, _recipe_updated_at, pk=pk)
+    if updated_at is None:
+        raise Http404('Nie ma takiego przepisu.')
+    recipe, comments_html, similar_recipes = await asyncio.gather(
+        Recipe.objects.select_related('author').filter(pk=pk).afirst(),
+        acached_fragment(pk, updated_at, 'comments', lambda: _comment_list_html(pk)),
+        _similar_recipes(pk),
+    )
+    if recipe is None:
+        raise Http404('Nie ma takiego przepisu.')
+    servings = parse_int(request.GET.get('servings'))
+    servings = min(servings, MAX_SERVINGS) if servings else None
+    scale = Decimal(servings) / recipe.number if servings and servings > 0 and recipe.number else 1
+    servings = servings if scale != 1 else recipe.number
+    body_html = await acached_fragment(recipe.pk, updated_at, f'body:{scale}',
+                                       lambda: _recipe_body_html(recipe, servings, scale))
+    return await _arender(request, 'recipes/recipe_detail.html',
+                          {'recipe': recipe, 'comment_form': comment_form, 'body_html': body_html,
+                           'comments_html': comments_html, 'similar_recipes': similar_recipes,
+                           'live_comments': live.available(request)})
+
+
+async def _comment_page_context(recipe_id, after=None):
+    """Zwraca stronę komentarzy przepisu od najnowszych, stronicowaną kursorem po (created_at, id)."""
+    comments, next_cursor = await akeyset_paginate(
+        Comment.objects.filter(recipe_id=recipe_id).select_related('user'),
+        after=after, page_size=COMMENTS_PAGE_SIZE, ordering=('-created_at', '-pk'))
+    return {'comments': comments, 'next_cursor': next_cursor, 'recipe_id': recipe_id}
+
+
+@replica_reads
+async def recipe_comments(request, pk):
+    """Zwraca kolejną stronę komentarzy przepisu jako fragment HTML dla przycisku "Załaduj więcej"."""
+    exists, context = await asyncio.gather(
+        Recipe.objects.filter(pk=pk).aexists(),
+        _comment_page_context(pk, request.GET.get('after')),
+    )
+    if not exists:
+        raise Http404('Nie ma takiego przepisu.')
+    return await _arender(request, 'recipes/comment_items.html', context)
+
+
+async def recipe_comment_stream(request, pk):
+    """Strumień server-sent events, który wysyła nowe komentarze przepisu jako fragmenty HTML.
+
+    Wymaga serwera ASGI (Baza2/asgi.py), bo połączenie pozostaje otwarte bez zajmowania wątku.
+    Pod WSGI zwraca 204, po którym przeglądarka nie łączy się ponownie.
+    """
+    if not await Recipe.objects.filter(pk=pk).aexists():
+        raise Http404('Nie ma takiego przepisu.')
+    if not live.available(request):
+        return HttpResponse(status=204)
+    response = StreamingHttpResponse(live.stream(pk, parse_int(request.headers.get('Last-Event-ID'))),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # nginx nie buforuje odpowiedzi z tym nagłówkiem, więc zdarzenia docierają od razu
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@replica_reads
+@conditional_page(_recipes_updated_at)
+async def search(request):
+    """Umożliwia wyszukiwanie przepisów po tytule, instrukcjach i składnikach, z wynikami posortowanymi według trafności."""
+    query = request.GET.get('q')
+    page = parse_page(request.GET.get('page'))
+    filter_form = SearchFilterForm(request.GET)
+    queryset = filter_form.filter(Recipe.objects.all()) if filter_form.has_filters() else None
+    results, has_next = await asearch_recipes(query, page=page, queryset=queryset, ordering=filter_form.ordering())
+    return await _arender(request, 'recipes/search.html',
+                          {'results': results, 'query': query, 'page': page, 'has_next': has_next,
+                           'filter_form': filter_form, 'query_string': _query_string(request, 'page')})
+
+
+@replica_reads
+def pantry(request):
+    """Wyszukuje przepisy, które można przygotować z wybranych składników, zaczynając od najmniej brakujących."""
+    selected = {pk for pk in map(parse_id, request.GET.getlist('ingredient')) if pk is not None}
+    page = parse_page(request.GET.get('page'))
+    results, has_next = find_recipes(selected, page=page)
+    return render(request, 'recipes/pantry.html', {
+        'selected_ingredients': Ingredient.objects.filter(pk__in=selected).order_by('name'),
+        'selected': selected,
+        'results': results,
+        'page': page,
+        'has_next': has_next,
+        'query_string': _query_string(request, 'page'),
+    })
+
+
+def shopping_list(request):
+    """Wyświetla zbiorczą listę zakupów dla przepisów zaplanowanych w sesji.
+
+    POST z `recipe` i `multiplier` dodaje przepisy do planu, z `remove` usuwa przepis, a z `clear` czyści plan.
+    """
+    plan = load_plan(request.session)
     if request.method == 'POST':
-        comment_form = CommentForm(request.POST)
-        if comment_form.is_valid():
-            comment = comment_form.save(commit=False)
-            comment.user = request.user
-            comment.recipe = recipe
-            comment.save()
-            return redirect('recipe_detail', pk=recipe.pk)
+        if 'clear' in request.POST:
+            plan = {}
+        elif 'remove' in request.POST:
+            plan.pop(parse_int(request.POST['remove']), None)
+        else:
+            plan.update(parse_plan(request.POST.getlist('recipe'), request.POST.getlist('multiplier')))
+        save_plan(request.session, plan)
+        return redirect('shopping_list')
+    recipes = Recipe.objects.filter(pk__in=plan).only('title')
+    planned = [(recipe, plan[recipe.pk]) for recipe in recipes]
+    return render(request, 'recipes/shopping_list.html',
+                  {'planned': planned, 'items': build_shopping_list(plan)})
+
+
+def shopping_list_json(request):
+    """Zwraca listę zakupów w JSON dla przepisów z parametrów `recipe`/`multiplier` albo z planu w sesji."""
+    if 'recipe' in request.GET:
+        plan = parse_plan(request.GET.getlist('recipe'), request.GET.getlist('multiplier'))
     else:
-        comment_form = CommentForm()
-    return render(request, 'recipes/recipe_detail.html',
-                  {'recipe': recipe, 'comments': comments, 'comment_form': comment_form})
+        plan = load_plan(request.session)
+    items = [{**item, 'amount': str(item['amount'])} for item in build_shopping_list(plan)]
+    return JsonResponse({'recipes': {str(pk): str(multiplier) for pk, multiplier in plan.items()}, 'items': items})
 
 
-def search(request):
-    """Umożliwia wyszukiwanie przepisów na podstawie zapytania użytkownika."""
-    query = request.GET.get('q')
-    results = Recipe.objects.filter(title__icontains=query) if query else []
-    return render(request, 'recipes/search.html', {'results': results, 'query': query})
+def metrics(request):
+    """Zwraca statystyki żądań w formacie Prometheusa dla adresów z METRICS_ALLOWED_IPS lub dla administracji."""
+    allowed = getattr(settings, 'METRICS_ALLOWED_IPS', ['127.0.0.1', '::1'])
+    if request.META.get('REMOTE_ADDR') not in allowed and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@staff_member_required
+def cache_stats(request):
+    """Zwraca liczniki trafień i chybień pamięci podręcznej stron przepisów w tym procesie."""
+    return JsonResponse(caching.stats())
 
 
 def register(request):
@@ -84,15 +317,26 @@ def register(request):
 
 @login_required
 def profile(request):
-    """Wyświetla profil zalogowanego użytkownika."""
-    return render(request, 'recipes/profile.html')
+    """Wyświetla profil zalogowanego użytkownika z liczbą jego przepisów."""
+    recipe_count = AuthorStats.objects.filter(user=request.user).values_list('recipe_count', flat=True).first()
+    return render(request, 'recipes/profile.html', {'recipe_count': recipe_count or 0})
+
+
+@login_required
+def account_delete(request):
+    """Usuwa konto zalogowanego użytkownika po potwierdzeniu i wylogowuje go; dane usuwa później purge_deleted."""
+    if request.method == 'POST':
+        deletion.delete_account(request.user)
+        logout(request)
+        return redirect('home')
+    return render(request, 'recipes/account_delete.html')
 
 
 @login_required
 def recipe_new(request):
     """Tworzy nowy przepis na podstawie danych z formularza i przekierowuje do szczegółów przepisu."""
     if request.method == "POST":
-        form = RecipeForm(request.POST)
+        form = RecipeForm(request.POST, request.FILES)
         if form.is_valid():
             recipe = form.save()
             return redirect('recipe_detail', pk=recipe.pk)
@@ -104,52 +348,34 @@ def recipe_new(request):
 @login_required
 def recipe_edit(request, pk):
     """Edytuje istniejący przepis, jeśli użytkownik jest autorem, i zapisuje zmiany po zatwierdzeniu formularza."""
-    global ingredient_form
     recipe = get_object_or_404(Recipe, pk=pk)
     if request.user != recipe.author:
         return redirect('home')
 
     if request.method == 'POST':
-        form = RecipeForm(request.POST, instance=recipe)
-        if form.is_valid():
-            recipe = form.save(commit=False)
-            recipe.save()
-            form.save_m2m()
-
-            IngredientInRecipe.objects.filter(recipe=recipe).delete()
-
-            ingredients = request.POST.getlist('ingredient')
-            amounts = request.POST.getlist('amount')
-            units = request.POST.getlist('unit')
-            for i in range(len(ingredients)):
-                if ingredients[i] and amounts[i] and units[i]:
-                    ingredient = Ingredient.objects.get(id=ingredients[i])
-                    amount = amounts[i]
-                    unit = units[i]
-                    IngredientInRecipe.objects.create(
-                        recipe=recipe,
-                        ingredient=ingredient,
-                        amount=amount,
-                        unit=unit
-                    )
-
+        form = RecipeForm(request.POST, request.FILES, instance=recipe)
+        if form.is_valid() and _save_recipe_with_ingredients(request, form):
             return redirect('my_recipes')
     else:
         form = RecipeForm(instance=recipe)
-        ingredient_form = IngredientInRecipeForm()
+    ingredient_rows = recipe.ingredientinrecipe_set.select_related('ingredient')
     return render(request, 'recipes/recipe_edit.html',
-                  {'form': form, 'ingredient_form': ingredient_form, 'recipe': recipe})
+                  {'form': form, 'ingredient_form': IngredientInRecipeForm(), 'recipe': recipe,
+                   'ingredient_rows': ingredient_rows})
 
 
 @login_required
 def recipe_delete(request, pk):
-    """Usuwa przepis, jeśli użytkownik jest autorem, po potwierdzeniu przez użytkownika."""
+    """Usuwa przepis, jeśli użytkownik jest autorem, po potwierdzeniu przez użytkownika.
+
+    Usunięcie jest miękkie, więc komentarze i składniki usuwa później polecenie purge_deleted.
+    """
     recipe = get_object_or_404(Recipe, pk=pk)
     if request.user != recipe.author:
         return redirect('home')
 
     if request.method == 'POST':
-        recipe.delete()
+        deletion.delete_recipes(Recipe.objects.filter(pk=recipe.pk))
         return redirect('my_recipes')
 
     return render(request, 'recipes/recipe_delete.html', {'recipe': recipe})
@@ -157,7 +383,10 @@ def recipe_delete(request, pk):
 
 @login_required
 def add_comment(request, recipe_id):
-    """Dodaje nowy komentarz do przepisu na podstawie danych z formularza i przekierowuje do szczegółów przepisu."""
+    """Dodaje nowy komentarz do przepisu na podstawie danych z formularza i przekierowuje do szczegółów przepisu.
+
+    Żądanie AJAX dostaje w odpowiedzi tylko fragment HTML nowego komentarza.
+    """
     recipe = get_object_or_404(Recipe, pk=recipe_id)
     if request.method == 'POST':
         form = CommentForm(request.POST)
@@ -166,61 +395,54 @@ def add_comment(request, recipe_id):
             comment.recipe = recipe
             comment.user = request.user
             comment.save()
-            return redirect('recipe_detail', pk=recipe.pk)
+            return _comment_added_response(request, comment)
+        if _is_ajax(request):
+            return HttpResponseBadRequest(form.errors.as_ul())
     return redirect('recipe_detail', pk=recipe.pk)
 
 
+@replica_reads
 @login_required
 def my_recipes(request):
-    """Wyświetla stronę z przepisami zalogowanego użytkownika."""
-    recipes = Recipe.objects.filter(author=request.user)
-    return render(request, 'recipes/my_recipes.html', {'recipes': recipes})
+    """Wyświetla stronę z przepisami zalogowanego użytkownika, z filtrami zakresu i sortowaniem, stronicowaną kursorem."""
+    return render(request, 'recipes/my_recipes.html',
+                  _recipe_list_context(request, Recipe.objects.filter(author=request.user)))
 
 
 @login_required
 def add_recipe(request):
     """Umożliwia zalogowanemu użytkownikowi dodanie nowego przepisu."""
-    global ingredient_form
     if request.method == "POST":
-        form = RecipeForm(request.POST)
-        print("POST data:", request.POST)
+        form = RecipeForm(request.POST, request.FILES)
         if form.is_valid():
-            recipe = form.save(commit=False)
-            recipe.author = request.user
-            recipe.save()
-            form.save_m2m()
-
-            ingredients = request.POST.getlist('ingredient')
-            amounts = request.POST.getlist('amount')
-            units = request.POST.getlist('unit')
-
-            for i in range(len(ingredients)):
-                if ingredients[i] and amounts[i] and units[i]:
-                    ingredient = Ingredient.objects.get(id=ingredients[i])
-                    amount = amounts[i]
-                    unit = units[i]
-                    IngredientInRecipe.objects.create(
-                        recipe=recipe,
-                        ingredient=ingredient,
-                        amount=amount,
-                        unit=unit
-                    )
-
-            return redirect('home')
-        else:
-            print("Form is not valid. Errors:")
-            for field, errors in form.errors.items():
-                for error in errors:
-                    print(f"Field: {field} - Error: {error}")
+            form.instance.author = request.user
+            if _save_recipe_with_ingredients(request, form):
+                return redirect('home')
     else:
         form = RecipeForm()
-        ingredient_form = IngredientInRecipeForm()
 
-    return render(request, 'recipes/add_recipe.html', {'form': form, 'ingredient_form': ingredient_form})
+    return render(request, 'recipes/add_recipe.html', {'form': form, 'ingredient_form': IngredientInRecipeForm()})
 
 
+def _save_recipe_with_ingredients(request, form):
+    """Zapisuje przepis z formularza razem ze składnikami z POST w jednej transakcji.
+
+    Zwraca False i dopisuje błąd do formularza, jeśli składniki są nieprawidłowe.
+    """
+    try:
+        with transaction.atomic():
+            recipe = form.save()
+            save_recipe_ingredients(recipe, request.POST.getlist('ingredient'),
+                                    request.POST.getlist('amount'), request.POST.getlist('unit'))
+    except ValidationError as error:
+        form.add_error(None, error)
+        return False
+    return True
+
+
+@replica_reads
 def ingredient_list(request):
-    """Umożliwia użytkownikowi dodanie nowego składnika"""
+    """Umożliwia użytkownikowi dodanie nowego składnika i pokazuje składniki od najnowszych, stronicowane kursorem."""
     if request.method == "POST":
         form = IngredientForm(request.POST)
         if form.is_valid():
@@ -229,5 +451,13 @@ def ingredient_list(request):
     else:
         form = IngredientForm()
 
-    ingredients = Ingredient.objects.all()
-    return render(request, 'recipes/ingredient_list.html', {'form': form, 'ingredients': ingredients})
+    ingredients, next_cursor = keyset_paginate(Ingredient.objects.all(), after=request.GET.get('after'))
+    return render(request, 'recipes/ingredient_list.html',
+                  {'form': form, 'ingredients': ingredients, 'next_cursor': next_cursor,
+                   'query_string': _query_string(request, 'after')})
+
+
+def ingredient_autocomplete(request):
+    """Zwraca w JSON podpowiedzi składników, których nazwa zaczyna się od parametru `q`, bez względu na ogonki."""
+    limit = max(1, min(parse_int(request.GET.get('limit')) or 10, 50))
+    return JsonResponse({'results': autocomplete.suggest(request.GET.get('q', ''), limit)})